@@ -4,9 +4,10 @@ load_dotenv()
 # Añadir el directorio src al path de Python para importar deepagents
 import sys
 import os
+import asyncio
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'src'))
 
-from deepagents import create_deep_agent
+from deepagents import async_create_deep_agent
 from langchain_core.tools import tool
 from langchain_core.messages import HumanMessage
 
@@ -121,47 +122,53 @@ When analysis is too long for one response (8K token limit), you MUST:
 
 **The user gets: live narration + permanent documentation + comprehensive analysis across iterations!**"""
 
-# Herramientas para el agente
+def _write_text_file(file_path: str, content: str):
+    # Asegurar que el directorio existe
+    os.makedirs(os.path.dirname(file_path) if os.path.dirname(file_path) else '.', exist_ok=True)
+
+    with open(file_path, 'w', encoding='utf-8') as f:
+        f.write(content)
+
+def _read_text_file(file_path: str) -> str:
+    with open(file_path, 'r', encoding='utf-8') as f:
+        return f.read()
+
+# Herramientas para el agente (asíncronas: se ejecutan en el event loop sin ocupar hilos)
 @tool
-def web_search(query: str) -> str:
+async def web_search(query: str) -> str:
     """Busca información en la web. Nota: Funcionalidad limitada en modo de prueba."""
     return f"[MODO PRUEBA] Búsqueda simulada para: '{query}'\n\nEn modo completo, esto buscaría información real sobre tu consulta usando DuckDuckGo. Por ahora, basaré mi análisis en conocimiento interno y documentación específica."
 
 @tool
-def write_file(file_path: str, content: str) -> str:
+async def write_file(file_path: str, content: str) -> str:
     """Escribe contenido a un archivo. Útil para documentar investigaciones y análisis."""
     try:
-        import os
-        # Asegurar que el directorio existe
-        os.makedirs(os.path.dirname(file_path) if os.path.dirname(file_path) else '.', exist_ok=True)
-        
-        with open(file_path, 'w', encoding='utf-8') as f:
-            f.write(content)
+        # La escritura en disco no debe bloquear el event loop
+        await asyncio.to_thread(_write_text_file, file_path, content)
         return f"✅ Archivo '{file_path}' creado exitosamente con {len(content)} caracteres."
     except Exception as e:
         return f"❌ Error creando archivo '{file_path}': {str(e)}"
 
 @tool  
-def write_todos(todos: str) -> str:
+async def write_todos(todos: str) -> str:
     """Actualiza la lista de tareas pendientes para mostrar progreso al usuario."""
     # Esta herramienta simula la actualización de todos para el loud thinking
     return f"📋 Lista de tareas actualizada: {todos}"
 
 @tool
-def read_file(file_path: str) -> str:
+async def read_file(file_path: str) -> str:
     """Lee el contenido de un archivo existente."""
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
+        content = await asyncio.to_thread(_read_text_file, file_path)
         return f"📖 Contenido del archivo '{file_path}':\n\n{content}"
     except FileNotFoundError:
         return f"❌ Archivo '{file_path}' no encontrado."
     except Exception as e:
         return f"❌ Error leyendo archivo '{file_path}': {str(e)}"
 
-# Crear el agente con herramientas básicas
+# Crear el agente asíncrono con herramientas básicas (ainvoke/astream_events, task tool async)
 try:
-    agent = create_deep_agent(
+    agent = async_create_deep_agent(
         tools=[web_search, write_file, write_todos, read_file],
         instructions=instructions,
     ).with_config({"recursion_limit": 100})
@@ -187,7 +194,7 @@ except Exception as e:
                 'read_file': read_file
             }
         
-        def invoke(self, input_data, config=None):
+        async def ainvoke(self, input_data, config=None):
             messages = input_data.get("messages", [])
             if messages:
                 # Tomar el último mensaje del usuario
@@ -221,7 +228,7 @@ PARAMS: {{"todos": "1. Investigar normativa\\n2. Documentar hallazgos\\n3. Crear
 IMPORTANTE: Debes EJECUTAR herramientas reales para investigar, documentar y generar archivos."""
 
                 # Generar respuesta inicial
-                initial_response = self.model.invoke([HumanMessage(content=f"{instructions}\n{tools_description}\n\nUser: {user_message}")])
+                initial_response = await self.model.ainvoke([HumanMessage(content=f"{instructions}\n{tools_description}\n\nUser: {user_message}")])
                 
                 # Procesar la respuesta para detectar y ejecutar herramientas
                 response_text = initial_response.content
@@ -242,7 +249,7 @@ IMPORTANTE: Debes EJECUTAR herramientas reales para investigar, documentar y gen
                             import json
                             params = json.loads(params_str)
                             print(f"✅ Executing {tool_name} with {params}")
-                            tool_result = self.tools[tool_name](**params)
+                            tool_result = await self.tools[tool_name].ainvoke(params)
                             print(f"✅ Tool result: {tool_result}")
                             
                             # Reemplazar la llamada a herramienta con el resultado
@@ -280,42 +287,30 @@ IMPORTANTE: Debes EJECUTAR herramientas reales para investigar, documentar y gen
     print("Agente simplificado creado como fallback")
 
 # Para deployment en Render, exponemos el agente como una app FastAPI
-from fastapi import FastAPI, HTTPException, Request
+from fastapi import FastAPI, HTTPException, Response
 from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+from langgraph.types import Command
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import Optional
 import uuid
-import asyncio
 import logging
 import json
 
-# Configurar logging
-logging.basicConfig(level=logging.INFO)
+from request_logging import configure_logging, RequestLoggingMiddleware
+
+# Configurar logging (JSON vía structlog/orjson, escritura no bloqueante en un hilo aparte)
+configure_logging()
 logger = logging.getLogger(__name__)
 
 # Importar módulos de base de datos
-from database import async_init_database, ThreadService, get_database_stats, migrate_threads_from_langgraph
+from database import async_init_database, dispose_engines, sqlite_maintenance, thread_cache, thread_loader, ThreadService, get_database_stats, migrate_threads_from_langgraph, decode_thread_cursor, encode_thread_cursor
+from write_behind import write_behind
+from scheduler import run_scheduler, thread_run_locks, SchedulerFullError, ThreadBusyError
 
 app = FastAPI(title="Lois Deep Agent API")
 
-# Middleware de logging para debug
-@app.middleware("http")
-async def log_requests(request: Request, call_next):
-    # Log de la petición entrante
-    body = None
-    if request.method in ["POST", "PUT", "PATCH"]:
-        body = await request.body()
-        # Recrear el request para que funcione normalmente
-        request._body = body
-    
-    logger.info(f"📨 {request.method} {request.url.path} - Headers: {dict(request.headers)} - Body: {body.decode() if body else 'None'}")
-    
-    response = await call_next(request)
-    
-    logger.info(f"📤 Response status: {response.status_code}")
-    return response
-
 # Configurar CORS para permitir requests del frontend
 app.add_middleware(
     CORSMiddleware,
@@ -325,6 +320,10 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Middleware de logging estructurado: sin bufferizar bodies, cabeceras redactadas, con latencias.
+# Se registra el último para que sea el más externo y mida también CORS (incluidos los preflight)
+app.add_middleware(RequestLoggingMiddleware)
+
 # Modelos para requests y responses compatibles con LangGraph API
 from datetime import datetime
 
@@ -344,6 +343,10 @@ class TodoItem(BaseModel):
 class ChatRequest(BaseModel):
     message: str
     thread_id: Optional[str] = None
+    # None = política por defecto (AGENT_THREAD_BUSY_POLICY); True = 409 si el thread está ocupado
+    reject_if_busy: Optional[bool] = None
+    # Última versión del thread que tiene el cliente: si se indica, la respuesta solo trae cambios
+    since: Optional[int] = None
 
 class ChatResponse(BaseModel):
     messages: list[Message]
@@ -351,17 +354,30 @@ class ChatResponse(BaseModel):
     files: dict[str, str]
     thread_id: str
     metadata: dict
+    version: Optional[int] = None
+    # Solo en respuestas delta (since): nombres de todos los archivos actuales y si cambiaron los todos
+    file_names: Optional[list[str]] = None
+    todos_changed: Optional[bool] = None
 
 # Inicializar base de datos al inicio
 @app.on_event("startup")
 async def startup_event():
     """Inicializar la base de datos al arrancar la aplicación"""
     await async_init_database()
+    sqlite_maintenance.start()
+    write_behind.start()
     print("Base de datos SQLite lista para usar")
     
     # Intentar migrar threads desde LangGraph
     await migrate_threads_from_langgraph()
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Guardar lo pendiente, detener el mantenimiento de SQLite y cerrar los pools al cerrar la aplicación"""
+    await write_behind.stop()
+    await sqlite_maintenance.stop()
+    await dispose_engines()
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint para Render"""
@@ -369,7 +385,13 @@ async def health_check():
     return {
         "status": "healthy", 
         "service": "lois-agent-backend",
-        "database": stats
+        "database": stats,
+        "sqlite_maintenance": sqlite_maintenance.stats(),
+        "thread_cache": thread_cache.stats(),
+        "thread_loader": thread_loader.stats(),
+        "write_behind": write_behind.stats(),
+        "scheduler": run_scheduler.stats(),
+        "thread_locks": thread_run_locks.stats()
     }
 
 @app.get("/")
@@ -385,6 +407,258 @@ async def root():
         }
     }
 
+def _message_to_data(msg) -> Optional[dict]:
+    """Convertir un mensaje de LangChain al formato de la base de datos (None si es del usuario)"""
+    # Determinar tipo de mensaje de forma más segura
+    msg_type = "ai"  # Por defecto
+    content = ""
+    tool_calls = None
+    tool_call_id = None
+
+    if hasattr(msg, 'content'):
+        # Si el contenido es una lista (tool calls + texto)
+        if isinstance(msg.content, list):
+            text_parts = []
+            tool_parts = []
+
+            for part in msg.content:
+                if isinstance(part, dict):
+                    if part.get('type') == 'text':
+                        text_parts.append(part.get('text', ''))
+                    elif part.get('type') == 'tool_use':
+                        tool_parts.append({
+                            'id': part.get('id'),
+                            'name': part.get('name'),
+                            'input': part.get('input')
+                        })
+
+            content = ' '.join(text_parts)
+            if tool_parts:
+                tool_calls = tool_parts
+        else:
+            content = str(msg.content)
+    else:
+        content = str(msg)
+
+    # Tool calls ya parseados por LangChain (p. ej. contenido de texto plano)
+    if not tool_calls and getattr(msg, 'tool_calls', None):
+        tool_calls = [
+            {'id': tc.get('id'), 'name': tc.get('name'), 'input': tc.get('args')}
+            for tc in msg.tool_calls
+        ]
+    tool_call_id = getattr(msg, 'tool_call_id', None)
+
+    if hasattr(msg, '__class__'):
+        class_name = msg.__class__.__name__.lower()
+        if "human" in class_name:
+            msg_type = "human"
+        elif "tool" in class_name:
+            msg_type = "tool"
+
+    # Skip el mensaje del usuario (ya lo agregamos)
+    if msg_type == "human":
+        return None
+
+    return {
+        "id": getattr(msg, 'id', None) or str(uuid.uuid4()),
+        "type": msg_type,
+        "content": content,
+        "tool_calls": tool_calls,
+        "tool_call_id": tool_call_id
+    }
+
+def _extract_agent_messages(agent_response) -> list[dict]:
+    """Convertir los mensajes devueltos por el agente al formato de la base de datos"""
+    message_datas = []
+    if not isinstance(agent_response, dict) or not agent_response.get("messages"):
+        return message_datas
+
+    for msg in agent_response["messages"]:
+        try:
+            message_data = _message_to_data(msg)
+            if message_data:
+                message_datas.append(message_data)
+        except Exception as msg_error:
+            print(f"Error procesando mensaje individual: {msg_error}")
+    return message_datas
+
+def _parse_todos_text(todos_text: str) -> list[dict]:
+    """Parsear la lista de todos enviada como texto por la herramienta write_todos"""
+    todos = []
+    todos_lines = [line.strip() for line in todos_text.split('\n') if line.strip()]
+    for i, line in enumerate(todos_lines):
+        # Determinar status basado en si tiene checkmark
+        if line.startswith('✅'):
+            status = "completed"
+            content = line.replace('✅', '').strip()
+        elif line.startswith(f'{i+1}.'):
+            status = "pending"
+            content = line[2:].strip()  # Remove "1. "
+        else:
+            status = "pending"
+            content = line
+
+        if content:
+            todos.append({
+                "content": content,
+                "status": status,
+                "activeForm": f"Working on {content.lower()}"
+            })
+    return todos
+
+def _extract_todos_and_files(message_datas: list[dict]) -> tuple[list[dict], dict[str, str], list[str]]:
+    """Extraer TODOs, archivos y herramientas usadas a partir de los tool_calls de los mensajes"""
+    todos_data = []
+    files_data = {}
+    tools_used = []
+
+    for message_data in message_datas:
+        if message_data["type"] == "tool":
+            tools_used.append("tool_call")
+
+        for tool_call in message_data.get("tool_calls") or []:
+            if not isinstance(tool_call, dict):
+                continue
+            tool_input = tool_call.get('input') or {}
+
+            # Buscar tool calls de write_todos
+            if tool_call.get('name') == 'write_todos':
+                if 'todos' in tool_input:
+                    todos_data.extend(_parse_todos_text(tool_input['todos']))
+                tools_used.append("write_todos")
+
+            elif tool_call.get('name') == 'write_file':
+                file_path = tool_input.get('file_path', '')
+                file_content = tool_input.get('content', '')
+                if file_path and file_content:
+                    files_data[file_path] = file_content
+                tools_used.append("write_file")
+
+    return todos_data, files_data, tools_used
+
+def _sse(data: dict) -> str:
+    """Formatear un evento Server-Sent Events"""
+    return f"data: {json.dumps(data, default=str)}\n\n"
+
+def _chunk_text(chunk) -> str:
+    """Extraer el texto de un chunk de streaming del modelo (ignora los deltas de tool_use)"""
+    content = getattr(chunk, "content", "")
+    if isinstance(content, str):
+        return content
+    text_parts = []
+    for part in content or []:
+        if isinstance(part, dict) and part.get("type") == "text":
+            text_parts.append(part.get("text", ""))
+        elif isinstance(part, str):
+            text_parts.append(part)
+    return "".join(text_parts)
+
+def _is_main_agent_event(event: dict) -> bool:
+    """True si el evento viene del agente principal y no de un sub-agente anidado"""
+    checkpoint_ns = event.get("metadata", {}).get("langgraph_checkpoint_ns") or ""
+    return "|" not in checkpoint_ns
+
+def _partial_message_datas(messages: list) -> list[dict]:
+    """Convertir los mensajes completados durante un stream interrumpido (ignora lo que no sea mensaje)"""
+    message_datas = []
+    for msg in messages:
+        if isinstance(msg, Command):
+            # Las herramientas de deepagents devuelven Command: sus mensajes van en update
+            update = msg.update if isinstance(msg.update, dict) else {}
+            message_datas.extend(_partial_message_datas(update.get("messages") or []))
+            continue
+        if not hasattr(msg, "type"):
+            continue
+        msg_data = _message_to_data(msg)
+        if msg_data:
+            message_datas.append(msg_data)
+    return message_datas
+
+def _collect_partial_run(run: dict):
+    """Si la ejecución no terminó, quedarse con los mensajes que el agente llegó a completar"""
+    if run["completed"]:
+        return
+    message_datas = _partial_message_datas(run["partial_messages"])
+    run["message_datas"] = message_datas
+    run["todos"], run["files"], _ = _extract_todos_and_files(message_datas)
+
+async def _persist_stream_run(run: dict):
+    """
+    Guardar en la base de datos el resultado de una ejecución en streaming.
+    Si el stream falló o el cliente se desconectó se guarda igualmente el mensaje
+    del usuario y los mensajes que el agente llegó a completar, como hace /chat.
+    """
+    if run.get("persisted"):
+        return
+    run["persisted"] = True
+
+    thread_id = run["thread_id"]
+    if not run.get("completed"):
+        _collect_partial_run(run)
+        print(f"⚠️ Stream interrumpido: se guardan {len(run['message_datas'])} mensajes parciales en thread {thread_id}")
+    try:
+        await write_behind.add_messages(
+            thread_id,
+            [run["user_message"]] + run["message_datas"],
+            todos_list=run["todos"] or None,
+            files_dict=run["files"] or None
+        )
+        print(f"💾 Stream persistido: {len(run['message_datas'])} mensajes en thread {thread_id}")
+    except Exception as e:
+        import traceback
+        print(f"❌ Error persistiendo stream: {e}")
+        traceback.print_exc()
+
+async def _admit_run(thread_id: str, reject_if_busy: Optional[bool] = None) -> list:
+    """
+    Admitir una ejecución: primero el turno del thread (una ejecución a la vez por thread_id)
+    y luego un slot del scheduler global. Devuelve los tickets a liberar al terminar.
+    """
+    try:
+        thread_ticket = await thread_run_locks.acquire(thread_id, reject_if_busy)
+    except ThreadBusyError as e:
+        print(f"⛔ Thread ocupado ({e.status_code}): {thread_id}")
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+
+    try:
+        run_ticket = await run_scheduler.acquire()
+    except BaseException as e:
+        thread_ticket.release()
+        if isinstance(e, SchedulerFullError):
+            print(f"⛔ Ejecución rechazada ({e.status_code}): {run_scheduler.stats()}")
+            raise HTTPException(
+                status_code=e.status_code,
+                detail=str(e),
+                headers={"Retry-After": str(e.retry_after)}
+            )
+        raise
+    return [thread_ticket, run_ticket]
+
+def _release_run(tickets: list):
+    """Liberar los tickets de admisión en orden inverso"""
+    for ticket in reversed(tickets):
+        ticket.release()
+
+class _AdmittedStreamingResponse(StreamingResponse):
+    """StreamingResponse que libera la admisión cuando termina (o se desconecta el cliente)"""
+
+    def __init__(self, tickets: list, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.tickets = tickets
+
+    async def __call__(self, scope, receive, send):
+        try:
+            # Incluye la BackgroundTask de persistencia: el thread sigue bloqueado hasta guardar
+            await super().__call__(scope, receive, send)
+        except BaseException:
+            # Con ASGI 2.4 una desconexión del cliente (o una cancelación) corta el envío
+            # antes de la BackgroundTask: guardar igualmente lo que se llegó a completar
+            if self.background is not None:
+                await asyncio.shield(self.background())
+            raise
+        finally:
+            _release_run(self.tickets)
+
 @app.post("/chat", response_model=ChatResponse)
 async def chat_endpoint(request: ChatRequest):
     """
@@ -394,25 +668,30 @@ async def chat_endpoint(request: ChatRequest):
     - **message**: Tu pregunta o consulta
     - **thread_id**: (Opcional) ID del hilo de conversación para continuar
     """
+    request.thread_id = request.thread_id or str(uuid.uuid4())
+    tickets = await _admit_run(request.thread_id, request.reject_if_busy)
+    try:
+        # El thread existe desde el inicio de la ejecución (sin cargar nada)
+        await ThreadService.ensure_thread(request.thread_id)
+        return await _run_chat(request)
+    finally:
+        _release_run(tickets)
+
+async def _run_chat(request: ChatRequest) -> ChatResponse:
+    """Ejecutar el agente para un mensaje y persistir el resultado"""
     start_time = datetime.utcnow()
     
     try:
         # Generar thread_id si no se proporciona
         thread_id = request.thread_id or str(uuid.uuid4())
         
-        # Obtener o crear thread en la base de datos
-        thread = await ThreadService.get_or_create_thread(thread_id)
-        
-        # Crear mensaje del usuario en la base de datos
+        # Mensaje del usuario (se guarda junto con la salida del agente)
         user_message_data = {
             "id": str(uuid.uuid4()),
             "type": "human",
             "content": request.message
         }
         
-        # Guardar mensaje del usuario en la base de datos
-        await ThreadService.add_message(thread_id, user_message_data)
-        
         # Configuración del agente para este thread
         config = {
             "configurable": {
@@ -423,8 +702,7 @@ async def chat_endpoint(request: ChatRequest):
         
         # Invocar el agente con mejor manejo de errores
         try:
-            agent_response = await asyncio.to_thread(
-                agent.invoke,
+            agent_response = await agent.ainvoke(
                 {"messages": [("user", request.message)]},
                 config
             )
@@ -442,141 +720,13 @@ async def chat_endpoint(request: ChatRequest):
             }
         
         # Extraer datos del agente response
-        agent_messages = []
         todos_list = []
         files_dict = {}
-        tools_used = []
         
-        # Procesar mensajes del agente de forma más segura
-        if "messages" in agent_response and agent_response["messages"]:
-            try:
-                for msg in agent_response["messages"]:
-                    try:
-                        # Determinar tipo de mensaje de forma más segura
-                        msg_type = "ai"  # Por defecto
-                        content = ""
-                        tool_calls = None
-                        tool_call_id = None
-                        
-                        if hasattr(msg, 'content'):
-                            # Si el contenido es una lista (tool calls + texto)
-                            if isinstance(msg.content, list):
-                                text_parts = []
-                                tool_parts = []
-                                
-                                for part in msg.content:
-                                    if isinstance(part, dict):
-                                        if part.get('type') == 'text':
-                                            text_parts.append(part.get('text', ''))
-                                        elif part.get('type') == 'tool_use':
-                                            tool_parts.append({
-                                                'id': part.get('id'),
-                                                'name': part.get('name'),
-                                                'input': part.get('input')
-                                            })
-                                
-                                content = ' '.join(text_parts)
-                                if tool_parts:
-                                    tool_calls = tool_parts
-                            else:
-                                # Procesar content de manera más inteligente
-                                if isinstance(msg.content, list):
-                                    # Si es una lista, extraer solo el texto
-                                    text_parts = []
-                                    for item in msg.content:
-                                        if isinstance(item, dict):
-                                            if item.get('type') == 'text' and 'text' in item:
-                                                text_parts.append(item['text'])
-                                        elif isinstance(item, str):
-                                            text_parts.append(item)
-                                    content = ' '.join(text_parts) if text_parts else str(msg.content)
-                                else:
-                                    content = str(msg.content)
-                        else:
-                            content = str(msg)
-                            
-                        if hasattr(msg, '__class__'):
-                            class_name = msg.__class__.__name__.lower()
-                            if "human" in class_name:
-                                msg_type = "human"
-                            elif "tool" in class_name:
-                                msg_type = "tool"
-                                tools_used.append("tool_call")
-                        
-                        # Skip el mensaje del usuario (ya lo agregamos)
-                        if msg_type == "human":
-                            continue
-                            
-                        # Crear datos del mensaje para la base de datos
-                        message_data = {
-                            "id": getattr(msg, 'id', str(uuid.uuid4())),
-                            "type": msg_type,
-                            "content": content,
-                            "tool_calls": tool_calls,
-                            "tool_call_id": tool_call_id
-                        }
-                        
-                        # Guardar mensaje en la base de datos
-                        db_message = await ThreadService.add_message(thread_id, message_data)
-                        
-                        # Crear objeto para respuesta
-                        message_obj = Message(
-                            id=db_message.id,
-                            type=db_message.type,
-                            content=db_message.content,
-                            timestamp=db_message.timestamp.isoformat() + "Z",
-                            tool_calls=db_message.tool_calls,
-                            tool_call_id=db_message.tool_call_id
-                        )
-                        agent_messages.append(message_obj)
-                    except Exception as msg_error:
-                        print(f"Error procesando mensaje individual: {msg_error}")
-                        continue
-            except Exception as messages_error:
-                print(f"Error procesando lista de mensajes: {messages_error}")
+        message_datas = _extract_agent_messages(agent_response)
         
-        # Extraer TODOs y archivos de los tool_calls y tool messages en agent_messages
-        todos_data = []
-        files_data = {}
-        
-        for msg in agent_messages:
-            # Buscar tool calls de write_todos
-            if hasattr(msg, 'tool_calls') and msg.tool_calls:
-                for tool_call in msg.tool_calls:
-                    if isinstance(tool_call, dict) and tool_call.get('name') == 'write_todos':
-                        tool_input = tool_call.get('input', {})
-                        if 'todos' in tool_input:
-                            todos_text = tool_input['todos']
-                            # Parsear todos del texto
-                            todos_lines = [line.strip() for line in todos_text.split('\n') if line.strip()]
-                            for i, line in enumerate(todos_lines):
-                                # Determinar status basado en si tiene checkmark
-                                if line.startswith('✅'):
-                                    status = "completed"
-                                    content = line.replace('✅', '').strip()
-                                elif line.startswith(f'{i+1}.'):
-                                    status = "pending"  
-                                    content = line[2:].strip()  # Remove "1. "
-                                else:
-                                    status = "pending"
-                                    content = line
-                                
-                                if content:
-                                    todo_dict = {
-                                        "content": content,
-                                        "status": status,
-                                        "activeForm": f"Working on {content.lower()}"
-                                    }
-                                    todos_data.append(todo_dict)
-                        tools_used.append("write_todos")
-                    
-                    elif isinstance(tool_call, dict) and tool_call.get('name') == 'write_file':
-                        tool_input = tool_call.get('input', {})
-                        file_path = tool_input.get('file_path', '')
-                        file_content = tool_input.get('content', '')
-                        if file_path and file_content:
-                            files_data[file_path] = file_content
-                        tools_used.append("write_file")
+        # Extraer TODOs y archivos de los tool_calls y tool messages
+        todos_data, files_data, tools_used = _extract_todos_and_files(message_datas)
         
         # Debug prints para verificar datos extraídos
         print(f"📋 TODOS extraídos: {len(todos_data)} items")
@@ -587,14 +737,28 @@ async def chat_endpoint(request: ChatRequest):
         for filename, content_preview in files_data.items():
             print(f"  - {filename}: {len(content_preview)} chars")
         
-        # Guardar todos y archivos en la base de datos
-        if todos_data:
-            await ThreadService.update_thread_todos(thread_id, todos_data)
-            print(f"✅ Guardados {len(todos_data)} todos en DB")
+        # Guardar mensaje del usuario, mensajes del agente, todos y archivos en una sola transacción
+        # (con write-behind activo solo se encolan y se guardan en segundo plano)
+        db_messages = await write_behind.add_messages(
+            thread_id,
+            [user_message_data] + message_datas,
+            todos_list=todos_data or None,
+            files_dict=files_data or None
+        )
+        print(f"✅ Guardados {len(db_messages)} mensajes, {len(todos_data)} todos y {len(files_data)} archivos")
         
-        if files_data:
-            await ThreadService.update_thread_files(thread_id, files_data)
-            print(f"✅ Guardados {len(files_data)} archivos en DB")
+        # Crear objetos para respuesta (sin el mensaje del usuario)
+        agent_messages = [
+            Message(
+                id=db_message.id,
+                type=db_message.type,
+                content=db_message.content,
+                timestamp=db_message.timestamp.isoformat() + "Z",
+                tool_calls=db_message.tool_calls,
+                tool_call_id=db_message.tool_call_id
+            )
+            for db_message in db_messages[1:]
+        ]
         
         # Si no hay mensajes del agente, crear uno por defecto
         if not agent_messages:
@@ -606,8 +770,40 @@ async def chat_endpoint(request: ChatRequest):
             )
             agent_messages.append(default_message)
         
+        # Calcular metadata
+        end_time = datetime.utcnow()
+        processing_time = (end_time - start_time).total_seconds()
+        
+        # Estimar tokens (aproximación)
+        total_content = request.message + "".join([msg.content for msg in agent_messages])
+        estimated_tokens = len(total_content.split()) * 1.3  # Aproximación
+        
+        if request.since is not None:
+            # Respuesta delta: solo lo que cambió desde la versión que tiene el cliente
+            # (las versiones solo existen una vez guardado: esperar a la cola write-behind)
+            await write_behind.wait_for_thread(thread_id)
+            changes = await ThreadService.get_thread_changes(thread_id, request.since)
+            delta = _thread_delta_values(changes)
+            return ChatResponse(
+                messages=[Message(**msg_dict) for msg_dict in delta["values"]["messages"]],
+                todos=delta["values"].get("todos") or [],
+                files=delta["values"]["files"],
+                thread_id=thread_id,
+                metadata={
+                    "model_used": "claude-3-5-haiku-20241022",
+                    "estimated_tokens": int(estimated_tokens),
+                    "processing_time_seconds": round(processing_time, 2),
+                    "tools_used": list(set(tools_used)) if tools_used else [],
+                    **delta["metadata"]
+                },
+                version=delta["version"],
+                file_names=delta["values"]["file_names"],
+                todos_changed=delta["values"]["todos_changed"]
+            )
+        
         # Obtener thread actualizado de la base de datos
         updated_thread = await ThreadService.get_thread(thread_id)
+        thread_messages = list(updated_thread.messages) if updated_thread else []
         
         # Poblar todos_list y files_dict desde el thread actualizado
         if updated_thread:
@@ -615,43 +811,44 @@ async def chat_endpoint(request: ChatRequest):
             todos_list = [todo.to_dict() for todo in updated_thread.todos] if updated_thread.todos else []
             # Obtener archivos del thread
             files_dict = {file.filename: file.content for file in updated_thread.files} if updated_thread.files else {}
-            
-            print(f"📋 Thread actualizado - Todos: {len(todos_list)}, Files: {len(files_dict)}")
         else:
             print("❌ No se pudo obtener thread actualizado")
         
-        # Calcular metadata
-        end_time = datetime.utcnow()
-        processing_time = (end_time - start_time).total_seconds()
-        
-        # Estimar tokens (aproximación)
-        total_content = request.message + "".join([msg.content for msg in agent_messages])
-        estimated_tokens = len(total_content.split()) * 1.3  # Aproximación
+        # Superponer lo que aún está en la cola write-behind (lectura de lo propio escrito)
+        pending = write_behind.pending_view(thread_id)
+        saved_ids = {db_msg.id for db_msg in thread_messages}
+        thread_messages.extend(msg for msg in pending["messages"] if msg.id not in saved_ids)
+        if pending["todos"] is not None:
+            todos_list = [{"content": todo.get("content"), "status": todo.get("status"), "activeForm": todo.get("activeForm")}
+                          for todo in pending["todos"]]
+        if pending["files"] is not None:
+            files_dict = dict(pending["files"])
+        print(f"📋 Thread actualizado - Todos: {len(todos_list)}, Files: {len(files_dict)}")
         
         metadata = {
             "model_used": "claude-3-5-haiku-20241022",
             "estimated_tokens": int(estimated_tokens),
             "processing_time_seconds": round(processing_time, 2),
             "tools_used": list(set(tools_used)) if tools_used else [],
-            "message_count": len(updated_thread.messages) if updated_thread else 0,
-            "files_count": len(updated_thread.files) if updated_thread else 0,
-            "todos_count": len(updated_thread.todos) if updated_thread else 0
+            "message_count": len(thread_messages),
+            "files_count": len(files_dict),
+            "todos_count": len(todos_list)
         }
         
         # Combinar todos los mensajes para la respuesta
         all_messages = []
-        if updated_thread:
-            for db_msg in updated_thread.messages:
-                msg_dict = db_msg.to_dict()
-                msg_obj = Message(**msg_dict)
-                all_messages.append(msg_obj)
+        for db_msg in thread_messages:
+            msg_dict = db_msg.to_dict()
+            msg_obj = Message(**msg_dict)
+            all_messages.append(msg_obj)
         
         return ChatResponse(
             messages=all_messages,
             todos=todos_list,
             files=files_dict,
             thread_id=thread_id,
-            metadata=metadata
+            metadata=metadata,
+            version=updated_thread.version if updated_thread else None
         )
         
     except Exception as e:
@@ -666,99 +863,172 @@ async def chat_endpoint(request: ChatRequest):
 @app.post("/chat/stream")
 async def chat_stream_endpoint(request: ChatRequest):
     """
-    Endpoint de streaming HÍBRIDO: 
-    1. Llama a /chat para obtener respuesta completa  
-    2. Hace streaming simulado de la respuesta
+    Endpoint de streaming real (SSE) basado en el stream de eventos del grafo:
+    1. Reenvía cada token del modelo, inicio/fin de herramientas y cambios de todos/archivos
+       en cuanto se producen
+    2. Guarda mensajes, todos y archivos en la base de datos al terminar, sin bloquear el stream
     """
+    thread_id = request.thread_id or str(uuid.uuid4())
+
+    # Admisión antes de abrir el stream para poder responder 409/429/503 con un status HTTP
+    tickets = await _admit_run(thread_id, request.reject_if_busy)
+
+    run = {
+        "thread_id": thread_id,
+        "user_message": {
+            "id": str(uuid.uuid4()),
+            "type": "human",
+            "content": request.message
+        },
+        "message_datas": [],
+        "todos": [],
+        "files": {},
+        # Mensajes terminados del agente principal, para guardar si el stream falla
+        "partial_messages": [],
+        "completed": False,
+        "persisted": False
+    }
+
     async def generate_response():
-        import json
-        
+        start_time = datetime.utcnow()
+
         try:
+            # El thread existe desde el inicio del stream (sin cargar nada)
+            await ThreadService.ensure_thread(thread_id)
+
             # Enviar evento de inicio
-            thread_id = request.thread_id or str(uuid.uuid4())
-            yield f"data: {json.dumps({'type': 'start', 'thread_id': thread_id})}\n\n"
-            
-            print(f"🔄 STREAMING HÍBRIDO: Procesando {request.message[:50]}...")
-            
-            # Llamar directamente al endpoint /chat internamente
-            # Simular la request para evitar llamada HTTP
-            internal_request = ChatRequest(message=request.message, thread_id=thread_id)
-            
-            # Llamar directamente a la función chat_endpoint
-            chat_result = await chat_endpoint(internal_request)
-            
-            # Convertir ChatResponse a dict
-            chat_data = {
-                "messages": [msg.dict() if hasattr(msg, 'dict') else msg for msg in chat_result.messages],
-                "todos": [todo.dict() if hasattr(todo, 'dict') else todo for todo in chat_result.todos],  
-                "files": chat_result.files,
-                "thread_id": chat_result.thread_id,
-                "metadata": chat_result.metadata
+            yield _sse({'type': 'start', 'thread_id': thread_id})
+
+            print(f"🔄 STREAMING: Procesando {request.message[:50]}...")
+
+            if not hasattr(agent, "astream_events"):
+                # Agente simplificado de fallback: no soporta streaming de eventos
+                # _run_chat ya guarda el resultado en la base de datos
+                run["persisted"] = True
+                chat_result = await _run_chat(ChatRequest(message=request.message, thread_id=thread_id))
+                ai_content = "\n\n".join(
+                    msg.content for msg in chat_result.messages if msg.type == 'ai' and msg.content
+                )
+                if ai_content:
+                    yield _sse({'type': 'text_chunk', 'content': ai_content, 'is_complete': True})
+                yield _sse({
+                    'type': 'complete',
+                    'thread_id': thread_id,
+                    'todos': [todo.dict() if hasattr(todo, 'dict') else todo for todo in chat_result.todos],
+                    'files': chat_result.files,
+                    'metadata': chat_result.metadata
+                })
+                return
+
+            config = {
+                "configurable": {
+                    "thread_id": thread_id
+                },
+                "recursion_limit": 100
             }
-            
-            print(f"✅ Chat response received with {len(chat_data.get('messages', []))} messages")
-            print(f"📋 Todos: {len(chat_data.get('todos', []))}")
-            print(f"📄 Files: {len(chat_data.get('files', {}))}")
-            
-            # Extraer contenido de AI para streaming
-            ai_content = ""
-            
-            for message in chat_data.get('messages', []):
-                if message.get('type') == 'ai' and message.get('content'):
-                    ai_content += message['content'] + "\n\n"
-            
-            print(f"🔤 Content to stream: {len(ai_content)} characters")
-            
-            # Streamear el contenido palabra por palabra
-            if ai_content.strip():
-                words = ai_content.split()
-                chunk_size = 3
-                
-                for i in range(0, len(words), chunk_size):
-                    chunk_words = words[i:i+chunk_size]
-                    chunk_text = ' '.join(chunk_words)
-                    
-                    if i + chunk_size < len(words):
-                        chunk_text += ' '
-                    
-                    chunk_data = {
-                        'type': 'text_chunk',
-                        'content': chunk_text,
-                        'is_complete': i + chunk_size >= len(words)
-                    }
-                    
-                    yield f"data: {json.dumps(chunk_data)}\n\n"
-                    await asyncio.sleep(0.04)
-            
-            # Enviar evento de finalización con TODOS los datos
+
+            final_state = None
+            async for event in agent.astream_events(
+                {"messages": [("user", request.message)]},
+                config,
+                version="v2"
+            ):
+                kind = event["event"]
+
+                if kind == "on_chain_end" and not event.get("parent_ids"):
+                    # Fin del grafo raíz: estado final de la ejecución
+                    final_state = event["data"].get("output")
+                    continue
+
+                # Al cliente solo llegan los eventos del agente principal, no los de sub-agentes
+                if not _is_main_agent_event(event):
+                    continue
+
+                if kind == "on_chat_model_stream":
+                    text = _chunk_text(event["data"].get("chunk"))
+                    if text:
+                        yield _sse({'type': 'text_chunk', 'content': text, 'is_complete': False})
+
+                elif kind == "on_chat_model_end":
+                    run["partial_messages"].append(event["data"].get("output"))
+
+                elif kind == "on_tool_start":
+                    tool_input = event["data"].get("input") or {}
+                    yield _sse({
+                        'type': 'tool_start',
+                        'tool': event["name"],
+                        'run_id': event["run_id"],
+                        'input': tool_input
+                    })
+                    if event["name"] == "write_todos" and isinstance(tool_input.get("todos"), str):
+                        yield _sse({'type': 'todos', 'todos': _parse_todos_text(tool_input["todos"])})
+
+                elif kind == "on_tool_end":
+                    output = event["data"].get("output")
+                    run["partial_messages"].append(output)
+                    yield _sse({
+                        'type': 'tool_end',
+                        'tool': event["name"],
+                        'run_id': event["run_id"],
+                        'output': str(getattr(output, "content", output))[:500]
+                    })
+                    if event["name"] in ("write_file", "edit_file"):
+                        tool_input = event["data"].get("input") or {}
+                        yield _sse({'type': 'file', 'file_path': tool_input.get("file_path")})
+
+            message_datas = _extract_agent_messages(final_state)
+            todos_data, files_data, tools_used = _extract_todos_and_files(message_datas)
+
+            run["message_datas"] = message_datas
+            run["todos"] = todos_data
+            run["files"] = files_data
+            run["completed"] = True
+
+            processing_time = (datetime.utcnow() - start_time).total_seconds()
+            total_content = request.message + "".join(m["content"] or "" for m in message_datas)
+
+            # Enviar evento de finalización con los datos de esta ejecución
             completion_data = {
                 'type': 'complete',
-                'thread_id': chat_data.get('thread_id', thread_id),
-                'todos': chat_data.get('todos', []),
-                'files': chat_data.get('files', {}),
-                'metadata': chat_data.get('metadata', {})
+                'thread_id': thread_id,
+                'todos': todos_data,
+                'files': files_data,
+                'metadata': {
+                    "model_used": "claude-3-5-haiku-20241022",
+                    "estimated_tokens": int(len(total_content.split()) * 1.3),
+                    "processing_time_seconds": round(processing_time, 2),
+                    "tools_used": list(set(tools_used)),
+                    "message_count": len(message_datas) + 1
+                }
             }
-            
-            print(f"🏁 Enviando completion_data con {len(completion_data['todos'])} todos y {len(completion_data['files'])} files")
-            
-            yield f"data: {json.dumps(completion_data)}\n\n"
-            
+
+            print(f"🏁 Enviando completion_data con {len(todos_data)} todos y {len(files_data)} files")
+
+            yield _sse(completion_data)
+
         except Exception as e:
             import traceback
-            error_msg = f"Error en streaming híbrido: {str(e)}"
+            error_msg = f"Error en streaming: {str(e)}"
             error_trace = traceback.format_exc()
             print(f"❌ STREAM ERROR: {error_msg}")
             print(f"❌ STACK TRACE: {error_trace}")
-            yield f"data: {json.dumps({'type': 'error', 'message': error_msg})}\n\n"
-    
-    
-    return StreamingResponse(
+            yield _sse({'type': 'error', 'message': error_msg})
+        finally:
+            # También al cancelarse el generador (cliente desconectado): conservar
+            # lo que el agente llegó a producir
+            _collect_partial_run(run)
+
+    return _AdmittedStreamingResponse(
+        tickets,
         generate_response(),
         media_type="text/event-stream",
         headers={
             "Cache-Control": "no-cache",
             "Connection": "keep-alive",
-        }
+            "X-Accel-Buffering": "no",
+        },
+        # La persistencia corre cuando el stream ya terminó de enviarse
+        background=BackgroundTask(_persist_stream_run, run)
     )
 
 # Modelo para búsqueda de threads
@@ -767,22 +1037,68 @@ class ThreadSearchRequest(BaseModel):
     offset: int = 0
     sort_by: str = "created_at"
     sort_order: str = "desc"
+    # Paginación keyset: valor "cursor" del último thread de la página anterior
+    cursor: Optional[str] = None
+    # Por defecto solo se devuelve el resumen; True carga mensajes, archivos y todos completos
+    include_values: bool = False
 
 @app.get("/threads/search")
-async def search_threads_get(limit: int = 30, sortBy: str = "created_at", sortOrder: str = "desc"):
+async def search_threads_get(response: Response, limit: int = 30, sortBy: str = "created_at",
+                             sortOrder: str = "desc", cursor: Optional[str] = None,
+                             include_values: bool = False):
     """Buscar threads - GET Compatible con LangGraph API"""
-    return await search_threads_logic(limit, 0, sortBy, sortOrder)
+    return await search_threads_logic(limit, 0, sortBy, sortOrder, cursor, include_values, response)
 
 @app.post("/threads/search")
-async def search_threads_post(request: ThreadSearchRequest):
+async def search_threads_post(request: ThreadSearchRequest, response: Response):
     """Buscar threads - POST Compatible con LangGraph API"""
-    return await search_threads_logic(request.limit, request.offset, request.sort_by, request.sort_order)
+    return await search_threads_logic(request.limit, request.offset, request.sort_by, request.sort_order,
+                                      request.cursor, request.include_values, response)
 
-async def search_threads_logic(limit: int, offset: int, sort_by: str, sort_order: str):
+def _format_timestamp(value: Optional[datetime]) -> Optional[str]:
+    return value.isoformat() + "Z" if value else None
+
+async def search_threads_logic(limit: int, offset: int, sort_by: str, sort_order: str,
+                               cursor: Optional[str] = None, include_values: bool = False,
+                               response: Optional[Response] = None):
     """Lógica común para búsqueda de threads usando SQLite"""
+    if cursor:
+        try:
+            decode_thread_cursor(cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
     try:
+        if not include_values:
+            # Modo resumen: conteos y vista previa calculados en SQL, sin cargar contenido
+            summaries = await ThreadService.search_thread_summaries(limit, offset, sort_by, sort_order, cursor)
+            if response is not None and len(summaries) == limit:
+                response.headers["X-Next-Cursor"] = summaries[-1]["cursor"]
+            return [
+                {
+                    "thread_id": summary["thread_id"],
+                    "created_at": _format_timestamp(summary["created_at"]),
+                    "updated_at": _format_timestamp(summary["updated_at"]),
+                    "metadata": {
+                        **summary["metadata"],
+                        "title": summary["title"],
+                        "preview": summary["preview"],
+                        "message_count": summary["message_count"],
+                        "files_count": summary["files_count"],
+                        "todos_count": summary["todos_count"]
+                    },
+                    "cursor": summary["cursor"],
+                    "status": "idle",
+                    "config": {
+                        "recursion_limit": 100,
+                        "configurable": {}
+                    }
+                }
+                for summary in summaries
+            ]
+
         # Buscar threads en la base de datos
-        db_threads = await ThreadService.search_threads(limit, offset, sort_by, sort_order)
+        db_threads = await ThreadService.search_threads(limit, offset, sort_by, sort_order, cursor)
         
         # Convertir threads de DB a formato compatible con LangGraph API
         thread_list = []
@@ -802,6 +1118,7 @@ async def search_threads_logic(limit: int, offset: int, sort_by: str, sort_order
             for db_file in db_thread.files:
                 files[db_file.filename] = db_file.content
             
+            sort_value = db_thread.updated_at if sort_by == "updated_at" else db_thread.created_at
             thread_list.append({
                 "thread_id": db_thread.id,
                 "created_at": db_thread.created_at.isoformat() + "Z" if db_thread.created_at else None,
@@ -816,6 +1133,7 @@ async def search_threads_logic(limit: int, offset: int, sort_by: str, sort_order
                     "files_count": len(files),
                     "todos_count": len(todos)
                 },
+                "cursor": encode_thread_cursor(sort_value, db_thread.id),
                 "status": "idle",
                 "config": {
                     "recursion_limit": 100,
@@ -823,6 +1141,8 @@ async def search_threads_logic(limit: int, offset: int, sort_by: str, sort_order
                 }
             })
         
+        if response is not None and len(thread_list) == limit:
+            response.headers["X-Next-Cursor"] = thread_list[-1]["cursor"]
         return thread_list
         
     except Exception as e:
@@ -831,9 +1151,68 @@ async def search_threads_logic(limit: int, offset: int, sort_by: str, sort_order
         traceback.print_exc()
         return []
 
+def _thread_delta_values(changes: dict) -> dict:
+    """
+    Convertir el resultado de ThreadService.get_thread_changes en values/metadata.
+    files solo trae los archivos nuevos o modificados; file_names lista todos los actuales
+    para que el cliente pode los borrados; todos solo se incluye si se reemplazaron.
+    """
+    values = {
+        "messages": [db_msg.to_dict() for db_msg in changes["messages"]],
+        "files": changes["files"],
+        "file_names": changes["file_names"],
+        "todos_changed": changes["todos"] is not None
+    }
+    if changes["todos"] is not None:
+        values["todos"] = [db_todo.to_dict() for db_todo in changes["todos"]]
+    
+    return {
+        "values": values,
+        "metadata": {
+            "message_count": changes["message_count"],
+            "files_count": len(changes["file_names"]),
+            "todos_count": changes["todos_count"]
+        },
+        "since": changes["since"],
+        "version": changes["version"]
+    }
+
+async def _get_thread_delta(thread_id: str, since: int) -> Optional[dict]:
+    """Cambios de un thread desde `since`, o None si no existe"""
+    changes = await ThreadService.get_thread_changes(thread_id, since)
+    if changes is None:
+        return None
+    delta = _thread_delta_values(changes)
+    delta["thread"] = changes["thread"]
+    return delta
+
 @app.get("/threads/{thread_id}")
-async def get_thread(thread_id: str):
-    """Obtener historial de un thread específico - Compatible con LangGraph API"""
+async def get_thread(thread_id: str, since: Optional[int] = None):
+    """
+    Obtener historial de un thread específico - Compatible con LangGraph API.
+    Con `since=<versión>` solo devuelve lo que cambió después de esa versión.
+    """
+    await write_behind.wait_for_thread(thread_id)
+    if since is not None:
+        delta = await _get_thread_delta(thread_id, since)
+        if not delta:
+            raise HTTPException(status_code=404, detail="Thread no encontrado")
+        db_thread = delta["thread"]
+        return {
+            "thread_id": thread_id,
+            "created_at": db_thread.created_at.isoformat() + "Z" if db_thread.created_at else None,
+            "updated_at": db_thread.updated_at.isoformat() + "Z" if db_thread.updated_at else None,
+            "metadata": db_thread.thread_metadata or {},
+            "status": "idle",
+            "values": delta["values"],
+            "since": since,
+            "version": delta["version"],
+            "config": {
+                "recursion_limit": 100,
+                "configurable": {}
+            }
+        }
+    
     db_thread = await ThreadService.get_thread(thread_id)
     if not db_thread:
         raise HTTPException(status_code=404, detail="Thread no encontrado")
@@ -864,6 +1243,7 @@ async def get_thread(thread_id: str):
             "todos": todos,
             "files": files
         },
+        "version": db_thread.version or 0,
         "config": {
             "recursion_limit": 100,
             "configurable": {}
@@ -885,63 +1265,131 @@ async def create_thread():
 # Modelo para historial de thread
 class ThreadHistoryRequest(BaseModel):
     limit: int = 1000
+    since: Optional[int] = None
+    # Cursores de paginación por seq (exclusivos): before = página anterior, after = siguiente;
+    # juntos delimitan un rango
+    before: Optional[int] = None
+    after: Optional[int] = None
+
+def _page_cursors(page: dict) -> dict:
+    """Cursores before/after de una página de mensajes"""
+    messages = page["messages"]
+    return {
+        "has_more": page["has_more"],
+        "before": messages[0].seq if messages else None,
+        "after": messages[-1].seq if messages else None
+    }
 
 @app.post("/threads/{thread_id}/history")
 async def get_thread_history(thread_id: str, request: ThreadHistoryRequest):
-    """Obtener historial de un thread - Compatible con LangGraph API"""
-    db_thread = await ThreadService.get_thread(thread_id)
-    if not db_thread:
+    """
+    Obtener historial de un thread - Compatible con LangGraph API.
+    Sin cursores devuelve los últimos `limit` mensajes; `before`/`after` paginan por seq.
+    """
+    await write_behind.wait_for_thread(thread_id)
+    if request.since is not None:
+        delta = await _get_thread_delta(thread_id, request.since)
+        if not delta:
+            raise HTTPException(status_code=404, detail="Thread no encontrado")
+        values = delta["values"]
+        values["messages"] = values["messages"][-request.limit:]
+        return {
+            "values": values,
+            "metadata": delta["metadata"],
+            "thread_id": thread_id,
+            "since": request.since,
+            "version": delta["version"]
+        }
+    
+    page = await ThreadService.get_message_page(
+        thread_id, request.limit, request.before, request.after, include_state=True
+    )
+    if not page:
         raise HTTPException(status_code=404, detail="Thread no encontrado")
     
     # Convertir mensajes
     messages = []
-    for db_msg in db_thread.messages:
+    for db_msg in page["messages"]:
         messages.append(db_msg.to_dict())
     
     # Convertir todos
     todos = []
-    for db_todo in db_thread.todos:
+    for db_todo in page["todos"]:
         todos.append(db_todo.to_dict())
     
     # Convertir archivos
     files = {}
-    for db_file in db_thread.files:
+    for db_file in page["files"]:
         files[db_file.filename] = db_file.content
     
-    # Limitar mensajes según el request
-    limited_messages = messages[-request.limit:] if request.limit < len(messages) else messages
-    
     return {
         "values": {
-            "messages": limited_messages,
+            "messages": messages,
             "todos": todos,
             "files": files
         },
         "metadata": {
-            "message_count": len(limited_messages),
+            "message_count": len(messages),
+            "total_message_count": page["message_count"],
             "files_count": len(files),
-            "todos_count": len(todos)
+            "todos_count": len(todos),
+            **_page_cursors(page)
         },
-        "thread_id": thread_id
+        "thread_id": thread_id,
+        "version": page["thread"].version or 0
     }
 
 @app.get("/threads/{thread_id}/history")
-async def get_thread_history_simple(thread_id: str):
-    """Obtener solo mensajes como array - Para compatibilidad con SDK"""
-    db_thread = await ThreadService.get_thread(thread_id)
-    if not db_thread:
+async def get_thread_history_simple(thread_id: str, response: Response, since: Optional[int] = None,
+                                    limit: int = 1000, before: Optional[int] = None,
+                                    after: Optional[int] = None):
+    """
+    Obtener solo mensajes como array - Para compatibilidad con SDK.
+    Con `since` devuelve solo los mensajes posteriores; la versión actual va en X-Thread-Version.
+    Sin cursores devuelve los últimos `limit` mensajes; `before`/`after` paginan por seq y
+    X-Has-More indica si quedan más en esa dirección.
+    """
+    await write_behind.wait_for_thread(thread_id)
+    if since is not None:
+        changes = await ThreadService.get_thread_changes(thread_id, since)
+        if not changes:
+            return []
+        response.headers["X-Thread-Version"] = str(changes["version"])
+        return [db_msg.to_dict() for db_msg in changes["messages"]]
+    
+    page = await ThreadService.get_message_page(thread_id, limit, before, after)
+    if not page:
         return []  # Devolver array vacío si no existe
     
     # Convertir solo mensajes a array
     messages = []
-    for db_msg in db_thread.messages:
+    for db_msg in page["messages"]:
         messages.append(db_msg.to_dict())
     
+    response.headers["X-Thread-Version"] = str(page["thread"].version or 0)
+    response.headers["X-Has-More"] = "true" if page["has_more"] else "false"
     return messages
 
 @app.get("/threads/{thread_id}/state")
-async def get_thread_state(thread_id: str):
+async def get_thread_state(thread_id: str, since: Optional[int] = None):
     """Obtener estado actual de un thread - Compatible con LangGraph API"""
+    await write_behind.wait_for_thread(thread_id)
+    if since is not None:
+        delta = await _get_thread_delta(thread_id, since)
+        if not delta:
+            raise HTTPException(status_code=404, detail="Thread no encontrado")
+        db_thread = delta["thread"]
+        return {
+            "values": delta["values"],
+            "next": [],
+            "metadata": delta["metadata"],
+            "created_at": db_thread.created_at.isoformat() + "Z" if db_thread.created_at else None,
+            "updated_at": db_thread.updated_at.isoformat() + "Z" if db_thread.updated_at else None,
+            "thread_id": thread_id,
+            "since": since,
+            "version": delta["version"]
+        }
+    
     db_thread = await ThreadService.get_thread(thread_id)
     if not db_thread:
         raise HTTPException(status_code=404, detail="Thread no encontrado")
@@ -975,7 +1423,8 @@ async def get_thread_state(thread_id: str):
         },
         "created_at": db_thread.created_at.isoformat() + "Z" if db_thread.created_at else None,
         "updated_at": db_thread.updated_at.isoformat() + "Z" if db_thread.updated_at else None,
-        "thread_id": thread_id
+        "thread_id": thread_id,
+        "version": db_thread.version or 0
     }
 
 if __name__ == "__main__":
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Benchmark de los índices añadidos por las migraciones.
+
+Crea una base de datos temporal con el esquema original (sin índices), la llena con
+datos sintéticos y muestra el plan de consulta (EXPLAIN QUERY PLAN) y el tiempo medio
+de las consultas más frecuentes antes y después de aplicar las migraciones.
+
+Uso:
+    python benchmark_migrations.py [--threads 2000] [--messages 50] [--repeat 20]
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, text
+
+from migrations import BASELINE_SCHEMA, upgrade
+
+QUERIES = {
+    "mensajes de un thread": "SELECT * FROM messages WHERE thread_id = :thread_id",
+    "archivos de un thread": "SELECT * FROM thread_files WHERE thread_id = :thread_id",
+    "todos de un thread": "SELECT * FROM thread_todos WHERE thread_id = :thread_id",
+    "búsqueda por updated_at": "SELECT id FROM threads ORDER BY updated_at DESC, id DESC LIMIT 30",
+    "búsqueda por created_at": "SELECT id FROM threads ORDER BY created_at DESC, id DESC LIMIT 30",
+}
+
+
+def populate(conn, threads: int, messages: int):
+    """Insertar threads con mensajes, archivos y todos sintéticos"""
+    start = datetime(2024, 1, 1)
+    thread_rows, message_rows, file_rows, todo_rows = [], [], [], []
+    for t in range(threads):
+        thread_id = f"thread-{t}"
+        created = start + timedelta(minutes=t)
+        thread_rows.append({"id": thread_id, "created_at": created,
+                            "updated_at": created + timedelta(minutes=random.randint(0, 10000))})
+        for m in range(messages):
+            message_rows.append({"id": f"{thread_id}-m{m}", "thread_id": thread_id,
+                                 "type": "human" if m % 2 == 0 else "ai",
+                                 "content": f"mensaje {m} " * 20,
+                                 "timestamp": created + timedelta(seconds=m)})
+        for f in range(3):
+            file_rows.append({"thread_id": thread_id, "filename": f"archivo_{f}.md", "content": "x" * 500})
+        for d in range(3):
+            todo_rows.append({"thread_id": thread_id, "content": f"tarea {d}", "status": "pending"})
+
+    conn.execute(text("INSERT INTO threads (id, created_at, updated_at) VALUES (:id, :created_at, :updated_at)"), thread_rows)
+    conn.execute(text("INSERT INTO messages (id, thread_id, type, content, timestamp) "
+                      "VALUES (:id, :thread_id, :type, :content, :timestamp)"), message_rows)
+    conn.execute(text("INSERT INTO thread_files (thread_id, filename, content) "
+                      "VALUES (:thread_id, :filename, :content)"), file_rows)
+    conn.execute(text("INSERT INTO thread_todos (thread_id, content, status) "
+                      "VALUES (:thread_id, :content, :status)"), todo_rows)
+
+
+def measure(engine, threads: int, repeat: int) -> dict:
+    """Plan de consulta y tiempo medio (ms) de cada consulta"""
+    results = {}
+    with engine.connect() as conn:
+        for label, sql in QUERIES.items():
+            params = {"thread_id": f"thread-{threads // 2}"}
+            plan = conn.execute(text(f"EXPLAIN QUERY PLAN {sql}"), params).all()
+            began = time.perf_counter()
+            for _ in range(repeat):
+                params["thread_id"] = f"thread-{random.randrange(threads)}"
+                conn.execute(text(sql), params).all()
+            elapsed_ms = (time.perf_counter() - began) * 1000 / repeat
+            results[label] = (" | ".join(str(row[-1]) for row in plan), elapsed_ms)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, default=2000)
+    parser.add_argument("--messages", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    db_path = os.path.join(tempfile.mkdtemp(), "benchmark.db")
+    engine = create_engine(f"sqlite:///{db_path}")
+    print(f"Base de datos temporal: {db_path}")
+    print(f"Generando {args.threads} threads x {args.messages} mensajes...")
+    with engine.begin() as conn:
+        for ddl in BASELINE_SCHEMA:
+            conn.execute(text(ddl))
+        populate(conn, args.threads, args.messages)
+
+    before = measure(engine, args.threads, args.repeat)
+    began = time.perf_counter()
+    with engine.begin() as conn:
+        upgrade(conn)
+    print(f"Migraciones aplicadas en {time.perf_counter() - began:.2f}s\n")
+    with engine.connect() as conn:
+        conn.execute(text("ANALYZE"))
+    after = measure(engine, args.threads, args.repeat)
+
+    for label in QUERIES:
+        plan_before, ms_before = before[label]
+        plan_after, ms_after = after[label]
+        print(f"== {label}")
+        print(f"   antes:   {ms_before:8.3f} ms  {plan_before}")
+        print(f"   después: {ms_after:8.3f} ms  {plan_after}")
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,37 +1,462 @@
 """
-Configuración y funciones de base de datos SQLite
+Configuración y funciones de base de datos (SQLite o Postgres)
 """
+import asyncio
 import os
-from sqlalchemy import create_engine
+import time
+from collections import OrderedDict
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.orm import sessionmaker
-from models import Base, Thread, Message, ThreadFile, ThreadTodo
-from typing import Optional, List, Dict, Any
+from models import Base, Thread, Message, FileBlob, ThreadFile, ThreadTodo, content_hash, compress_content, decompress_content
+from typing import Optional, List, Dict, Any, Tuple
 from datetime import datetime
 import uuid
 
+def async_database_url(url: str) -> str:
+    """
+    URL con el driver asíncrono: aiosqlite para SQLite y asyncpg para Postgres
+    (acepta postgres:// y postgresql://, como las que dan Render o Heroku)
+    """
+    from sqlalchemy.engine import make_url
+    
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    if backend == "sqlite":
+        return url.replace("sqlite://", "sqlite+aiosqlite://", 1) if parsed.drivername == "sqlite" else url
+    if backend in ("postgres", "postgresql"):
+        parsed = parsed.set(drivername="postgresql+asyncpg")
+        if "sslmode" in parsed.query:
+            # asyncpg recibe el modo SSL como `ssl`
+            parsed = parsed.update_query_dict({"ssl": parsed.query["sslmode"]}).difference_update_query(["sslmode"])
+        return parsed.render_as_string(hide_password=False)
+    return url
+
+def redact_database_url(url: str) -> str:
+    """URL de la base de datos sin la contraseña, para mostrarla (por ejemplo en /health)"""
+    from sqlalchemy.engine import make_url
+    
+    return make_url(url).render_as_string(hide_password=True)
+
 # Configuración de la base de datos
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///threads.db")
-ASYNC_DATABASE_URL = DATABASE_URL.replace("sqlite://", "sqlite+aiosqlite://")
+ASYNC_DATABASE_URL = async_database_url(DATABASE_URL)
+IS_SQLITE = DATABASE_URL.startswith("sqlite")
+IS_POSTGRES = DATABASE_URL.startswith(("postgres://", "postgresql"))
+
+# Perfil de rendimiento SQLite aplicado a cada conexión nueva (orden relevante:
+# auto_vacuum solo tiene efecto si se fija antes de crear las tablas)
+SQLITE_PRAGMAS: List[Tuple[str, str]] = [
+    ("auto_vacuum", os.getenv("SQLITE_AUTO_VACUUM", "INCREMENTAL")),
+    ("journal_mode", os.getenv("SQLITE_JOURNAL_MODE", "WAL")),
+    ("synchronous", os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")),
+    ("busy_timeout", os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000")),
+    # cache_size negativo = KiB
+    ("cache_size", str(-abs(int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536"))))),
+    ("mmap_size", os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+    ("temp_store", os.getenv("SQLITE_TEMP_STORE", "MEMORY")),
+    ("journal_size_limit", os.getenv("SQLITE_JOURNAL_SIZE_LIMIT", str(64 * 1024 * 1024))),
+    ("foreign_keys", os.getenv("SQLITE_FOREIGN_KEYS", "ON")),
+]
+
+def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+    """Aplicar SQLITE_PRAGMAS al abrir una conexión (sync o aiosqlite)"""
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in SQLITE_PRAGMAS:
+            if value != "":
+                cursor.execute(f"PRAGMA {name}={value}")
+    finally:
+        cursor.close()
+
+# Pragmas de las conexiones de solo lectura (el resto son propiedades del archivo o de escritura)
+SQLITE_READER_PRAGMAS: List[Tuple[str, str]] = [
+    (name, value) for name, value in SQLITE_PRAGMAS
+    if name not in ("auto_vacuum", "journal_mode", "journal_size_limit")
+] + [("query_only", "ON")]
+
+def _apply_sqlite_reader_pragmas(dbapi_connection, connection_record):
+    """Aplicar SQLITE_READER_PRAGMAS al abrir una conexión lectora"""
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in SQLITE_READER_PRAGMAS:
+            if value != "":
+                cursor.execute(f"PRAGMA {name}={value}")
+    finally:
+        cursor.close()
+
+def _use_explicit_begin(engine_, begin_sql: str):
+    """
+    Desactivar el BEGIN implícito de pysqlite y emitir begin_sql al abrir cada transacción.
+    BEGIN IMMEDIATE en el escritor toma el lock de escritura al empezar (en vez de fallar
+    con "database is locked" al promocionar una lectura); BEGIN en los lectores da a cada
+    sesión una instantánea consistente del WAL.
+    """
+    @event.listens_for(engine_, "connect")
+    def _disable_implicit_begin(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+    
+    @event.listens_for(engine_, "begin")
+    def _begin(conn):
+        # Las conexiones AUTOCOMMIT (pragmas de mantenimiento) no abren transacción
+        if conn.get_execution_options().get("isolation_level") != "AUTOCOMMIT":
+            conn.exec_driver_sql(begin_sql)
+
+def _sqlite_reader_url() -> Optional[str]:
+    """URL de solo lectura (mode=ro) para el pool de lectores, o None si la base no es un archivo"""
+    from urllib.parse import quote
+    from sqlalchemy.engine import make_url
+    
+    path = make_url(DATABASE_URL).database
+    if not path or path == ":memory:" or path.startswith("file:"):
+        return None
+    return f"sqlite+aiosqlite:///file:{quote(os.path.abspath(path))}?mode=ro&uri=true"
 
-# Motores de base de datos
-engine = create_engine(DATABASE_URL, echo=False)
-async_engine = create_async_engine(ASYNC_DATABASE_URL, echo=False)
+DB_READER_POOL_SIZE = int(os.getenv("DB_READER_POOL_SIZE", str(min(os.cpu_count() or 4, 8))))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# Pool de Postgres (por réplica: el total de conexiones es réplicas x (size + overflow))
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+# Caché de sentencias preparadas por conexión (0 detrás de pgbouncer en modo transaction)
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "500"))
+# Réplica de lectura opcional para AsyncReplicaSessionLocal (solo consultas que toleran retraso)
+DATABASE_READ_URL = os.getenv("DATABASE_READ_URL")
 
-# Sessions
+def _create_postgres_engine(url: str):
+    """Motor asyncpg con pool dimensionado, pre_ping y caché de sentencias preparadas"""
+    from sqlalchemy.engine import make_url
+    
+    async_url = make_url(async_database_url(url)).update_query_dict(
+        {"prepared_statement_cache_size": str(DB_STATEMENT_CACHE_SIZE)}
+    )
+    return create_async_engine(
+        async_url, echo=False,
+        pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE, pool_pre_ping=True,
+        connect_args={
+            "statement_cache_size": DB_STATEMENT_CACHE_SIZE,
+            "server_settings": {"application_name": "lois-agent-backend"}
+        }
+    )
+
+# Motores de base de datos. El síncrono (init_database, scripts) solo existe con SQLite:
+# con Postgres todo el acceso va por asyncpg
+engine = create_engine(DATABASE_URL, echo=False) if IS_SQLITE else None
+if IS_SQLITE:
+    from sqlalchemy.pool import AsyncAdaptedQueuePool
+    
+    # Un único escritor serializado (el resto de escrituras espera turno en el pool) ...
+    async_engine = create_async_engine(
+        ASYNC_DATABASE_URL, echo=False, poolclass=AsyncAdaptedQueuePool,
+        pool_size=1, max_overflow=0, pool_timeout=DB_POOL_TIMEOUT
+    )
+    event.listen(engine, "connect", _apply_sqlite_pragmas)
+    event.listen(async_engine.sync_engine, "connect", _apply_sqlite_pragmas)
+    _use_explicit_begin(async_engine.sync_engine, "BEGIN IMMEDIATE")
+    
+    # ... y un pool de lectores de solo lectura que en WAL no bloquean ni son bloqueados
+    _reader_url = _sqlite_reader_url()
+    if _reader_url:
+        async_read_engine = create_async_engine(
+            _reader_url, echo=False, poolclass=AsyncAdaptedQueuePool,
+            pool_size=max(1, DB_READER_POOL_SIZE), max_overflow=0, pool_timeout=DB_POOL_TIMEOUT
+        )
+        event.listen(async_read_engine.sync_engine, "connect", _apply_sqlite_reader_pragmas)
+        _use_explicit_begin(async_read_engine.sync_engine, "BEGIN")
+    else:
+        async_read_engine = async_engine
+elif IS_POSTGRES:
+    # Postgres admite escritores concurrentes: un pool normal compartido por todas las réplicas
+    # Las lecturas de un thread van al primario: suelen seguir a una escritura de la misma
+    # petición (la respuesta de /chat, el GET tras el chat) y una réplica con retraso no la vería
+    async_engine = _create_postgres_engine(DATABASE_URL)
+    async_read_engine = async_engine
+else:
+    async_engine = create_async_engine(ASYNC_DATABASE_URL, echo=False)
+    async_read_engine = async_engine
+
+# La réplica de lectura (Postgres) solo sirve listados y estadísticas, que toleran retraso
+if IS_POSTGRES and DATABASE_READ_URL:
+    async_replica_engine = _create_postgres_engine(DATABASE_READ_URL)
+else:
+    async_replica_engine = async_read_engine
+
+# Sessions: AsyncSessionLocal escribe, AsyncReadSessionLocal lee (viendo lo ya escrito) y
+# AsyncReplicaSessionLocal lee lo que puede llegar con retraso
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 AsyncSessionLocal = async_sessionmaker(async_engine)
+AsyncReadSessionLocal = async_sessionmaker(async_read_engine)
+AsyncReplicaSessionLocal = async_sessionmaker(async_replica_engine)
 
 def init_database():
-    """Inicializar la base de datos creando todas las tablas"""
-    Base.metadata.create_all(bind=engine)
+    """Inicializar la base de datos: crear tablas y aplicar migraciones pendientes"""
+    from migrations import upgrade
+    
+    if engine is None:
+        asyncio.run(async_init_database())
+        return
+    with engine.begin() as conn:
+        upgrade(conn)
     print("Base de datos SQLite inicializada correctamente")
 
 async def async_init_database():
     """Inicializar la base de datos de forma asíncrona"""
+    from migrations import upgrade
+    
     async with async_engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
-    print("Base de datos SQLite inicializada correctamente (async)")
+        if IS_POSTGRES:
+            # Varias réplicas pueden arrancar a la vez: solo una aplica las migraciones
+            await conn.exec_driver_sql("SELECT pg_advisory_xact_lock(7265921)")
+        await conn.run_sync(upgrade)
+    print(f"Base de datos {async_engine.dialect.name} inicializada correctamente (async)")
+
+async def dispose_engines():
+    """Cerrar las conexiones de los pools (y los hilos de aiosqlite) al apagar la aplicación"""
+    await async_engine.dispose()
+    if async_read_engine is not async_engine:
+        await async_read_engine.dispose()
+    if async_replica_engine is not async_read_engine:
+        await async_replica_engine.dispose()
+
+def encode_thread_cursor(sort_value: Optional[datetime], thread_id: str) -> str:
+    """Cursor opaco de paginación keyset con el formato <timestamp ISO>|<thread_id>"""
+    return f"{sort_value.isoformat() if sort_value else ''}|{thread_id}"
+
+def decode_thread_cursor(cursor: str) -> tuple:
+    """Decodificar un cursor generado por encode_thread_cursor"""
+    try:
+        sort_value, thread_id = cursor.split("|", 1)
+        return datetime.fromisoformat(sort_value), thread_id
+    except ValueError:
+        raise ValueError(f"Cursor inválido: {cursor}")
+
+class ThreadCache:
+    """
+    Caché LRU en memoria de threads hidratados (mensajes, archivos y todos) para get_thread.
+    Cada entrada caduca a los ttl_seconds y el total se limita por número de entradas y por
+    un tamaño estimado en bytes. Las mutaciones de ThreadService invalidan el thread, y una
+    carga que coincide con una invalidación no se guarda (evita volver a cachear datos viejos).
+    Los threads devueltos son compartidos: se deben tratar como de solo lectura.
+    """
+    
+    def __init__(self, max_entries: int = 256, max_bytes: int = 64 * 1024 * 1024, ttl_seconds: float = 60):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        # thread_id -> (thread, tamaño estimado, caducidad)
+        self._entries: "OrderedDict[str, Tuple[Thread, int, float]]" = OrderedDict()
+        # thread_id -> [cargas en curso, invalidaciones durante esas cargas]
+        self._loading: Dict[str, List[int]] = {}
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._invalidations = 0
+    
+    @classmethod
+    def from_env(cls) -> "ThreadCache":
+        return cls(
+            # Con Postgres hay varias réplicas y la invalidación es local: desactivada por defecto
+            max_entries=int(os.getenv("THREAD_CACHE_MAX_ENTRIES", "256" if IS_SQLITE else "0")),
+            max_bytes=int(os.getenv("THREAD_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+            ttl_seconds=float(os.getenv("THREAD_CACHE_TTL_SECONDS", "60")),
+        )
+    
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 and self.max_bytes > 0 and self.ttl_seconds > 0
+    
+    @staticmethod
+    def estimate_size(thread: Thread) -> int:
+        """Tamaño aproximado en memoria de un thread hidratado"""
+        size = 512
+        for message in thread.messages:
+            size += 256 + len(message.content or "") + len(message.display_text or "")
+        for file in thread.files:
+            size += 256 + (file.blob.size if file.blob is not None else len(file.legacy_content or ""))
+        for todo in thread.todos:
+            size += 128 + len(todo.content or "") + len(todo.active_form or "")
+        return size
+    
+    def get(self, thread_id: str) -> Optional[Thread]:
+        entry = self._entries.get(thread_id)
+        if entry is not None and entry[2] > time.monotonic():
+            self._entries.move_to_end(thread_id)
+            self._hits += 1
+            return entry[0]
+        if entry is not None:
+            self._discard(thread_id)
+        self._misses += 1
+        return None
+    
+    def begin_load(self, thread_id: str) -> int:
+        """Registrar una carga desde la base de datos; devuelve el token que espera put()"""
+        loading = self._loading.setdefault(thread_id, [0, 0])
+        loading[0] += 1
+        return loading[1]
+    
+    def end_load(self, thread_id: str):
+        loading = self._loading.get(thread_id)
+        if loading is not None:
+            loading[0] -= 1
+            if loading[0] <= 0:
+                del self._loading[thread_id]
+    
+    def put(self, thread_id: str, thread: Thread, token: int):
+        """Guardar un thread cargado, salvo que se haya invalidado mientras se cargaba"""
+        loading = self._loading.get(thread_id)
+        if not self.enabled or (loading is not None and loading[1] != token):
+            return
+        size = self.estimate_size(thread)
+        if size > self.max_bytes:
+            return
+        self._discard(thread_id)
+        self._entries[thread_id] = (thread, size, time.monotonic() + self.ttl_seconds)
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._discard(oldest)
+            self._evictions += 1
+    
+    def invalidate(self, thread_id: str):
+        """Olvidar un thread tras modificarlo"""
+        loading = self._loading.get(thread_id)
+        if loading is not None:
+            loading[1] += 1
+        if self._discard(thread_id):
+            self._invalidations += 1
+    
+    def clear(self):
+        self._entries.clear()
+        self._bytes = 0
+    
+    def _discard(self, thread_id: str) -> bool:
+        entry = self._entries.pop(thread_id, None)
+        if entry is None:
+            return False
+        self._bytes -= entry[1]
+        return True
+    
+    def stats(self) -> Dict[str, Any]:
+        """Métricas de la caché para /health"""
+        lookups = self._hits + self._misses
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self._hits,
+            "misses": self._misses,
+            "hit_rate": round(self._hits / lookups, 4) if lookups else None,
+            "evictions": self._evictions,
+            "invalidations": self._invalidations,
+        }
+
+thread_cache = ThreadCache.from_env()
+
+class ThreadLoader:
+    """
+    Carga por lotes de get_thread al estilo DataLoader: las peticiones de threads que
+    llegan en la misma vuelta del event loop se resuelven con una sola consulta
+    (Thread.id IN (...), más un IN por relación con selectinload), y las peticiones de un
+    thread que ya se está cargando comparten esa carga.
+    """
+    
+    def __init__(self, max_batch_size: int = 100):
+        self.max_batch_size = max_batch_size
+        self._inflight: Dict[str, asyncio.Future] = {}
+        # Cada petición encolada lleva su futuro: forget() solo lo desliga de _inflight
+        self._queue: List[Tuple[str, asyncio.Future]] = []
+        self._dispatch_task: Optional[asyncio.Task] = None
+        self._loads = 0
+        self._shared = 0
+        self._batches = 0
+        self._largest_batch = 0
+    
+    async def load(self, thread_id: str) -> Optional[Thread]:
+        future = self._inflight.get(thread_id)
+        if future is not None:
+            self._shared += 1
+        else:
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self._inflight[thread_id] = future
+            self._queue.append((thread_id, future))
+            self._loads += 1
+            task = self._dispatch_task
+            if task is None or task.done() or task.get_loop() is not loop:
+                # La tarea arranca en la siguiente vuelta del loop: agrupa lo pedido hasta entonces
+                self._dispatch_task = loop.create_task(self._dispatch())
+        # shield: cancelar a quien espera no cancela la carga compartida
+        return await asyncio.shield(future)
+    
+    def forget(self, thread_id: str):
+        """
+        Tras una escritura, las nuevas peticiones no se unen a una carga anterior a ella.
+        La carga olvidada sigue en curso (o en la cola) y resuelve a quienes ya esperaban.
+        """
+        self._inflight.pop(thread_id, None)
+    
+    async def _dispatch(self):
+        while self._queue:
+            batch, self._queue = self._queue[:self.max_batch_size], self._queue[self.max_batch_size:]
+            self._batches += 1
+            self._largest_batch = max(self._largest_batch, len(batch))
+            tokens = [thread_cache.begin_load(thread_id) for thread_id, _ in batch]
+            try:
+                threads = await self._fetch(list(dict.fromkeys(thread_id for thread_id, _ in batch)))
+            except Exception as e:
+                for thread_id, future in batch:
+                    self._resolve(thread_id, future, exception=e)
+            else:
+                for (thread_id, future), token in zip(batch, tokens):
+                    thread = threads.get(thread_id)
+                    if thread is not None:
+                        thread_cache.put(thread_id, thread, token)
+                    self._resolve(thread_id, future, result=thread)
+            finally:
+                for thread_id, _ in batch:
+                    thread_cache.end_load(thread_id)
+    
+    def _resolve(self, thread_id: str, future: asyncio.Future, result=None, exception=None):
+        if self._inflight.get(thread_id) is future:
+            del self._inflight[thread_id]
+        if not future.done():
+            if exception is not None:
+                future.set_exception(exception)
+            else:
+                future.set_result(result)
+    
+    @staticmethod
+    async def _fetch(thread_ids: List[str]) -> Dict[str, Thread]:
+        async with AsyncReadSessionLocal() as session:
+            from sqlalchemy.orm import selectinload
+            from sqlalchemy import select
+            
+            stmt = select(Thread).options(
+                selectinload(Thread.messages),
+                selectinload(Thread.files),
+                selectinload(Thread.todos)
+            ).where(Thread.id.in_(thread_ids))
+            
+            result = await session.execute(stmt)
+            return {thread.id: thread for thread in result.scalars().all()}
+    
+    def stats(self) -> Dict[str, Any]:
+        """Métricas del cargador para /health"""
+        return {
+            "loads": self._loads,
+            "shared_loads": self._shared,
+            "batches": self._batches,
+            "avg_batch_size": round(self._loads / self._batches, 2) if self._batches else None,
+            "largest_batch": self._largest_batch,
+            "in_flight": len(self._inflight),
+        }
+
+thread_loader = ThreadLoader(max_batch_size=int(os.getenv("THREAD_LOADER_MAX_BATCH", "100")))
 
 class ThreadService:
     """Servicio para manejar operaciones de threads en la base de datos"""
@@ -44,46 +469,69 @@ class ThreadService:
             session.add(thread)
             await session.commit()
             await session.refresh(thread)
+            ThreadService._invalidate(thread.id)
             return thread
     
     @staticmethod
     async def get_thread(thread_id: str) -> Optional[Thread]:
-        """Obtener un thread por ID"""
+        """
+        Obtener un thread por ID: desde thread_cache si está cacheado y si no con
+        thread_loader, que agrupa las lecturas concurrentes en una sola consulta
+        """
+        thread = thread_cache.get(thread_id)
+        if thread is not None:
+            return thread
+        return await thread_loader.load(thread_id)
+    
+    @staticmethod
+    def _invalidate(thread_id: str):
+        """Invalidar la caché y las cargas en curso de un thread tras modificarlo"""
+        thread_cache.invalidate(thread_id)
+        thread_loader.forget(thread_id)
+    
+    @staticmethod
+    async def ensure_thread(thread_id: str) -> bool:
+        """
+        Asegurar que el thread existe sin cargar nada (INSERT ... ON CONFLICT DO NOTHING).
+        Es seguro con peticiones concurrentes; devuelve True si se acaba de crear.
+        """
         async with AsyncSessionLocal() as session:
-            from sqlalchemy.orm import selectinload
-            from sqlalchemy import select
-            
-            stmt = select(Thread).options(
-                selectinload(Thread.messages),
-                selectinload(Thread.files),
-                selectinload(Thread.todos)
-            ).where(Thread.id == thread_id)
-            
-            result = await session.execute(stmt)
-            return result.scalar_one_or_none()
+            async with session.begin():
+                created = await ThreadService._ensure_thread_row(session, thread_id)
+        if created:
+            ThreadService._invalidate(thread_id)
+        return created
     
     @staticmethod
     async def get_or_create_thread(thread_id: str) -> Thread:
         """Obtener un thread existente o crear uno nuevo"""
-        thread = await ThreadService.get_thread(thread_id)
-        if not thread:
-            thread = await ThreadService.create_thread(thread_id)
-        return thread
+        await ThreadService.ensure_thread(thread_id)
+        return await ThreadService.get_thread(thread_id)
+    
+    @staticmethod
+    def _apply_thread_ordering(stmt, sort_by: str, sort_order: str, cursor: Optional[str] = None):
+        """Aplicar ordenamiento y paginación keyset (sort_col, id) a una consulta de threads"""
+        from sqlalchemy import desc, asc, tuple_
+        
+        sort_col = Thread.updated_at if sort_by == "updated_at" else Thread.created_at
+        descending = sort_order == "desc"
+        
+        if cursor:
+            cursor_ts, cursor_id = decode_thread_cursor(cursor)
+            key = tuple_(sort_col, Thread.id)
+            stmt = stmt.where(key < (cursor_ts, cursor_id) if descending else key > (cursor_ts, cursor_id))
+        
+        order = desc if descending else asc
+        return stmt.order_by(order(sort_col), order(Thread.id))
     
     @staticmethod
     async def search_threads(limit: int = 30, offset: int = 0, 
-                           sort_by: str = "created_at", sort_order: str = "desc") -> List[Thread]:
-        """Buscar threads con paginación y ordenamiento"""
-        async with AsyncSessionLocal() as session:
+                           sort_by: str = "created_at", sort_order: str = "desc",
+                           cursor: Optional[str] = None) -> List[Thread]:
+        """Buscar threads con paginación y ordenamiento (carga completa de mensajes, archivos y todos)"""
+        async with AsyncReplicaSessionLocal() as session:
             from sqlalchemy.orm import selectinload
-            from sqlalchemy import select, desc, asc
-            
-            # Debug: Contar threads totales primero
-            from sqlalchemy import func
-            count_stmt = select(func.count(Thread.id))
-            count_result = await session.execute(count_stmt)
-            total_count = count_result.scalar()
-            print(f"🔍 DEBUG: Total threads in DB: {total_count}")
+            from sqlalchemy import select
             
             stmt = select(Thread).options(
                 selectinload(Thread.messages),
@@ -91,94 +539,507 @@ class ThreadService:
                 selectinload(Thread.todos)
             )
             
-            # Aplicar ordenamiento
-            if sort_by == "created_at":
-                if sort_order == "desc":
-                    stmt = stmt.order_by(desc(Thread.created_at))
-                else:
-                    stmt = stmt.order_by(asc(Thread.created_at))
-            elif sort_by == "updated_at":
-                if sort_order == "desc":
-                    stmt = stmt.order_by(desc(Thread.updated_at))
-                else:
-                    stmt = stmt.order_by(asc(Thread.updated_at))
-            
-            # Aplicar paginación
-            stmt = stmt.offset(offset).limit(limit)
+            # Aplicar ordenamiento y paginación
+            stmt = ThreadService._apply_thread_ordering(stmt, sort_by, sort_order, cursor)
+            if not cursor:
+                stmt = stmt.offset(offset)
+            stmt = stmt.limit(limit)
             
             result = await session.execute(stmt)
-            threads = result.scalars().all()
-            print(f"🔍 DEBUG: Found {len(threads)} threads with query")
+            return result.scalars().all()
+    
+    @staticmethod
+    async def search_thread_summaries(limit: int = 30, offset: int = 0,
+                                      sort_by: str = "created_at", sort_order: str = "desc",
+                                      cursor: Optional[str] = None,
+                                      preview_chars: int = 200) -> List[Dict[str, Any]]:
+        """
+        Buscar threads en modo resumen: sin cargar mensajes ni archivos.
+        Los conteos y la vista previa del primer mensaje se calculan con subconsultas SQL.
+        """
+        async with AsyncReplicaSessionLocal() as session:
+            from sqlalchemy import select, func
+            
+            message_count = select(func.count(Message.id)).where(
+                Message.thread_id == Thread.id
+            ).correlate(Thread).scalar_subquery()
+            files_count = select(func.count(ThreadFile.id)).where(
+                ThreadFile.thread_id == Thread.id
+            ).correlate(Thread).scalar_subquery()
+            todos_count = select(func.count(ThreadTodo.id)).where(
+                ThreadTodo.thread_id == Thread.id
+            ).correlate(Thread).scalar_subquery()
+            first_message = select(func.substr(func.coalesce(Message.display_text, Message.content), 1, preview_chars)).where(
+                Message.thread_id == Thread.id,
+                Message.type == "human"
+            ).order_by(Message.seq.asc()).limit(1).correlate(Thread).scalar_subquery()
             
-            return threads
+            stmt = select(
+                Thread.id,
+                Thread.created_at,
+                Thread.updated_at,
+                Thread.thread_metadata,
+                message_count.label("message_count"),
+                files_count.label("files_count"),
+                todos_count.label("todos_count"),
+                first_message.label("preview")
+            )
+            
+            stmt = ThreadService._apply_thread_ordering(stmt, sort_by, sort_order, cursor)
+            if not cursor:
+                stmt = stmt.offset(offset)
+            stmt = stmt.limit(limit)
+            
+            result = await session.execute(stmt)
+            sort_key = "updated_at" if sort_by == "updated_at" else "created_at"
+            summaries = []
+            for row in result.mappings():
+                preview = row["preview"] or ""
+                metadata = row["thread_metadata"] or {}
+                summaries.append({
+                    "thread_id": row["id"],
+                    "created_at": row["created_at"],
+                    "updated_at": row["updated_at"],
+                    "metadata": metadata,
+                    "title": metadata.get("title") or preview.strip().split("\n", 1)[0][:80],
+                    "preview": preview,
+                    "message_count": row["message_count"],
+                    "files_count": row["files_count"],
+                    "todos_count": row["todos_count"],
+                    "cursor": encode_thread_cursor(row[sort_key], row["id"])
+                })
+            return summaries
+    
+    @staticmethod
+    async def _ensure_thread_row(session, thread_id: str) -> bool:
+        """INSERT ... ON CONFLICT DO NOTHING del thread dentro de la sesión; True si se insertó"""
+        now = datetime.utcnow()
+        if session.bind.dialect.name == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        
+        result = await session.execute(
+            insert(Thread.__table__)
+            .values(id=thread_id, created_at=now, updated_at=now, thread_metadata={},
+                    version=0, todos_version=0, message_seq=0)
+            .on_conflict_do_nothing(index_elements=["id"])
+        )
+        return result.rowcount == 1
+    
+    @staticmethod
+    async def _bump_version(session, thread_id: str, reserve_messages: int = 0) -> Tuple[int, int]:
+        """
+        Incrementar la versión del thread y devolver (nueva versión, último seq reservado),
+        reservando además `reserve_messages` números de seq. Es un único UPDATE ... RETURNING
+        que toma el lock de escritura, así que dos escritores concurrentes nunca obtienen la
+        misma versión ni el mismo seq. Si el thread no existe se crea con _ensure_thread_row,
+        sin cargarlo: en el caso habitual el thread solo cuesta esta sentencia.
+        """
+        from sqlalchemy import update
+        
+        stmt = (
+            update(Thread)
+            .where(Thread.id == thread_id)
+            .values(
+                version=Thread.version + 1,
+                message_seq=Thread.message_seq + reserve_messages,
+                updated_at=datetime.utcnow()
+            )
+            .returning(Thread.version, Thread.message_seq)
+            .execution_options(synchronize_session=False)
+        )
+        row = (await session.execute(stmt)).first()
+        if row is None:
+            await ThreadService._ensure_thread_row(session, thread_id)
+            row = (await session.execute(stmt)).one()
+        return row[0], row[1]
     
     @staticmethod
     async def add_message(thread_id: str, message_data: Dict[str, Any]) -> Message:
         """Agregar un mensaje a un thread"""
-        async with AsyncSessionLocal() as session:
-            # Asegurar que el thread existe
-            await ThreadService.get_or_create_thread(thread_id)
-            
-            message = Message(
+        async with AsyncSessionLocal(expire_on_commit=False) as session:
+            async with session.begin():
+                # Asegurar que el thread existe, avanzar su versión y reservar el seq del mensaje
+                version, message_seq = await ThreadService._bump_version(session, thread_id, reserve_messages=1)
+                
+                message = Message(
+                    id=message_data.get("id"),
+                    thread_id=thread_id,
+                    type=message_data.get("type"),
+                    content=message_data.get("content"),
+                    tool_calls=message_data.get("tool_calls"),
+                    tool_call_id=message_data.get("tool_call_id"),
+                    version=version,
+                    seq=message_seq
+                )
+                session.add(message)
+            ThreadService._invalidate(thread_id)
+            return message
+    
+    @staticmethod
+    async def add_messages(thread_id: str, messages_data: List[Dict[str, Any]],
+                           todos_list: Optional[List[Dict[str, Any]]] = None,
+                           files_dict: Optional[Dict[str, str]] = None) -> List[Message]:
+        """
+        Guardar en una sola transacción los mensajes de una ejecución, sus todos y archivos
+        (si se indican) y el updated_at del thread, creando el thread si no existe.
+        """
+        async with AsyncSessionLocal(expire_on_commit=False) as session:
+            async with session.begin():
+                messages = await ThreadService._write_run(session, thread_id, messages_data, todos_list, files_dict)
+            ThreadService._invalidate(thread_id)
+            return messages
+    
+    @staticmethod
+    async def add_runs(runs: List[Tuple[str, List[Dict[str, Any]], Optional[List[Dict[str, Any]]], Optional[Dict[str, str]]]]):
+        """
+        Guardar varias ejecuciones (thread_id, mensajes, todos, archivos) en una sola
+        transacción, en orden. La usa la cola write-behind para agrupar escrituras.
+        """
+        async with AsyncSessionLocal(expire_on_commit=False) as session:
+            async with session.begin():
+                for thread_id, messages_data, todos_list, files_dict in runs:
+                    await ThreadService._write_run(session, thread_id, messages_data, todos_list, files_dict)
+            for thread_id in {run[0] for run in runs}:
+                ThreadService._invalidate(thread_id)
+    
+    @staticmethod
+    async def _write_run(session, thread_id: str, messages_data: List[Dict[str, Any]],
+                         todos_list: Optional[List[Dict[str, Any]]],
+                         files_dict: Optional[Dict[str, str]]) -> List[Message]:
+        """Escribir una ejecución dentro de la sesión indicada (ver add_messages)"""
+        version, message_seq = await ThreadService._bump_version(
+            session, thread_id, reserve_messages=len(messages_data)
+        )
+        
+        first_seq = message_seq - len(messages_data) + 1
+        messages = [
+            Message(
                 id=message_data.get("id"),
                 thread_id=thread_id,
                 type=message_data.get("type"),
                 content=message_data.get("content"),
                 tool_calls=message_data.get("tool_calls"),
-                tool_call_id=message_data.get("tool_call_id")
+                tool_call_id=message_data.get("tool_call_id"),
+                version=version,
+                seq=first_seq + offset
+            )
+            for offset, message_data in enumerate(messages_data)
+        ]
+        session.add_all(messages)
+        
+        if todos_list is not None:
+            await ThreadService._replace_thread_todos(session, thread_id, todos_list, version)
+        if files_dict is not None:
+            await ThreadService._replace_thread_files(session, thread_id, files_dict, version)
+        return messages
+    
+    @staticmethod
+    async def _upsert(session, model, rows: List[Dict[str, Any]], key: List[str], update_columns: List[str]):
+        """
+        INSERT ... ON CONFLICT (key) DO UPDATE de varias filas en una sola sentencia
+        (DO NOTHING si no hay columnas que actualizar)
+        """
+        if not rows:
+            return
+        if session.bind.dialect.name == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        
+        stmt = insert(model.__table__).values(rows)
+        if not update_columns:
+            await session.execute(stmt.on_conflict_do_nothing(index_elements=key))
+            return
+        await session.execute(stmt.on_conflict_do_update(
+            index_elements=key,
+            set_={column: stmt.excluded[column] for column in update_columns}
+        ))
+    
+    @staticmethod
+    async def _lock_file_blobs(session, hashes) -> set:
+        """
+        Bloquear (SELECT ... FOR UPDATE, en orden de hash) los blobs existentes entre los
+        indicados y devolver cuáles existen. Con escritores concurrentes (Postgres) evita que
+        otra transacción elimine un blob que esta va a referenciar: quien lo deje a cero espera
+        a que esta confirme su +1, y si ya lo eliminó, aquí no aparece y se vuelve a crear.
+        En SQLite no hace falta (un único escritor) y FOR UPDATE no se emite.
+        """
+        from sqlalchemy import select
+        
+        hashes = sorted({digest for digest in hashes if digest})
+        if not hashes:
+            return set()
+        result = await session.execute(
+            select(FileBlob.hash).where(FileBlob.hash.in_(hashes)).order_by(FileBlob.hash).with_for_update()
+        )
+        return set(result.scalars().all())
+    
+    @staticmethod
+    async def _store_file_blobs(session, contents: Dict[str, str], lock_hashes=()):
+        """
+        Guardar comprimidos los contenidos (hash -> texto) que aún no tengan blob, dejando
+        bloqueados esos blobs y los de lock_hashes hasta el final de la transacción
+        """
+        stored = await ThreadService._lock_file_blobs(session, set(contents) | set(lock_hashes))
+        if not contents:
+            return
+        rows = []
+        for digest, content in contents.items():
+            if digest in stored:
+                continue
+            codec, data = compress_content(content)
+            rows.append({
+                "hash": digest,
+                "codec": codec,
+                "data": data,
+                "size": len((content or "").encode("utf-8")),
+                "ref_count": 0,
+                "created_at": datetime.utcnow()
+            })
+        await ThreadService._upsert(session, FileBlob, rows, ["hash"], [])
+    
+    @staticmethod
+    async def _adjust_blob_refs(session, deltas: Dict[str, int]):
+        """Aplicar los cambios de referencias a los blobs y eliminar los que queden sin ninguna"""
+        from sqlalchemy import update, delete, bindparam
+        
+        # En orden de hash, como los bloqueos de _lock_file_blobs, para no provocar interbloqueos
+        deltas = {digest: delta for digest, delta in sorted(deltas.items()) if digest and delta}
+        if not deltas:
+            return
+        await session.execute(
+            update(FileBlob.__table__)
+            .where(FileBlob.__table__.c.hash == bindparam("b_hash"))
+            .values(ref_count=FileBlob.__table__.c.ref_count + bindparam("b_delta")),
+            [{"b_hash": digest, "b_delta": delta} for digest, delta in deltas.items()]
+        )
+        released = [digest for digest, delta in deltas.items() if delta < 0]
+        if released:
+            await session.execute(
+                delete(FileBlob).where(FileBlob.hash.in_(released), FileBlob.ref_count <= 0)
+            )
+    
+    @staticmethod
+    async def _replace_thread_files(session, thread_id: str, files_dict: Dict[str, str], version: int):
+        """
+        Sincronizar los archivos de un thread dentro de la sesión indicada: se compara el
+        hash del contenido (sin leerlo), solo se hace upsert de los nuevos o modificados
+        (marcados con la versión) y solo se borran los eliminados. El contenido se guarda
+        una sola vez en file_blobs y las filas solo apuntan a su hash.
+        """
+        from sqlalchemy import select, delete
+        
+        result = await session.execute(
+            select(ThreadFile.filename, ThreadFile.content_hash).where(ThreadFile.thread_id == thread_id)
+        )
+        existing = dict(result.all())
+        ref_deltas: Dict[str, int] = {}
+        
+        removed = [filename for filename in existing if filename not in files_dict]
+        if removed:
+            await session.execute(
+                delete(ThreadFile).where(ThreadFile.thread_id == thread_id, ThreadFile.filename.in_(removed))
+            )
+            for filename in removed:
+                ref_deltas[existing[filename]] = ref_deltas.get(existing[filename], 0) - 1
+        
+        changed = []
+        contents = {}
+        for filename, content in files_dict.items():
+            digest = content_hash(content)
+            if existing.get(filename) == digest:
+                continue
+            contents[digest] = content
+            ref_deltas[digest] = ref_deltas.get(digest, 0) + 1
+            if filename in existing:
+                ref_deltas[existing[filename]] = ref_deltas.get(existing[filename], 0) - 1
+            changed.append({
+                "thread_id": thread_id,
+                "filename": filename,
+                "content": None,
+                "content_hash": digest,
+                "version": version,
+                "created_at": datetime.utcnow()
+            })
+        
+        await ThreadService._store_file_blobs(session, contents, lock_hashes=ref_deltas)
+        await ThreadService._upsert(session, ThreadFile, changed, ["thread_id", "filename"],
+                                    ["content", "content_hash", "version"])
+        await ThreadService._adjust_blob_refs(session, ref_deltas)
+    
+    @staticmethod
+    async def _replace_thread_todos(session, thread_id: str, todos_list: List[Dict[str, Any]], version: int):
+        """
+        Sincronizar los todos de un thread dentro de la sesión indicada por posición: solo se
+        hace upsert de los que cambian y se borran los que sobran al final de la lista.
+        """
+        from sqlalchemy import select, delete, update
+        
+        result = await session.execute(
+            select(ThreadTodo.position, ThreadTodo.content, ThreadTodo.status, ThreadTodo.active_form)
+            .where(ThreadTodo.thread_id == thread_id)
+        )
+        existing = {position: (content, status, active_form) for position, content, status, active_form in result.all()}
+        
+        changed = []
+        for position, todo_data in enumerate(todos_list):
+            values = (todo_data.get("content"), todo_data.get("status"), todo_data.get("activeForm"))
+            if existing.get(position) != values:
+                changed.append({
+                    "thread_id": thread_id,
+                    "position": position,
+                    "content": values[0],
+                    "status": values[1],
+                    "active_form": values[2],
+                    "version": version,
+                    "created_at": datetime.utcnow()
+                })
+        removed = [position for position in existing if position >= len(todos_list)]
+        if removed:
+            await session.execute(
+                delete(ThreadTodo).where(ThreadTodo.thread_id == thread_id, ThreadTodo.position.in_(removed))
+            )
+        await ThreadService._upsert(session, ThreadTodo, changed, ["thread_id", "position"],
+                                    ["content", "status", "active_form", "version"])
+        
+        # Las lecturas delta solo devuelven la lista si cambió algo
+        if changed or removed:
+            await session.execute(
+                update(Thread).where(Thread.id == thread_id).values(todos_version=version)
+                .execution_options(synchronize_session=False)
             )
-            
-            session.add(message)
-            
-            # Actualizar timestamp del thread
-            from sqlalchemy import select
-            stmt = select(Thread).where(Thread.id == thread_id)
-            result = await session.execute(stmt)
-            thread = result.scalar_one()
-            thread.updated_at = datetime.utcnow()
-            
-            await session.commit()
-            await session.refresh(message)
-            return message
     
     @staticmethod
     async def update_thread_files(thread_id: str, files_dict: Dict[str, str]):
         """Actualizar archivos de un thread"""
         async with AsyncSessionLocal() as session:
-            # Limpiar archivos existentes
-            from sqlalchemy import delete
-            await session.execute(delete(ThreadFile).where(ThreadFile.thread_id == thread_id))
-            
-            # Agregar nuevos archivos
-            for filename, content in files_dict.items():
-                file_obj = ThreadFile(
-                    thread_id=thread_id,
-                    filename=filename,
-                    content=content
-                )
-                session.add(file_obj)
-            
-            await session.commit()
+            async with session.begin():
+                version, _ = await ThreadService._bump_version(session, thread_id)
+                await ThreadService._replace_thread_files(session, thread_id, files_dict, version)
+            ThreadService._invalidate(thread_id)
     
     @staticmethod
     async def update_thread_todos(thread_id: str, todos_list: List[Dict[str, Any]]):
         """Actualizar todos de un thread"""
         async with AsyncSessionLocal() as session:
-            # Limpiar todos existentes
-            from sqlalchemy import delete
-            await session.execute(delete(ThreadTodo).where(ThreadTodo.thread_id == thread_id))
+            async with session.begin():
+                version, _ = await ThreadService._bump_version(session, thread_id)
+                await ThreadService._replace_thread_todos(session, thread_id, todos_list, version)
+            ThreadService._invalidate(thread_id)
+    
+    @staticmethod
+    async def get_thread_changes(thread_id: str, since: int = 0) -> Optional[Dict[str, Any]]:
+        """
+        Obtener solo lo que cambió en un thread después de la versión `since`: mensajes y
+        archivos nuevos o modificados, los nombres de archivo actuales (para podar los
+        borrados) y los todos si se reemplazaron. El trabajo depende de la actividad nueva,
+        no del tamaño total del thread.
+        """
+        async with AsyncReadSessionLocal() as session:
+            from sqlalchemy import select, func
             
-            # Agregar nuevos todos
-            for todo_data in todos_list:
-                todo_obj = ThreadTodo(
-                    thread_id=thread_id,
-                    content=todo_data.get("content"),
-                    status=todo_data.get("status"),
-                    active_form=todo_data.get("activeForm")
+            thread = await session.get(Thread, thread_id)
+            if thread is None:
+                return None
+            
+            version = thread.version or 0
+            changes = {
+                "thread": thread,
+                "since": since,
+                "version": version,
+                "messages": [],
+                "files": {},
+                "file_names": None,
+                "todos": None,
+            }
+            
+            if since < version:
+                result = await session.execute(
+                    select(Message)
+                    .where(Message.thread_id == thread_id, Message.version > since)
+                    .order_by(Message.seq.asc())
                 )
-                session.add(todo_obj)
+                changes["messages"] = list(result.scalars().all())
+                
+                result = await session.execute(
+                    select(ThreadFile.filename, ThreadFile.legacy_content, FileBlob.codec, FileBlob.data)
+                    .outerjoin(FileBlob, FileBlob.hash == ThreadFile.content_hash)
+                    .where(ThreadFile.thread_id == thread_id, ThreadFile.version > since)
+                )
+                changes["files"] = {
+                    filename: decompress_content(codec, data) if data is not None else legacy_content
+                    for filename, legacy_content, codec, data in result.all()
+                }
+                
+                if (thread.todos_version or 0) > since:
+                    result = await session.execute(
+                        select(ThreadTodo).where(ThreadTodo.thread_id == thread_id).order_by(ThreadTodo.position)
+                    )
+                    changes["todos"] = list(result.scalars().all())
             
-            await session.commit()
+            result = await session.execute(
+                select(ThreadFile.filename).where(ThreadFile.thread_id == thread_id)
+            )
+            changes["file_names"] = sorted(set(result.scalars().all()))
+            
+            changes["message_count"] = thread.message_seq or 0
+            todos_count = await session.execute(
+                select(func.count(ThreadTodo.id)).where(ThreadTodo.thread_id == thread_id)
+            )
+            changes["todos_count"] = todos_count.scalar()
+            return changes
+    
+    @staticmethod
+    async def get_message_page(thread_id: str, limit: int = 100, before: Optional[int] = None,
+                               after: Optional[int] = None, include_state: bool = False) -> Optional[Dict[str, Any]]:
+        """
+        Obtener una página de mensajes por seq sin cargar el resto del thread.
+        Sin cursores devuelve la última página; `before`/`after` son seq exclusivos y pueden
+        combinarse para pedir un rango (se recorre desde `after`).
+        Los mensajes se devuelven siempre en orden ascendente.
+        """
+        async with AsyncReadSessionLocal() as session:
+            from sqlalchemy import select
+            
+            thread = await session.get(Thread, thread_id)
+            if thread is None:
+                return None
+            
+            limit = max(1, limit)
+            stmt = select(Message).where(Message.thread_id == thread_id)
+            if before is not None:
+                stmt = stmt.where(Message.seq < before)
+            if after is not None:
+                stmt = stmt.where(Message.seq > after).order_by(Message.seq.asc())
+            else:
+                stmt = stmt.order_by(Message.seq.desc())
+            
+            # Pedir uno de más para saber si quedan mensajes en esa dirección
+            result = await session.execute(stmt.limit(limit + 1))
+            messages = list(result.scalars().all())
+            has_more = len(messages) > limit
+            messages = messages[:limit]
+            if after is None:
+                messages.reverse()
+            
+            page = {
+                "thread": thread,
+                "messages": messages,
+                "has_more": has_more,
+                "message_count": thread.message_seq or 0,
+            }
+            if include_state:
+                result = await session.execute(
+                    select(ThreadTodo).where(ThreadTodo.thread_id == thread_id).order_by(ThreadTodo.position)
+                )
+                page["todos"] = list(result.scalars().all())
+                result = await session.execute(
+                    select(ThreadFile).where(ThreadFile.thread_id == thread_id)
+                )
+                page["files"] = list(result.scalars().all())
+            return page
     
     @staticmethod
     async def delete_thread(thread_id: str) -> bool:
@@ -191,15 +1052,172 @@ class ThreadService:
             thread = result.scalar_one_or_none()
             
             if thread:
+                # Liberar las referencias a los blobs de sus archivos
+                result = await session.execute(
+                    select(ThreadFile.content_hash).where(ThreadFile.thread_id == thread_id)
+                )
+                ref_deltas: Dict[str, int] = {}
+                for digest in result.scalars().all():
+                    ref_deltas[digest] = ref_deltas.get(digest, 0) - 1
+                
                 await session.delete(thread)
+                await session.flush()
+                await ThreadService._adjust_blob_refs(session, ref_deltas)
                 await session.commit()
+                ThreadService._invalidate(thread_id)
                 return True
             return False
+    
+    @staticmethod
+    async def collect_file_blobs() -> int:
+        """
+        Recalcular las referencias de todos los blobs a partir de thread_files y eliminar los
+        que no use ningún archivo (por ejemplo tras borrados hechos fuera de ThreadService).
+        Devuelve el número de blobs eliminados.
+        """
+        async with AsyncSessionLocal() as session:
+            async with session.begin():
+                from sqlalchemy import select, update, delete, func
+                
+                # Bloquear antes los blobs (como los escritores): así el recuento, que es otra
+                # sentencia, ya ve confirmadas las referencias de quien los tenía bloqueados
+                await session.execute(select(FileBlob.hash).order_by(FileBlob.hash).with_for_update())
+                references = select(func.count(ThreadFile.id)).where(
+                    ThreadFile.content_hash == FileBlob.hash
+                ).correlate(FileBlob).scalar_subquery()
+                await session.execute(
+                    update(FileBlob).values(ref_count=references).execution_options(synchronize_session=False)
+                )
+                result = await session.execute(
+                    delete(FileBlob).where(FileBlob.ref_count <= 0).execution_options(synchronize_session=False)
+                )
+                return result.rowcount or 0
+
+class SQLiteMaintenance:
+    """
+    Mantenimiento periódico de SQLite en segundo plano: checkpoint del WAL,
+    PRAGMA optimize (y ANALYZE completo y limpieza de file_blobs cada cierto tiempo)
+    y vacuum incremental.
+    """
+    
+    def __init__(self, interval_seconds: float = 300, checkpoint_mode: str = "PASSIVE",
+                 analyze_interval_seconds: float = 86400, vacuum_pages: int = 1000):
+        self.interval_seconds = interval_seconds
+        self.checkpoint_mode = checkpoint_mode.upper()
+        self.analyze_interval_seconds = analyze_interval_seconds
+        self.vacuum_pages = vacuum_pages
+        self._task: Optional[asyncio.Task] = None
+        self._last_analyze: Optional[float] = None
+        
+        # Métricas
+        self._runs = 0
+        self._errors = 0
+        self._last_run: Optional[datetime] = None
+        self._last_duration: Optional[float] = None
+        self._last_checkpoint: Optional[Dict[str, int]] = None
+        self._last_error: Optional[str] = None
+        self._vacuumed_pages = 0
+        self._collected_blobs = 0
+    
+    @classmethod
+    def from_env(cls) -> "SQLiteMaintenance":
+        """Crear la tarea de mantenimiento a partir de variables de entorno"""
+        return cls(
+            interval_seconds=float(os.getenv("SQLITE_MAINTENANCE_INTERVAL_SECONDS", "300")),
+            checkpoint_mode=os.getenv("SQLITE_CHECKPOINT_MODE", "PASSIVE"),
+            analyze_interval_seconds=float(os.getenv("SQLITE_ANALYZE_INTERVAL_SECONDS", "86400")),
+            vacuum_pages=int(os.getenv("SQLITE_INCREMENTAL_VACUUM_PAGES", "1000")),
+        )
+    
+    def start(self):
+        """Arrancar el bucle de mantenimiento (no hace nada fuera de SQLite o con intervalo 0)"""
+        if not IS_SQLITE or self.interval_seconds <= 0 or self._task is not None:
+            return
+        self._task = asyncio.create_task(self._loop())
+    
+    async def stop(self):
+        """Detener el bucle y actualizar las estadísticas del planificador de consultas (optimize)"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if IS_SQLITE:
+            try:
+                async with async_engine.connect() as conn:
+                    conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+                    await conn.exec_driver_sql("PRAGMA optimize")
+            except Exception as e:
+                print(f"Error en PRAGMA optimize al cerrar: {e}")
+    
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval_seconds)
+            try:
+                await self.run_once()
+            except Exception as e:
+                self._errors += 1
+                self._last_error = str(e)
+                print(f"Error en mantenimiento de SQLite: {e}")
+    
+    async def run_once(self) -> Dict[str, Any]:
+        """Ejecutar una pasada de mantenimiento"""
+        start = time.monotonic()
+        analyze_due = self.analyze_interval_seconds > 0 and (
+            self._last_analyze is None or start - self._last_analyze >= self.analyze_interval_seconds
+        )
+        if analyze_due:
+            # Reconciliar las referencias de file_blobs antes de ANALYZE
+            self._collected_blobs += await ThreadService.collect_file_blobs()
+        
+        async with async_engine.connect() as conn:
+            # wal_checkpoint y los pragmas de mantenimiento no pueden ir dentro de una transacción
+            conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+            busy, log_frames, checkpointed = (
+                await conn.exec_driver_sql(f"PRAGMA wal_checkpoint({self.checkpoint_mode})")
+            ).first()
+            self._last_checkpoint = {"busy": busy, "log_frames": log_frames, "checkpointed_frames": checkpointed}
+            
+            await conn.exec_driver_sql("PRAGMA optimize")
+            if analyze_due:
+                await conn.exec_driver_sql("ANALYZE")
+                self._last_analyze = start
+            
+            # incremental_vacuum solo libera páginas con auto_vacuum=INCREMENTAL (2)
+            auto_vacuum = (await conn.exec_driver_sql("PRAGMA auto_vacuum")).scalar()
+            freelist = (await conn.exec_driver_sql("PRAGMA freelist_count")).scalar()
+            if auto_vacuum == 2 and freelist and self.vacuum_pages > 0:
+                await conn.exec_driver_sql(f"PRAGMA incremental_vacuum({self.vacuum_pages})")
+                self._vacuumed_pages += min(freelist, self.vacuum_pages)
+        
+        self._runs += 1
+        self._last_run = datetime.utcnow()
+        self._last_duration = time.monotonic() - start
+        return self.stats()
+    
+    def stats(self) -> Dict[str, Any]:
+        """Métricas de mantenimiento para /health"""
+        return {
+            "enabled": self._task is not None,
+            "interval_seconds": self.interval_seconds,
+            "runs": self._runs,
+            "errors": self._errors,
+            "last_run": self._last_run.isoformat() + "Z" if self._last_run else None,
+            "last_duration_ms": round(self._last_duration * 1000, 2) if self._last_duration is not None else None,
+            "last_checkpoint": self._last_checkpoint,
+            "vacuumed_pages": self._vacuumed_pages,
+            "collected_blobs": self._collected_blobs,
+            "last_error": self._last_error,
+        }
+
+sqlite_maintenance = SQLiteMaintenance.from_env()
 
 # Funciones de conveniencia
 async def get_database_stats() -> Dict[str, Any]:
     """Obtener estadísticas de la base de datos"""
-    async with AsyncSessionLocal() as session:
+    async with AsyncReplicaSessionLocal() as session:
         from sqlalchemy import select, func
         
         # Contar threads
@@ -214,11 +1232,24 @@ async def get_database_stats() -> Dict[str, Any]:
         files_count = await session.execute(select(func.count(ThreadFile.id)))
         files_total = files_count.scalar()
         
+        # Blobs de contenido: únicos, tamaño original y tamaño guardado
+        blobs = (await session.execute(select(
+            func.count(FileBlob.hash),
+            func.coalesce(func.sum(FileBlob.size), 0),
+            func.coalesce(func.sum(func.length(FileBlob.data)), 0)
+        ))).one()
+        
         return {
             "threads_count": threads_total,
             "messages_count": messages_total,
             "files_count": files_total,
-            "database_url": DATABASE_URL
+            "file_blobs": {"count": blobs[0], "size_bytes": blobs[1], "stored_bytes": blobs[2]},
+            "database_url": redact_database_url(DATABASE_URL),
+            "pools": {
+                "writer": async_engine.pool.status(),
+                "reader": async_read_engine.pool.status(),
+                "replica": async_replica_engine.pool.status()
+            }
         }
 
 async def migrate_threads_from_langgraph():
@@ -269,34 +1300,25 @@ async def migrate_threads_from_langgraph():
                         if existing:
                             continue
                         
-                        # Crear thread en SQLite
-                        thread = await ThreadService.create_thread(thread_id)
-                        
-                        # Migrar mensajes
+                        # Adaptar mensajes, archivos y todos y guardarlos en una sola transacción
                         values = lg_thread.get("values", {})
-                        messages = values.get("messages", [])
-                        
-                        for msg in messages:
-                            if isinstance(msg, dict):
-                                # Adaptar formato de mensaje
-                                msg_data = {
-                                    "id": msg.get("id", str(uuid.uuid4())),
-                                    "type": msg.get("type", "ai"),
-                                    "content": str(msg.get("content", "")),
-                                    "tool_calls": msg.get("tool_calls"),
-                                    "tool_call_id": msg.get("tool_call_id")
-                                }
-                                await ThreadService.add_message(thread_id, msg_data)
-                        
-                        # Migrar archivos
-                        files = values.get("files", {})
-                        if files:
-                            await ThreadService.update_thread_files(thread_id, files)
-                        
-                        # Migrar todos
-                        todos = values.get("todos", [])
-                        if todos:
-                            await ThreadService.update_thread_todos(thread_id, todos)
+                        messages_data = [
+                            {
+                                "id": msg.get("id", str(uuid.uuid4())),
+                                "type": msg.get("type", "ai"),
+                                "content": str(msg.get("content", "")),
+                                "tool_calls": msg.get("tool_calls"),
+                                "tool_call_id": msg.get("tool_call_id")
+                            }
+                            for msg in values.get("messages", [])
+                            if isinstance(msg, dict)
+                        ]
+                        await ThreadService.add_messages(
+                            thread_id,
+                            messages_data,
+                            todos_list=values.get("todos") or None,
+                            files_dict=values.get("files") or None
+                        )
                         
                         migrated_count += 1
                         print(f"Migrado thread {thread_id} ({migrated_count}/{len(langgraph_threads)})")
@@ -0,0 +1,313 @@
+"""
+Migraciones versionadas del esquema de la base de datos.
+
+Cada migración es una función que recibe una conexión síncrona de SQLAlchemy y se
+registra en la tabla schema_migrations al aplicarse. create_all solo crea tablas nuevas,
+así que cualquier cambio sobre tablas existentes (columnas, índices, datos) va aquí.
+
+Funcionan igual en SQLite y en Postgres (usan el motor asíncrono de database.py).
+
+Uso desde la línea de comandos:
+    python migrations.py status     # ver migraciones aplicadas y pendientes
+    python migrations.py upgrade    # aplicar las pendientes
+"""
+import asyncio
+import sys
+from datetime import datetime
+from typing import Callable, Dict, List, NamedTuple
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, bindparam, inspect, select, text, update, func
+from sqlalchemy.engine import Connection
+
+from models import (
+    Base, FileBlob, Message, Thread, ThreadFile, ThreadTodo, compress_content, content_hash, normalize_message_content
+)
+
+_BATCH_SIZE = 500
+
+migrations_metadata = MetaData()
+schema_migrations = Table(
+    "schema_migrations",
+    migrations_metadata,
+    Column("version", Integer, primary_key=True),
+    Column("name", String, nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+# Esquema original de threads.db (versión 0, antes de cualquier migración)
+BASELINE_SCHEMA = [
+    "CREATE TABLE threads (id VARCHAR NOT NULL, created_at DATETIME, updated_at DATETIME, "
+    "thread_metadata JSON, PRIMARY KEY (id))",
+    "CREATE TABLE messages (id VARCHAR NOT NULL, thread_id VARCHAR, type VARCHAR, content TEXT, "
+    "timestamp DATETIME, tool_calls JSON, tool_call_id VARCHAR, PRIMARY KEY (id), "
+    "FOREIGN KEY(thread_id) REFERENCES threads (id))",
+    "CREATE TABLE thread_files (id INTEGER NOT NULL, thread_id VARCHAR, filename VARCHAR, content TEXT, "
+    "created_at DATETIME, PRIMARY KEY (id), FOREIGN KEY(thread_id) REFERENCES threads (id))",
+    "CREATE TABLE thread_todos (id INTEGER NOT NULL, thread_id VARCHAR, content VARCHAR, status VARCHAR, "
+    "active_form VARCHAR, created_at DATETIME, PRIMARY KEY (id), FOREIGN KEY(thread_id) REFERENCES threads (id))",
+]
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    apply: Callable[[Connection], None]
+
+
+def _add_column(connection: Connection, table: str, column: str, ddl: str):
+    """Añadir una columna si la tabla aún no la tiene"""
+    existing = {col["name"] for col in inspect(connection).get_columns(table)}
+    if column not in existing:
+        connection.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+        print(f"  Columna añadida: {table}.{column}")
+
+
+def _create_index(connection: Connection, name: str, table: str, columns: str, unique: bool = False):
+    """Crear un índice si no existe"""
+    unique_sql = "UNIQUE " if unique else ""
+    connection.execute(text(f"CREATE {unique_sql}INDEX IF NOT EXISTS {name} ON {table} ({columns})"))
+
+
+def _normalized_message_content(connection: Connection):
+    """Columnas display_text/content_parts y normalización de los mensajes existentes"""
+    _add_column(connection, "messages", "display_text", "TEXT")
+    _add_column(connection, "messages", "content_parts", "JSON")
+
+    messages = Message.__table__
+    stmt = (
+        update(messages)
+        .where(messages.c.id == bindparam("b_id"))
+        .values(display_text=bindparam("b_display_text"), content_parts=bindparam("b_content_parts"))
+    )
+    total = 0
+    while True:
+        rows = connection.execute(
+            select(messages.c.id, messages.c.content)
+            .where(messages.c.display_text.is_(None))
+            .limit(_BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        values = []
+        for message_id, content in rows:
+            display_text, content_parts = normalize_message_content(content)
+            values.append({"b_id": message_id, "b_display_text": display_text, "b_content_parts": content_parts})
+        connection.execute(stmt, values)
+        total += len(rows)
+    if total:
+        print(f"  Contenido normalizado para {total} mensajes existentes")
+
+
+def _thread_versions(connection: Connection):
+    """Versión monotónica de threads y filas para las lecturas delta (since)"""
+    _add_column(connection, "threads", "version", "INTEGER NOT NULL DEFAULT 0")
+    _add_column(connection, "threads", "todos_version", "INTEGER NOT NULL DEFAULT 0")
+    _add_column(connection, "messages", "version", "INTEGER NOT NULL DEFAULT 0")
+    _add_column(connection, "thread_files", "version", "INTEGER NOT NULL DEFAULT 0")
+    _add_column(connection, "thread_todos", "version", "INTEGER NOT NULL DEFAULT 0")
+    _create_index(connection, "ix_messages_thread_version", "messages", "thread_id, version")
+    _create_index(connection, "ix_thread_files_thread_version", "thread_files", "thread_id, version")
+
+
+def _message_seq(connection: Connection):
+    """Secuencia por thread de los mensajes, numerando los existentes por timestamp"""
+    _add_column(connection, "threads", "message_seq", "INTEGER NOT NULL DEFAULT 0")
+    _add_column(connection, "messages", "seq", "INTEGER")
+
+    messages = Message.__table__
+    threads = Thread.__table__
+    rows = connection.execute(
+        select(messages.c.id, messages.c.thread_id)
+        .where(messages.c.seq.is_(None))
+        .order_by(messages.c.thread_id, messages.c.timestamp, messages.c.id)
+    ).all()
+    if rows:
+        last_seq: Dict[str, int] = dict(connection.execute(
+            select(messages.c.thread_id, func.coalesce(func.max(messages.c.seq), 0))
+            .group_by(messages.c.thread_id)
+        ).all())
+        values = []
+        for message_id, thread_id in rows:
+            last_seq[thread_id] = last_seq.get(thread_id, 0) + 1
+            values.append({"b_id": message_id, "b_seq": last_seq[thread_id]})
+        connection.execute(
+            update(messages).where(messages.c.id == bindparam("b_id")).values(seq=bindparam("b_seq")),
+            values,
+        )
+        connection.execute(
+            update(threads).where(threads.c.id == bindparam("b_id")).values(message_seq=bindparam("b_seq")),
+            [{"b_id": thread_id, "b_seq": seq} for thread_id, seq in last_seq.items()],
+        )
+        print(f"  Secuencia asignada a {len(rows)} mensajes existentes")
+    _create_index(connection, "ix_messages_thread_seq", "messages", "thread_id, seq", unique=True)
+
+
+def _foreign_key_and_sort_indexes(connection: Connection):
+    """Índices de las FK thread_id y de las columnas de orden de /threads/search"""
+    _create_index(connection, "ix_thread_files_thread_id", "thread_files", "thread_id, filename")
+    _create_index(connection, "ix_thread_todos_thread_id", "thread_todos", "thread_id")
+    _create_index(connection, "ix_threads_created_at", "threads", "created_at, id")
+    _create_index(connection, "ix_threads_updated_at", "threads", "updated_at, id")
+
+
+def _upsert_keys(connection: Connection):
+    """
+    Claves únicas (thread_id, filename) y (thread_id, position) para sincronizar archivos
+    y todos con upserts, y hash del contenido para saltarse los archivos sin cambios
+    """
+    files = ThreadFile.__table__
+    todos = ThreadTodo.__table__
+    _add_column(connection, "thread_files", "content_hash", "VARCHAR(64)")
+    _add_column(connection, "thread_todos", "position", "INTEGER")
+    
+    # Duplicados antiguos (antes se reemplazaba todo): quedarse con la fila más reciente
+    latest = select(func.max(files.c.id)).group_by(files.c.thread_id, files.c.filename)
+    removed = connection.execute(files.delete().where(files.c.id.not_in(latest))).rowcount
+    if removed:
+        print(f"  Eliminados {removed} archivos duplicados")
+    
+    stmt = update(files).where(files.c.id == bindparam("b_id")).values(content_hash=bindparam("b_hash"))
+    total = 0
+    while True:
+        rows = connection.execute(
+            select(files.c.id, files.c.content).where(files.c.content_hash.is_(None)).limit(_BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        connection.execute(stmt, [{"b_id": file_id, "b_hash": content_hash(content)} for file_id, content in rows])
+        total += len(rows)
+    if total:
+        print(f"  Hash calculado para {total} archivos existentes")
+    
+    rows = connection.execute(
+        select(todos.c.id, todos.c.thread_id).where(todos.c.position.is_(None)).order_by(todos.c.thread_id, todos.c.id)
+    ).all()
+    if rows:
+        positions: Dict[str, int] = {}
+        values = []
+        for todo_id, thread_id in rows:
+            positions[thread_id] = positions.get(thread_id, -1) + 1
+            values.append({"b_id": todo_id, "b_position": positions[thread_id]})
+        connection.execute(
+            update(todos).where(todos.c.id == bindparam("b_id")).values(position=bindparam("b_position")),
+            values,
+        )
+    
+    connection.execute(text("DROP INDEX IF EXISTS ix_thread_files_thread_id"))
+    connection.execute(text("DROP INDEX IF EXISTS ix_thread_todos_thread_id"))
+    _create_index(connection, "ix_thread_files_thread_filename", "thread_files", "thread_id, filename", unique=True)
+    _create_index(connection, "ix_thread_todos_thread_position", "thread_todos", "thread_id, position", unique=True)
+
+
+def _file_blobs(connection: Connection):
+    """Mover el contenido de los archivos a file_blobs (comprimido y deduplicado por hash)"""
+    files = ThreadFile.__table__
+    blobs = FileBlob.__table__
+    clear = update(files).where(files.c.id == bindparam("b_id")).values(
+        content=None, content_hash=bindparam("b_hash")
+    )
+    total = 0
+    while True:
+        rows = connection.execute(
+            select(files.c.id, files.c.content).where(files.c.content.is_not(None)).limit(_BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        contents = {content_hash(content): content for _, content in rows}
+        stored = set(connection.execute(select(blobs.c.hash).where(blobs.c.hash.in_(list(contents)))).scalars())
+        new_blobs = []
+        for digest, content in contents.items():
+            if digest not in stored:
+                codec, data = compress_content(content)
+                new_blobs.append({"hash": digest, "codec": codec, "data": data,
+                                  "size": len(content.encode("utf-8")), "ref_count": 0,
+                                  "created_at": datetime.utcnow()})
+        if new_blobs:
+            connection.execute(blobs.insert(), new_blobs)
+        connection.execute(clear, [{"b_id": file_id, "b_hash": content_hash(content)} for file_id, content in rows])
+        total += len(rows)
+    
+    references = select(func.count(files.c.id)).where(files.c.content_hash == blobs.c.hash).scalar_subquery()
+    connection.execute(update(blobs).values(ref_count=references))
+    connection.execute(blobs.delete().where(blobs.c.ref_count <= 0))
+    _create_index(connection, "ix_thread_files_content_hash", "thread_files", "content_hash")
+    if total:
+        print(f"  Contenido de {total} archivos movido a file_blobs")
+
+
+# Lista ordenada de migraciones: nunca modificar una ya publicada, añadir una nueva
+MIGRATIONS: List[Migration] = [
+    Migration(1, "contenido_normalizado_de_mensajes", _normalized_message_content),
+    Migration(2, "versiones_de_thread", _thread_versions),
+    Migration(3, "secuencia_de_mensajes", _message_seq),
+    Migration(4, "indices_de_thread_id_y_orden", _foreign_key_and_sort_indexes),
+    Migration(5, "claves_de_upsert_de_archivos_y_todos", _upsert_keys),
+    Migration(6, "blobs_de_contenido_de_archivos", _file_blobs),
+]
+
+
+def applied_versions(connection: Connection) -> Dict[int, datetime]:
+    """Versiones ya aplicadas y cuándo"""
+    migrations_metadata.create_all(connection)
+    rows = connection.execute(select(schema_migrations.c.version, schema_migrations.c.applied_at)).all()
+    return dict(rows)
+
+
+def pending_migrations(connection: Connection) -> List[Migration]:
+    applied = applied_versions(connection)
+    return [migration for migration in MIGRATIONS if migration.version not in applied]
+
+
+def upgrade(connection: Connection) -> List[int]:
+    """
+    Crear las tablas que falten y aplicar en orden las migraciones pendientes.
+    Se ejecuta dentro de la transacción de la conexión recibida.
+    """
+    Base.metadata.create_all(connection)
+    applied = []
+    for migration in pending_migrations(connection):
+        print(f"Aplicando migración {migration.version}: {migration.name}")
+        migration.apply(connection)
+        connection.execute(schema_migrations.insert().values(
+            version=migration.version,
+            name=migration.name,
+            applied_at=datetime.utcnow(),
+        ))
+        applied.append(migration.version)
+    return applied
+
+
+def _status(connection: Connection):
+    applied = applied_versions(connection)
+    for migration in MIGRATIONS:
+        applied_at = applied.get(migration.version)
+        state = f"aplicada {applied_at.isoformat()}" if applied_at else "pendiente"
+        print(f"{migration.version:>4}  {migration.name:<40} {state}")
+
+
+async def _run_command(command: str) -> List[int]:
+    from database import async_engine, dispose_engines
+    
+    try:
+        async with async_engine.begin() as connection:
+            if command == "status":
+                await connection.run_sync(_status)
+                return []
+            return await connection.run_sync(upgrade)
+    finally:
+        await dispose_engines()
+
+
+def main(argv: List[str]) -> int:
+    command = argv[1] if len(argv) > 1 else "status"
+    if command not in ("status", "upgrade"):
+        print(f"Comando desconocido: {command} (usar status o upgrade)")
+        return 2
+    applied = asyncio.run(_run_command(command))
+    if command == "upgrade":
+        print(f"Migraciones aplicadas: {applied}" if applied else "El esquema ya está actualizado")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -1,104 +1,217 @@
 """
 Modelos de base de datos SQLAlchemy para persistencia de threads
 """
-from sqlalchemy import Column, String, Text, DateTime, Integer, ForeignKey, JSON
+from sqlalchemy import Column, String, Text, DateTime, Integer, ForeignKey, JSON, Index, LargeBinary
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, validates
 from datetime import datetime
+from typing import Any, List, Optional, Tuple
+import ast
+import hashlib
+import json
 import uuid
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # zstd es opcional: sin él los blobs se comprimen con zlib
+    zstandard = None
 
 Base = declarative_base()
 
 class Thread(Base):
     __tablename__ = "threads"
+    __table_args__ = (
+        Index("ix_threads_created_at", "created_at", "id"),
+        Index("ix_threads_updated_at", "updated_at", "id"),
+    )
     
     id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     thread_metadata = Column(JSON, default=dict)
+    # Versión monotónica: cada escritura la incrementa y marca las filas que toca
+    version = Column(Integer, nullable=False, default=0, server_default="0")
+    # Versión en la que se reemplazó por última vez la lista de todos
+    todos_version = Column(Integer, nullable=False, default=0, server_default="0")
+    # Último número de secuencia asignado a un mensaje del thread
+    message_seq = Column(Integer, nullable=False, default=0, server_default="0")
     
     # Relaciones
-    messages = relationship("Message", back_populates="thread", cascade="all, delete-orphan")
+    messages = relationship("Message", back_populates="thread", cascade="all, delete-orphan",
+                            order_by="Message.seq")
     files = relationship("ThreadFile", back_populates="thread", cascade="all, delete-orphan")
-    todos = relationship("ThreadTodo", back_populates="thread", cascade="all, delete-orphan")
+    todos = relationship("ThreadTodo", back_populates="thread", cascade="all, delete-orphan",
+                         order_by="ThreadTodo.position")
     
     def to_dict(self):
         return {
             "thread_id": self.id,
             "created_at": self.created_at.isoformat() + "Z" if self.created_at else None,
             "updated_at": self.updated_at.isoformat() + "Z" if self.updated_at else None,
-            "metadata": self.thread_metadata or {}
+            "metadata": self.thread_metadata or {},
+            "version": self.version or 0
         }
 
+def normalize_message_content(content: Any) -> Tuple[str, Optional[List[Any]]]:
+    """
+    Normalizar el contenido de un mensaje al escribirlo.
+    Devuelve (texto visible, partes estructuradas o None si es texto plano).
+    """
+    if content is None:
+        return "", None
+    
+    parsed = content
+    if isinstance(content, str):
+        stripped = content.lstrip()
+        # Solo intentar parsear lo que parece una lista/dict serializado
+        if not stripped.startswith(("[", "{")):
+            return content, None
+        try:
+            # Intentar parsear como JSON primero, luego como Python literal
+            try:
+                parsed = json.loads(content)
+            except json.JSONDecodeError:
+                parsed = ast.literal_eval(content)
+        except (ValueError, SyntaxError, MemoryError, RecursionError):
+            # Si no es JSON válido, mantener el contenido original
+            return content, None
+    
+    if isinstance(parsed, dict):
+        parsed = [parsed]
+    if not isinstance(parsed, list):
+        return str(content), None
+    
+    # Si es una lista, extraer solo texto (tool_use no es contenido de texto visible)
+    text_parts = []
+    for item in parsed:
+        if isinstance(item, dict):
+            if item.get('type') == 'text' and item.get('text'):
+                text_parts.append(item['text'])
+        elif isinstance(item, str):
+            text_parts.append(item)
+    
+    if text_parts:
+        display_text = '\n\n'.join(text_parts)
+    else:
+        display_text = content if isinstance(content, str) else json.dumps(content, ensure_ascii=False)
+    return display_text, parsed
+
 class Message(Base):
     __tablename__ = "messages"
+    __table_args__ = (
+        Index("ix_messages_thread_version", "thread_id", "version"),
+        Index("ix_messages_thread_seq", "thread_id", "seq", unique=True),
+    )
     
     id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
     thread_id = Column(String, ForeignKey("threads.id"))
     type = Column(String)  # 'human', 'ai', 'tool'
     content = Column(Text)
+    # Contenido normalizado al escribir: texto visible + partes estructuradas (JSON)
+    display_text = Column(Text)
+    content_parts = Column(JSON, nullable=True)
     timestamp = Column(DateTime, default=datetime.utcnow)
     tool_calls = Column(JSON, default=list)
     tool_call_id = Column(String, nullable=True)
+    version = Column(Integer, nullable=False, default=0, server_default="0")
+    # Posición del mensaje dentro del thread (1, 2, 3...): orden estable y cursor de paginación
+    seq = Column(Integer)
     
     # Relación
     thread = relationship("Thread", back_populates="messages")
     
+    @validates("content")
+    def _normalize_content(self, key, content):
+        self.display_text, self.content_parts = normalize_message_content(content)
+        if content is not None and not isinstance(content, str):
+            content = json.dumps(content, ensure_ascii=False)
+        return content
+    
     def to_dict(self):
-        # Limpiar el contenido si está en formato JSON stringificado
-        content = self.content
-        if isinstance(content, str):
-            try:
-                import json
-                import ast
-                # Intentar parsear como JSON primero, luego como Python literal
-                try:
-                    parsed = json.loads(content)
-                except json.JSONDecodeError:
-                    # Si falla JSON, intentar ast.literal_eval para Python literals
-                    parsed = ast.literal_eval(content)
-                if isinstance(parsed, list):
-                    # Si es una lista, extraer solo texto
-                    text_parts = []
-                    for item in parsed:
-                        if isinstance(item, dict):
-                            if item.get('type') == 'text':
-                                # Buscar el texto en diferentes campos posibles
-                                text_content = item.get('text', '')
-                                if text_content:
-                                    text_parts.append(text_content)
-                            elif item.get('type') == 'tool_use':
-                                # Ignorar tool_use ya que no es contenido de texto visible
-                                continue
-                        elif isinstance(item, str):
-                            text_parts.append(item)
-                    content = '\n\n'.join(text_parts) if text_parts else content
-                elif isinstance(parsed, dict) and parsed.get('type') == 'text':
-                    content = parsed.get('text', content)
-            except (json.JSONDecodeError, ValueError, SyntaxError):
-                # Si no es JSON válido, mantener el contenido original
-                pass
-        
         return {
             "id": self.id,
             "type": self.type,
-            "content": content,
+            "content": self.display_text if self.display_text is not None else self.content,
             "timestamp": self.timestamp.isoformat() + "Z" if self.timestamp else None,
             "tool_calls": self.tool_calls,
-            "tool_call_id": self.tool_call_id
+            "tool_call_id": self.tool_call_id,
+            "version": self.version or 0,
+            "seq": self.seq
         }
 
+def content_hash(content: Optional[str]) -> str:
+    """Hash SHA-256 (hex) del contenido de un archivo, para detectar cambios sin compararlo"""
+    return hashlib.sha256((content or "").encode("utf-8")).hexdigest()
+
+def compress_content(content: Optional[str]) -> Tuple[str, bytes]:
+    """
+    Comprimir el contenido de un archivo para guardarlo como blob.
+    Devuelve (codec, datos); si comprimir no reduce el tamaño se guarda tal cual ("raw").
+    """
+    raw = (content or "").encode("utf-8")
+    if zstandard is not None:
+        codec, data = "zstd", zstandard.ZstdCompressor(level=9).compress(raw)
+    else:
+        codec, data = "zlib", zlib.compress(raw, 6)
+    if len(data) >= len(raw):
+        return "raw", raw
+    return codec, data
+
+def decompress_content(codec: str, data: bytes) -> str:
+    """Inverso de compress_content"""
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("El blob está comprimido con zstd pero el paquete zstandard no está instalado")
+        data = zstandard.ZstdDecompressor().decompress(data)
+    elif codec == "zlib":
+        data = zlib.decompress(data)
+    return data.decode("utf-8")
+
+class FileBlob(Base):
+    """Contenido de archivo direccionado por hash: se comparte entre threads y se comprime"""
+    __tablename__ = "file_blobs"
+    
+    hash = Column(String(64), primary_key=True)
+    codec = Column(String, nullable=False)  # 'zstd', 'zlib', 'raw'
+    data = Column(LargeBinary, nullable=False)
+    size = Column(Integer, nullable=False)  # bytes sin comprimir
+    # Número de filas de thread_files que apuntan al blob; con 0 se elimina
+    ref_count = Column(Integer, nullable=False, default=0, server_default="0")
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    @property
+    def text(self) -> str:
+        return decompress_content(self.codec, self.data)
+
 class ThreadFile(Base):
     __tablename__ = "thread_files"
+    __table_args__ = (
+        # Clave de upsert: un archivo por nombre dentro de cada thread
+        Index("ix_thread_files_thread_filename", "thread_id", "filename", unique=True),
+        Index("ix_thread_files_thread_version", "thread_id", "version"),
+        Index("ix_thread_files_content_hash", "content_hash"),
+    )
     
     id = Column(Integer, primary_key=True)
     thread_id = Column(String, ForeignKey("threads.id"))
     filename = Column(String)
-    content = Column(Text)
+    # Solo filas anteriores a file_blobs: el contenido vive en el blob de content_hash
+    legacy_content = Column("content", Text)
+    content_hash = Column(String(64))
     created_at = Column(DateTime, default=datetime.utcnow)
+    version = Column(Integer, nullable=False, default=0, server_default="0")
     
-    # Relación
+    # Relaciones
     thread = relationship("Thread", back_populates="files")
+    blob = relationship("FileBlob", primaryjoin="foreign(ThreadFile.content_hash) == FileBlob.hash",
+                        lazy="joined", viewonly=True)
+    
+    @property
+    def content(self) -> Optional[str]:
+        if self.blob is not None:
+            return self.blob.text
+        return self.legacy_content
     
     def to_dict(self):
         return {
@@ -109,13 +222,19 @@ class ThreadFile(Base):
 
 class ThreadTodo(Base):
     __tablename__ = "thread_todos"
+    __table_args__ = (
+        # Clave de upsert: la posición del todo dentro de la lista del thread
+        Index("ix_thread_todos_thread_position", "thread_id", "position", unique=True),
+    )
     
     id = Column(Integer, primary_key=True)
     thread_id = Column(String, ForeignKey("threads.id"))
+    position = Column(Integer)
     content = Column(String)
     status = Column(String)
     active_form = Column(String)
     created_at = Column(DateTime, default=datetime.utcnow)
+    version = Column(Integer, nullable=False, default=0, server_default="0")
     
     # Relación
     thread = relationship("Thread", back_populates="todos")
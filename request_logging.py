@@ -0,0 +1,164 @@
+"""
+Logging estructurado (structlog + orjson) y middleware ASGI de logging de peticiones
+"""
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+import orjson
+import structlog
+
+# Cabeceras que nunca se escriben en claro
+REDACTED_HEADERS = {
+    "authorization",
+    "proxy-authorization",
+    "cookie",
+    "set-cookie",
+    "x-api-key",
+    "api-key",
+    "anthropic-api-key",
+    "x-anthropic-api-key",
+}
+_SENSITIVE_MARKERS = ("token", "secret", "password", "api-key", "apikey")
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def _orjson_dumps(obj: Any, **kwargs) -> str:
+    return orjson.dumps(obj, default=str).decode()
+
+
+def configure_logging(level: Optional[str] = None):
+    """
+    Configurar structlog con salida JSON (orjson) a través de un QueueHandler:
+    las llamadas de logging solo encolan, la escritura a stdout ocurre en un hilo aparte.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    level_name = (level or os.getenv("LOG_LEVEL", "INFO")).upper()
+    log_level = logging.getLevelName(level_name)
+    if not isinstance(log_level, int):
+        log_level = logging.INFO
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(logging.Formatter("%(message)s"))
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+    root = logging.getLogger()
+    root.handlers = [logging.handlers.QueueHandler(log_queue)]
+    root.setLevel(log_level)
+
+    structlog.configure(
+        processors=[
+            structlog.contextvars.merge_contextvars,
+            structlog.processors.add_log_level,
+            structlog.processors.TimeStamper(fmt="iso", utc=True),
+            structlog.processors.format_exc_info,
+            structlog.processors.JSONRenderer(serializer=_orjson_dumps),
+        ],
+        wrapper_class=structlog.make_filtering_bound_logger(log_level),
+        logger_factory=structlog.stdlib.LoggerFactory(),
+        cache_logger_on_first_use=True,
+    )
+
+
+def redact_headers(headers: Iterable[Tuple[bytes, bytes]]) -> Dict[str, str]:
+    """Convertir las cabeceras ASGI a dict ocultando credenciales"""
+    result = {}
+    for raw_name, raw_value in headers:
+        name = raw_name.decode("latin-1").lower()
+        if name in REDACTED_HEADERS or any(marker in name for marker in _SENSITIVE_MARKERS):
+            result[name] = "[REDACTED]"
+        else:
+            result[name] = raw_value.decode("latin-1")
+    return result
+
+
+class RequestLoggingMiddleware:
+    """
+    Middleware ASGI de logging de peticiones.
+
+    No bufferiza el body: solo observa los primeros bytes a medida que la aplicación los
+    consume, y únicamente en las peticiones muestreadas. Emite una línea por petición con
+    método, ruta, status, latencia total y tiempo hasta el primer byte.
+    """
+
+    def __init__(self, app, sample_rate: Optional[float] = None,
+                 body_sample_rate: Optional[float] = None,
+                 max_body_bytes: Optional[int] = None,
+                 slow_request_seconds: Optional[float] = None):
+        self.app = app
+        self.sample_rate = sample_rate if sample_rate is not None else float(os.getenv("LOG_REQUEST_SAMPLE_RATE", "1.0"))
+        self.body_sample_rate = body_sample_rate if body_sample_rate is not None else float(os.getenv("LOG_BODY_SAMPLE_RATE", "0.0"))
+        self.max_body_bytes = max_body_bytes if max_body_bytes is not None else int(os.getenv("LOG_BODY_MAX_BYTES", "512"))
+        self.slow_request_seconds = slow_request_seconds if slow_request_seconds is not None else float(os.getenv("LOG_SLOW_REQUEST_SECONDS", "30"))
+        self.logger = structlog.get_logger("http")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        sampled = random.random() < self.sample_rate
+        capture_body = sampled and random.random() < self.body_sample_rate
+        body_preview = bytearray()
+        body_size = 0
+        info = {"status": 500, "ttfb": None, "response_bytes": 0}
+
+        async def receive_wrapper():
+            nonlocal body_size
+            message = await receive()
+            if message["type"] == "http.request":
+                chunk = message.get("body", b"")
+                body_size += len(chunk)
+                if capture_body and len(body_preview) < self.max_body_bytes:
+                    body_preview.extend(chunk[: self.max_body_bytes - len(body_preview)])
+            return message
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                info["status"] = message["status"]
+                info["ttfb"] = time.perf_counter() - start
+            elif message["type"] == "http.response.body":
+                info["response_bytes"] += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        finally:
+            duration = time.perf_counter() - start
+            status = info["status"]
+            # Errores y peticiones lentas se registran siempre, aunque no estén muestreadas
+            if sampled or status >= 500 or duration >= self.slow_request_seconds:
+                fields = {
+                    "method": scope.get("method"),
+                    "path": scope.get("path"),
+                    "status": status,
+                    "duration_ms": round(duration * 1000, 2),
+                    "ttfb_ms": round(info["ttfb"] * 1000, 2) if info["ttfb"] is not None else None,
+                    "request_bytes": body_size,
+                    "response_bytes": info["response_bytes"],
+                    "client": scope["client"][0] if scope.get("client") else None,
+                }
+                if capture_body:
+                    fields["headers"] = redact_headers(scope.get("headers", []))
+                    fields["body_preview"] = body_preview.decode("utf-8", errors="replace")
+                    fields["body_truncated"] = body_size > len(body_preview)
+                if status >= 500:
+                    self.logger.error("request", **fields)
+                elif duration >= self.slow_request_seconds:
+                    self.logger.warning("request", **fields)
+                else:
+                    self.logger.info("request", **fields)
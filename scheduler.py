@@ -0,0 +1,251 @@
+"""
+Control de admisión y cola de ejecuciones del agente
+"""
+import asyncio
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, Deque, Dict, Optional
+
+
+class SchedulerFullError(Exception):
+    """La ejecución fue rechazada: cola llena o espera demasiado larga"""
+
+    def __init__(self, message: str, status_code: int, retry_after: int):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class ThreadBusyError(Exception):
+    """El thread ya tiene una ejecución en curso y no se admite otra"""
+
+    def __init__(self, message: str, status_code: int = 409):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class RunTicket:
+    """Slot de ejecución concedido por el scheduler (liberarlo más de una vez es inocuo)"""
+
+    def __init__(self, scheduler: "RunScheduler", wait_seconds: float):
+        self.scheduler = scheduler
+        self.wait_seconds = wait_seconds
+        self.started_at = time.monotonic()
+        self._released = False
+
+    def release(self):
+        if self._released:
+            return
+        self._released = True
+        self.scheduler._release(time.monotonic() - self.started_at)
+
+
+class RunScheduler:
+    """Limita las ejecuciones concurrentes del agente con una cola FIFO acotada"""
+
+    def __init__(self, max_concurrent: int = 4, max_queue: int = 16,
+                 queue_timeout: Optional[float] = 60.0):
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queue = max(0, max_queue)
+        self.queue_timeout = queue_timeout if queue_timeout and queue_timeout > 0 else None
+
+        self._active = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+        # Métricas
+        self._admitted = 0
+        self._rejected = 0
+        self._timed_out = 0
+        self._wait_times: Deque[float] = deque(maxlen=500)
+        self._run_times: Deque[float] = deque(maxlen=500)
+
+    @classmethod
+    def from_env(cls) -> "RunScheduler":
+        """Crear el scheduler a partir de variables de entorno"""
+        return cls(
+            max_concurrent=int(os.getenv("AGENT_MAX_CONCURRENT_RUNS", "4")),
+            max_queue=int(os.getenv("AGENT_MAX_QUEUED_RUNS", "16")),
+            queue_timeout=float(os.getenv("AGENT_QUEUE_TIMEOUT_SECONDS", "60")),
+        )
+
+    def retry_after(self) -> int:
+        """Estimar en segundos cuándo volverá a haber capacidad"""
+        avg_run = sum(self._run_times) / len(self._run_times) if self._run_times else 30.0
+        estimate = avg_run * (len(self._waiters) + 1) / self.max_concurrent
+        return int(min(max(estimate, 1), 300))
+
+    async def acquire(self) -> RunTicket:
+        """Reservar un slot de ejecución, esperando en la cola FIFO si hace falta"""
+        if self._active < self.max_concurrent and not self._waiters:
+            self._active += 1
+            return self._admit(0.0)
+
+        if len(self._waiters) >= self.max_queue:
+            self._rejected += 1
+            raise SchedulerFullError(
+                "Demasiadas ejecuciones en curso, intenta de nuevo más tarde",
+                status_code=429,
+                retry_after=self.retry_after(),
+            )
+
+        start = time.monotonic()
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._discard_waiter(waiter)
+            self._timed_out += 1
+            raise SchedulerFullError(
+                "Tiempo de espera en cola agotado, intenta de nuevo más tarde",
+                status_code=503,
+                retry_after=self.retry_after(),
+            )
+        except asyncio.CancelledError:
+            self._discard_waiter(waiter)
+            raise
+        return self._admit(time.monotonic() - start)
+
+    @asynccontextmanager
+    async def slot(self):
+        """Context manager que reserva un slot y lo libera al terminar"""
+        ticket = await self.acquire()
+        try:
+            yield ticket
+        finally:
+            ticket.release()
+
+    def stats(self) -> Dict[str, Any]:
+        """Métricas de la cola para /health"""
+        waits = sorted(self._wait_times)
+        return {
+            "max_concurrent_runs": self.max_concurrent,
+            "max_queued_runs": self.max_queue,
+            "active_runs": self._active,
+            "queue_depth": len(self._waiters),
+            "admitted_total": self._admitted,
+            "rejected_total": self._rejected,
+            "timed_out_total": self._timed_out,
+            "avg_wait_seconds": round(sum(waits) / len(waits), 3) if waits else 0.0,
+            "p95_wait_seconds": round(waits[int(len(waits) * 0.95) - 1], 3) if waits else 0.0,
+            "max_wait_seconds": round(waits[-1], 3) if waits else 0.0,
+        }
+
+    def _admit(self, wait_seconds: float) -> RunTicket:
+        self._admitted += 1
+        self._wait_times.append(wait_seconds)
+        return RunTicket(self, wait_seconds)
+
+    def _discard_waiter(self, waiter: asyncio.Future):
+        if waiter.done() and not waiter.cancelled():
+            # El slot se concedió justo cuando expiraba la espera: devolverlo
+            self._release(None)
+            return
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+
+    def _release(self, run_seconds: Optional[float]):
+        if run_seconds is not None:
+            self._run_times.append(run_seconds)
+        # Pasar el slot directamente al siguiente en la cola (orden FIFO)
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self._active -= 1
+
+
+class _ThreadEntry:
+    __slots__ = ("lock", "users")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        # Ejecución en curso + ejecuciones esperando en este thread
+        self.users = 0
+
+
+class ThreadLockTicket:
+    """Turno de ejecución concedido para un thread (liberarlo más de una vez es inocuo)"""
+
+    def __init__(self, locks: "ThreadRunLocks", thread_id: str, entry: _ThreadEntry):
+        self.locks = locks
+        self.thread_id = thread_id
+        self.entry = entry
+        self._released = False
+
+    def release(self):
+        if self._released:
+            return
+        self._released = True
+        self.entry.lock.release()
+        self.locks._leave(self.thread_id, self.entry)
+
+
+class ThreadRunLocks:
+    """Serializa las ejecuciones de un mismo thread_id con una pequeña cola por thread"""
+
+    def __init__(self, max_pending: int = 2, reject_if_busy: bool = False):
+        self.max_pending = max(0, max_pending)
+        self.reject_if_busy = reject_if_busy
+        self._entries: Dict[str, _ThreadEntry] = {}
+        self._rejected = 0
+
+    @classmethod
+    def from_env(cls) -> "ThreadRunLocks":
+        """Crear los locks por thread a partir de variables de entorno"""
+        return cls(
+            max_pending=int(os.getenv("AGENT_THREAD_MAX_PENDING", "2")),
+            reject_if_busy=os.getenv("AGENT_THREAD_BUSY_POLICY", "queue").lower() == "reject",
+        )
+
+    async def acquire(self, thread_id: str, reject_if_busy: Optional[bool] = None) -> ThreadLockTicket:
+        """Esperar el turno del thread; rechaza si está ocupado (modo reject) o su cola está llena"""
+        if reject_if_busy is None:
+            reject_if_busy = self.reject_if_busy
+
+        entry = self._entries.get(thread_id)
+        if entry is not None and entry.users > 0:
+            if reject_if_busy:
+                self._rejected += 1
+                raise ThreadBusyError(f"El thread {thread_id} ya tiene una ejecución en curso")
+            if entry.users - 1 >= self.max_pending:
+                self._rejected += 1
+                raise ThreadBusyError(f"Demasiados mensajes en cola para el thread {thread_id}")
+        if entry is None:
+            entry = self._entries[thread_id] = _ThreadEntry()
+
+        entry.users += 1
+        try:
+            await entry.lock.acquire()
+        except BaseException:
+            self._leave(thread_id, entry)
+            raise
+        return ThreadLockTicket(self, thread_id, entry)
+
+    def is_busy(self, thread_id: str) -> bool:
+        entry = self._entries.get(thread_id)
+        return entry is not None and entry.users > 0
+
+    def stats(self) -> Dict[str, Any]:
+        """Métricas de serialización por thread para /health"""
+        return {
+            "busy_threads": len(self._entries),
+            "queued_runs": sum(max(entry.users - 1, 0) for entry in self._entries.values()),
+            "max_pending_per_thread": self.max_pending,
+            "busy_policy": "reject" if self.reject_if_busy else "queue",
+            "rejected_total": self._rejected,
+        }
+
+    def _leave(self, thread_id: str, entry: _ThreadEntry):
+        entry.users -= 1
+        if entry.users == 0 and self._entries.get(thread_id) is entry:
+            del self._entries[thread_id]
+
+
+run_scheduler = RunScheduler.from_env()
+thread_run_locks = ThreadRunLocks.from_env()
@@ -0,0 +1,165 @@
+"""Indexes derived from the contents of `state["files"]`, cached per file version."""
+
+import re
+import sys
+import threading
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Optional
+
+from .state import FileStat
+
+# The same line boundaries as str.splitlines()
+_LINE_BREAK = re.compile(r"\r\n|[\n\r\v\f\x1c\x1d\x1e\x85\u2028\u2029]")
+
+
+class LineIndex:
+    """Start and end offsets of every line in one version of a file."""
+
+    __slots__ = ("content", "starts", "ends")
+
+    def __init__(self, content: str):
+        starts = array("q", [0])
+        ends = array("q")
+        for match in _LINE_BREAK.finditer(content):
+            ends.append(match.start())
+            starts.append(match.end())
+        if starts[-1] < len(content):
+            ends.append(len(content))
+        else:
+            # A trailing line break doesn't start another line
+            starts.pop()
+        self.content = content
+        self.starts = starts
+        self.ends = ends
+
+    def __len__(self) -> int:
+        return len(self.ends)
+
+    @property
+    def nbytes(self) -> int:
+        """Memory pinned by this index: the content string plus both offset arrays."""
+        return (
+            sys.getsizeof(self.content)
+            + self.starts.itemsize * len(self.starts)
+            + self.ends.itemsize * len(self.ends)
+        )
+
+    def line_of(self, offset: int) -> int:
+        """Index of the line containing character `offset`."""
+        return bisect_right(self.starts, offset) - 1
+
+    def line(self, i: int, max_chars: Optional[int] = None) -> str:
+        """Line `i` (0-based) without its line break, optionally truncated."""
+        start, end = self.starts[i], self.ends[i]
+        if max_chars is not None:
+            end = min(end, start + max_chars)
+        return self.content[start:end]
+
+
+@lru_cache(maxsize=128)
+def compile_glob(pattern: str) -> re.Pattern:
+    """Compile a glob over file paths: `*` and `?` stay within one path segment and
+    `**` matches across segments (`**/` also matches no directory at all)."""
+    i, n, parts = 0, len(pattern), []
+    while i < n:
+        char = pattern[i]
+        if pattern.startswith("**/", i):
+            parts.append("(?:.*/)?")
+            i += 3
+            continue
+        if pattern.startswith("**", i):
+            parts.append(".*")
+            i += 2
+            continue
+        if char == "*":
+            parts.append("[^/]*")
+        elif char == "?":
+            parts.append("[^/]")
+        elif char == "[" and (end := pattern.find("]", i + 2)) != -1:
+            body = pattern[i + 1 : end].replace("\\", "\\\\")
+            if body.startswith("!"):
+                body = "^" + body[1:]
+            parts.append(f"[{body}]")
+            i = end + 1
+            continue
+        else:
+            parts.append(re.escape(char))
+        i += 1
+    return re.compile("".join(parts), re.DOTALL)
+
+
+class FileIndexCache:
+    """Small LRU of per-file indexes, bounded by entry count and by total bytes.
+
+    Entries are keyed by path and by the identity of the content string they were
+    built from, so a new version of a file never reuses a stale index. Writes
+    drop the index of the version they replace right away with `invalidate`.
+    """
+
+    def __init__(self, max_entries: int = 256, max_bytes: int = 32 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[tuple[str, int], LineIndex] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def lines(self, path: str, content: str) -> LineIndex:
+        key = (path, id(content))
+        with self._lock:
+            index = self._entries.get(key)
+            if index is not None and index.content is content:
+                self._entries.move_to_end(key)
+                return index
+        index = LineIndex(content)
+        if index.nbytes > self.max_bytes:
+            return index
+        with self._lock:
+            self._discard(key)
+            self._entries[key] = index
+            self._bytes += index.nbytes
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._discard(next(iter(self._entries)))
+        return index
+
+    def invalidate(self, path: str, content: Optional[str]) -> None:
+        """Drop the index built from this exact version of `path`, if any.
+
+        Other versions of the same path (e.g. from another conversation) are kept.
+        """
+        if content is None:
+            return
+        key = (path, id(content))
+        with self._lock:
+            index = self._entries.get(key)
+            if index is not None and index.content is content:
+                self._discard(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    @property
+    def nbytes(self) -> int:
+        return self._bytes
+
+    def _discard(self, key: tuple[str, int]) -> None:
+        index = self._entries.pop(key, None)
+        if index is not None:
+            self._bytes -= index.nbytes
+
+
+file_index = FileIndexCache()
+
+
+def file_stat(path: str, content: str, step: Optional[int] = None) -> FileStat:
+    """Size in bytes, line count and last-modified step of one file version."""
+    return {
+        # isascii() is a constant-time flag check, so ASCII files are never encoded
+        "size": len(content) if content.isascii() else len(content.encode("utf-8")),
+        "lines": len(file_index.lines(path, content)),
+        "modified_step": step,
+    }
@@ -1,6 +1,15 @@
 from .sub_agent import _create_task_tool, _create_sync_task_tool, SubAgent
 from .model import get_default_model
-from .tools import write_todos, write_file, read_file, ls, edit_file
+from .tools import (
+    write_todos,
+    write_file,
+    read_file,
+    ls,
+    edit_file,
+    multi_edit,
+    grep,
+    glob,
+)
 from .state import DeepAgentState
 from typing import Sequence, Union, Callable, Any, TypeVar, Type, Optional
 from langchain_core.tools import BaseTool, tool
@@ -40,7 +49,16 @@ def _agent_builder(
 ):
     prompt = instructions + base_prompt
 
-    all_builtin_tools = [write_todos, write_file, read_file, ls, edit_file]
+    all_builtin_tools = [
+        write_todos,
+        write_file,
+        read_file,
+        ls,
+        edit_file,
+        multi_edit,
+        grep,
+        glob,
+    ]
 
     if builtin_tools is not None:
         tools_by_name = {}
@@ -113,7 +131,8 @@ def create_deep_agent(
     """Create a deep agent.
 
     This agent will by default have access to a tool to write todos (write_todos),
-    and then four file editing tools: write_file, ls, read_file, edit_file.
+    and then file tools to edit and search its virtual filesystem: write_file, ls,
+    read_file, edit_file, multi_edit, grep and glob.
 
     Args:
         tools: The additional tools the agent should have access to.
@@ -165,7 +184,8 @@ def async_create_deep_agent(
     """Create a deep agent.
 
     This agent will by default have access to a tool to write todos (write_todos),
-    and then four file editing tools: write_file, ls, read_file, edit_file.
+    and then file tools to edit and search its virtual filesystem: write_file, ls,
+    read_file, edit_file, multi_edit, grep and glob.
 
     Args:
         tools: The additional tools the agent should have access to.
@@ -297,6 +297,14 @@ Since the user is greeting, use the greeting-responder agent to respond with a f
 </commentary>
 assistant: "I'm going to use the Task tool to launch with the greeting-responder agent"
 </example>"""
+LS_DESCRIPTION = """Lists the files in the virtual filesystem.
+
+Usage:
+- Narrow the listing with `path` (a path prefix such as "reports/") and/or `pattern` (a glob such as "*.md" or "**/draft_*")
+- Results are sorted by `sort_by`: "name" (default), "size", "lines" or "modified" (the step in which the file was last written). Set `reverse` for descending order, e.g. the most recently modified files first
+- Listings are paginated: at most `limit` files are returned starting at `offset`, and the output says how to get the next page
+- Set `details` to also show each file's size in bytes, line count and last-modified step, so you can decide what to read without reading every file
+- Prefer `glob` or a filtered `ls` over listing everything when the workspace has many files"""
 EDIT_DESCRIPTION = """Performs exact string replacements in files. 
 
 Usage:
@@ -306,6 +314,30 @@ Usage:
 - Only use emojis if the user explicitly requests it. Avoid adding emojis to files unless asked.
 - The edit will FAIL if `old_string` is not unique in the file. Either provide a larger string with more surrounding context to make it unique or use `replace_all` to change every instance of `old_string`. 
 - Use `replace_all` for replacing and renaming strings across the file. This parameter is useful if you want to rename a variable for instance."""
+MULTI_EDIT_DESCRIPTION = """Makes several exact string replacements in one file with a single tool call. Prefer this tool over repeated `edit_file` calls whenever you need to change more than one place in the same file.
+
+Usage:
+- Same rules as `edit_file`: read the file first, preserve the exact indentation after the line number prefix, and never include any part of the line number prefix in `old_string` or `new_string`.
+- `edits` is an ordered list of `{old_string, new_string, replace_all}` objects. `replace_all` is optional and defaults to false.
+- Every `old_string` is matched against the file as it is BEFORE this call, so an edit cannot match text produced by another edit in the same call, and two edits must not touch overlapping text.
+- Each `old_string` must be unique in the file unless that edit sets `replace_all`. Add surrounding context to make it unique.
+- The edits are atomic: if any one of them is invalid, none are applied and the error names the failing edit."""
+GREP_DESCRIPTION = """Searches the contents of the files for a regular expression and returns only the matching lines.
+
+Usage:
+- ALWAYS use `grep` to locate text instead of reading files one by one with `read_file`
+- `pattern` is a Python regular expression (e.g. "def \\w+", "TODO|FIXME"). `^` and `$` match at the start and end of each line
+- Filter which files are searched with `include`, a glob such as "*.md" or "notes/**"
+- Set `context` to include that many lines before and after each match, and `ignore_case` for case-insensitive search
+- Results look like `path:line_number:line` for matches and `path-line_number-line` for context lines, with `--` between separate groups
+- At most `max_results` matching lines are returned. Narrow the pattern or `include` if the output is truncated
+- Use the line numbers with `read_file`'s `offset` to read around a match"""
+GLOB_DESCRIPTION = """Finds files whose path matches a glob pattern.
+
+Usage:
+- `*` and `?` match within one path segment, `**` matches across directories (e.g. "*.md", "reports/**/*.md", "**/draft_?.txt")
+- Returns the matching paths sorted alphabetically, one per line
+- Use this tool to find files by name. Use `grep` to search inside files"""
 TOOL_DESCRIPTION = """Reads a file from the local filesystem. You can access any file directly by using this tool.
 Assume this tool is able to read all files on the machine. If the User provides a path to a file assume that path is valid. It is okay to read a file that does not exist; an error will be returned.
 
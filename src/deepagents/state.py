@@ -1,5 +1,5 @@
 from langgraph.prebuilt.chat_agent_executor import AgentState
-from typing import NotRequired, Annotated
+from typing import NotRequired, Annotated, Optional
 from typing import Literal
 from typing_extensions import TypedDict
 
@@ -11,15 +11,48 @@ class Todo(TypedDict):
     status: Literal["pending", "in_progress", "completed"]
 
 
+class FileStat(TypedDict):
+    """Precomputed metadata of one file, kept in the `file_stats` channel."""
+
+    size: int
+    lines: int
+    modified_step: Optional[int]
+
+
 def file_reducer(l, r):
-    if l is None:
-        return r
-    elif r is None:
+    """Apply a files delta: `{path: content}` upserts and `{path: None}` deletes.
+
+    Returns a new mapping and never mutates `l`: LangGraph keeps the previous
+    value as a checkpoint and as a streamed snapshot. The copy only duplicates
+    references to the file contents, not the contents themselves.
+    """
+    if r is None:
         return l
-    else:
-        return {**l, **r}
+    merged = dict(l) if l else {}
+    for path, content in r.items():
+        if content is None:
+            merged.pop(path, None)
+        else:
+            merged[path] = content
+    return merged
+
+
+def diff_files(
+    before: Optional[dict[str, str]], after: Optional[dict[str, str]]
+) -> dict[str, Optional[str]]:
+    """Files delta that turns `before` into `after` (used for sub-agent results)."""
+    before = before or {}
+    after = after or {}
+    delta = {
+        path: content
+        for path, content in after.items()
+        if before.get(path) != content
+    }
+    delta.update({path: None for path in before if path not in after})
+    return delta
 
 
 class DeepAgentState(AgentState):
     todos: NotRequired[list[Todo]]
     files: Annotated[NotRequired[dict[str, str]], file_reducer]
+    file_stats: Annotated[NotRequired[dict[str, FileStat]], file_reducer]
@@ -1,11 +1,13 @@
 from .prompts import TASK_DESCRIPTION_PREFIX, TASK_DESCRIPTION_SUFFIX
-from .state import DeepAgentState
+from .state import DeepAgentState, diff_files
+from .file_index import file_stat
 from langgraph.prebuilt import create_react_agent
 from langchain_core.tools import BaseTool
 from typing_extensions import TypedDict
 from langchain_core.tools import tool, InjectedToolCallId
 from langchain_core.messages import ToolMessage
 from langchain_core.language_models import LanguageModelLike
+from langchain_core.runnables import RunnableConfig
 from langchain.chat_models import init_chat_model
 from typing import Annotated, NotRequired, Any, Union
 from langgraph.types import Command
@@ -64,6 +66,19 @@ def _get_subagent_description(subagents):
     return [f"- {_agent['name']}: {_agent['description']}" for _agent in subagents]
 
 
+def _files_update(files, result, config) -> dict:
+    """Deltas of the files the sub-agent changed, with their stats at the current step."""
+    delta = diff_files(files, result.get("files", files))
+    step = (config or {}).get("metadata", {}).get("langgraph_step")
+    return {
+        "files": delta,
+        "file_stats": {
+            path: None if content is None else file_stat(path, content, step)
+            for path, content in delta.items()
+        },
+    }
+
+
 def _create_task_tool(
     tools, instructions, subagents: list[SubAgent], model, state_schema
 ):
@@ -79,15 +94,17 @@ def _create_task_tool(
         subagent_type: str,
         state: Annotated[DeepAgentState, InjectedState],
         tool_call_id: Annotated[str, InjectedToolCallId],
+        config: RunnableConfig = None,
     ):
         if subagent_type not in agents:
             return f"Error: invoked agent of type {subagent_type}, the only allowed types are {[f'`{k}`' for k in agents]}"
         sub_agent = agents[subagent_type]
+        files = state.get("files", {})
         state["messages"] = [{"role": "user", "content": description}]
         result = await sub_agent.ainvoke(state)
         return Command(
             update={
-                "files": result.get("files", {}),
+                **_files_update(files, result, config),
                 "messages": [
                     ToolMessage(
                         result["messages"][-1].content, tool_call_id=tool_call_id
@@ -114,15 +131,17 @@ def _create_sync_task_tool(
         subagent_type: str,
         state: Annotated[DeepAgentState, InjectedState],
         tool_call_id: Annotated[str, InjectedToolCallId],
+        config: RunnableConfig = None,
     ):
         if subagent_type not in agents:
             return f"Error: invoked agent of type {subagent_type}, the only allowed types are {[f'`{k}`' for k in agents]}"
         sub_agent = agents[subagent_type]
+        files = state.get("files", {})
         state["messages"] = [{"role": "user", "content": description}]
         result = sub_agent.invoke(state)
         return Command(
             update={
-                "files": result.get("files", {}),
+                **_files_update(files, result, config),
                 "messages": [
                     ToolMessage(
                         result["messages"][-1].content, tool_call_id=tool_call_id
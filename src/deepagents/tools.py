@@ -1,15 +1,24 @@
+import re
+
 from langchain_core.tools import tool, InjectedToolCallId
+from langchain_core.runnables import RunnableConfig
 from langgraph.types import Command
 from langchain_core.messages import ToolMessage
-from typing import Annotated, Union
+from typing import Annotated, Literal, NotRequired, Optional, Union
+from typing_extensions import TypedDict
 from langgraph.prebuilt import InjectedState
 
 from .prompts import (
     WRITE_TODOS_DESCRIPTION,
+    LS_DESCRIPTION,
     EDIT_DESCRIPTION,
+    MULTI_EDIT_DESCRIPTION,
+    GREP_DESCRIPTION,
+    GLOB_DESCRIPTION,
     TOOL_DESCRIPTION,
 )
 from .state import Todo, DeepAgentState
+from .file_index import compile_glob, file_index, file_stat
 
 
 @tool(description=WRITE_TODOS_DESCRIPTION)
@@ -26,9 +35,74 @@ def write_todos(
     )
 
 
-def ls(state: Annotated[DeepAgentState, InjectedState]) -> list[str]:
-    """List all files"""
-    return list(state.get("files", {}).keys())
+def _file_update(
+    state: DeepAgentState, file_path: str, content: str, config: Optional[RunnableConfig]
+) -> dict:
+    """`files` and `file_stats` deltas for one written file."""
+    file_index.invalidate(file_path, state.get("files", {}).get(file_path))
+    step = (config or {}).get("metadata", {}).get("langgraph_step")
+    return {
+        "files": {file_path: content},
+        "file_stats": {file_path: file_stat(file_path, content, step)},
+    }
+
+
+@tool(description=LS_DESCRIPTION)
+def ls(
+    state: Annotated[DeepAgentState, InjectedState],
+    path: Optional[str] = None,
+    pattern: Optional[str] = None,
+    sort_by: Literal["name", "size", "lines", "modified"] = "name",
+    reverse: bool = False,
+    offset: int = 0,
+    limit: int = 100,
+    details: bool = False,
+) -> str:
+    """List files."""
+    files = state.get("files", {})
+    stats = state.get("file_stats") or {}
+    paths = [p for p in files if not path or p.startswith(path)]
+    if pattern:
+        path_filter = compile_glob(pattern)
+        paths = [p for p in paths if path_filter.fullmatch(p)]
+    if not paths:
+        return "No files found"
+
+    def stat(p: str):
+        # Files that never went through a file tool (e.g. passed in the input) are measured on demand
+        return stats.get(p) or file_stat(p, files[p])
+
+    if sort_by == "modified":
+        modified = {p: (stats.get(p) or {}).get("modified_step") for p in paths}
+        paths.sort(key=lambda p: (-1 if modified[p] is None else modified[p], p), reverse=reverse)
+    elif sort_by in ("size", "lines"):
+        paths.sort(key=lambda p: (stat(p)[sort_by], p), reverse=reverse)
+    else:
+        paths.sort(reverse=reverse)
+
+    total = len(paths)
+    offset = max(0, offset)
+    if offset >= total:
+        return f"Error: Offset {offset} exceeds the number of files ({total})"
+    page = paths[offset : offset + max(1, limit)]
+
+    if details:
+        lines = []
+        for p in page:
+            file_info = stat(p)
+            step = file_info["modified_step"]
+            lines.append(
+                f"{p}\t{file_info['size']} bytes\t{file_info['lines']} lines\t"
+                f"modified at step {'-' if step is None else step}"
+            )
+    else:
+        lines = list(page)
+    if offset + len(page) < total:
+        lines.append(
+            f"(showing {offset + 1}-{offset + len(page)} of {total} files; "
+            f"use offset={offset + len(page)} for more)"
+        )
+    return "\n".join(lines)
 
 
 @tool(description=TOOL_DESCRIPTION)
@@ -46,12 +120,12 @@ def read_file(
     # Get file content
     content = mock_filesystem[file_path]
 
-    # Handle empty file
-    if not content or content.strip() == "":
+    # Handle empty file (isspace stops at the first visible character)
+    if not content or content.isspace():
         return "System reminder: File exists but has empty contents"
 
-    # Split content into lines
-    lines = content.splitlines()
+    # Line offsets are indexed once per file version, so any window is a direct slice
+    lines = file_index.lines(file_path, content)
 
     # Apply line offset and limit
     start_idx = offset
@@ -64,11 +138,8 @@ def read_file(
     # Format output with line numbers (cat -n format)
     result_lines = []
     for i in range(start_idx, end_idx):
-        line_content = lines[i]
-
         # Truncate lines longer than 2000 characters
-        if len(line_content) > 2000:
-            line_content = line_content[:2000]
+        line_content = lines.line(i, max_chars=2000)
 
         # Line numbers start at 1, so add 1 to the index
         line_number = i + 1
@@ -82,13 +153,12 @@ def write_file(
     content: str,
     state: Annotated[DeepAgentState, InjectedState],
     tool_call_id: Annotated[str, InjectedToolCallId],
+    config: RunnableConfig = None,
 ) -> Command:
     """Write to a file."""
-    files = state.get("files", {})
-    files[file_path] = content
     return Command(
         update={
-            "files": files,
+            **_file_update(state, file_path, content, config),
             "messages": [
                 ToolMessage(f"Updated file {file_path}", tool_call_id=tool_call_id)
             ],
@@ -104,6 +174,7 @@ def edit_file(
     state: Annotated[DeepAgentState, InjectedState],
     tool_call_id: Annotated[str, InjectedToolCallId],
     replace_all: bool = False,
+    config: RunnableConfig = None,
 ) -> Union[Command, str]:
     """Write to a file."""
     mock_filesystem = state.get("files", {})
@@ -137,11 +208,162 @@ def edit_file(
         )  # Replace only first occurrence
         result_msg = f"Successfully replaced string in '{file_path}'"
 
-    # Update the mock filesystem
-    mock_filesystem[file_path] = new_content
+    # Only send the edited file; the files reducer merges it into state
     return Command(
         update={
-            "files": mock_filesystem,
+            **_file_update(state, file_path, new_content, config),
             "messages": [ToolMessage(result_msg, tool_call_id=tool_call_id)],
         }
     )
+
+
+class FileEdit(TypedDict):
+    """One replacement in a `multi_edit` call."""
+
+    old_string: str
+    new_string: str
+    replace_all: NotRequired[bool]
+
+
+@tool(description=MULTI_EDIT_DESCRIPTION)
+def multi_edit(
+    file_path: str,
+    edits: list[FileEdit],
+    state: Annotated[DeepAgentState, InjectedState],
+    tool_call_id: Annotated[str, InjectedToolCallId],
+    config: RunnableConfig = None,
+) -> Union[Command, str]:
+    """Apply several edits to a file at once."""
+    mock_filesystem = state.get("files", {})
+    if file_path not in mock_filesystem:
+        return f"Error: File '{file_path}' not found"
+    if not edits:
+        return "Error: No edits provided"
+
+    content = mock_filesystem[file_path]
+    first_edit = {}
+    for number, edit in enumerate(edits, 1):
+        old_string = edit["old_string"]
+        if not old_string:
+            return f"Error: Edit {number} has an empty old_string"
+        if old_string in first_edit:
+            return f"Error: Edits {first_edit[old_string]} and {number} have the same old_string: '{old_string}'"
+        first_edit[old_string] = number
+
+    # Find every occurrence of every old_string in a single left-to-right scan of the
+    # original content (the longest old_string wins where several start together)
+    by_length = sorted(range(len(edits)), key=lambda i: -len(edits[i]["old_string"]))
+    pattern = re.compile(
+        "|".join(f"(?P<e{i}>{re.escape(edits[i]['old_string'])})" for i in by_length)
+    )
+    matches = [(match.start(), match.end(), int(match.lastgroup[1:])) for match in pattern.finditer(content)]
+    occurrences = [0] * len(edits)
+    for _, _, i in matches:
+        occurrences[i] += 1
+
+    # Validate all the edits before applying any of them
+    for number, (edit, count) in enumerate(zip(edits, occurrences), 1):
+        old_string = edit["old_string"]
+        if count == 0 and old_string not in content:
+            return f"Error: Edit {number}: String not found in file: '{old_string}'"
+        # Occurrences missing from the scan were consumed by another edit's match
+        if count != content.count(old_string):
+            return f"Error: Edit {number} overlaps text matched by another edit: '{old_string}'"
+        if count > 1 and not edit.get("replace_all", False):
+            return f"Error: Edit {number}: String '{old_string}' appears {count} times in file. Use replace_all=True to replace all instances, or provide a more specific string with surrounding context."
+
+    # Rebuild the content once from the untouched slices and the replacements
+    pieces = []
+    position = 0
+    for start, end, i in matches:
+        pieces.append(content[position:start])
+        pieces.append(edits[i]["new_string"])
+        position = end
+    pieces.append(content[position:])
+    new_content = "".join(pieces)
+
+    return Command(
+        update={
+            **_file_update(state, file_path, new_content, config),
+            "messages": [
+                ToolMessage(
+                    f"Successfully applied {len(edits)} edit(s) ({len(matches)} replacement(s)) to '{file_path}'",
+                    tool_call_id=tool_call_id,
+                )
+            ],
+        }
+    )
+
+
+@tool(description=GREP_DESCRIPTION)
+def grep(
+    pattern: str,
+    state: Annotated[DeepAgentState, InjectedState],
+    include: Optional[str] = None,
+    ignore_case: bool = False,
+    context: int = 0,
+    max_results: int = 100,
+) -> str:
+    """Search file contents."""
+    try:
+        regex = re.compile(pattern, re.MULTILINE | (re.IGNORECASE if ignore_case else 0))
+    except re.error as e:
+        return f"Error: Invalid regex pattern '{pattern}': {e}"
+    path_filter = compile_glob(include) if include else None
+    context = max(0, context)
+
+    output = []
+    matched = 0
+    for path in sorted(state.get("files", {})):
+        if matched >= max_results:
+            break
+        if path_filter is not None and not path_filter.fullmatch(path):
+            continue
+        content = state["files"][path]
+        match = regex.search(content)
+        if match is None:
+            continue
+
+        # Matches are mapped to lines through the cached offsets of this file version;
+        # after a match the search resumes on the next line, so each line is reported once
+        lines = file_index.lines(path, content)
+        match_lines = []
+        while match is not None and matched < max_results:
+            i = lines.line_of(match.start())
+            if i >= len(lines):
+                break
+            match_lines.append(i)
+            matched += 1
+            if i + 1 >= len(lines):
+                break
+            match = regex.search(content, lines.starts[i + 1])
+
+        # Print each match with its context, separating groups that aren't contiguous
+        hits = set(match_lines)
+        last_shown = None
+        for i in match_lines:
+            first = max(0, i - context)
+            if last_shown is not None:
+                first = max(first, last_shown + 1)
+            if context and output and (last_shown is None or first > last_shown + 1):
+                output.append("--")
+            for j in range(first, min(len(lines), i + context + 1)):
+                separator = ":" if j in hits else "-"
+                output.append(f"{path}{separator}{j + 1}{separator}{lines.line(j, max_chars=2000)}")
+                last_shown = j
+
+    if not output:
+        return f"No matches found for pattern '{pattern}'"
+    if matched >= max_results:
+        output.append(f"(showing the first {max_results} matching lines)")
+    return "\n".join(output)
+
+
+@tool(description=GLOB_DESCRIPTION)
+def glob(pattern: str, state: Annotated[DeepAgentState, InjectedState]) -> str:
+    """Find files by path."""
+    path_filter = compile_glob(pattern)
+    paths = sorted(path for path in state.get("files", {}) if path_filter.fullmatch(path))
+    if not paths:
+        return f"No files match pattern '{pattern}'"
+    return "\n".join(paths)
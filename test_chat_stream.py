@@ -0,0 +1,176 @@
+import asyncio
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+# Base de datos temporal: debe configurarse antes de importar agent/database
+_db_dir = tempfile.mkdtemp()
+os.environ.setdefault("DATABASE_URL", os.getenv("TEST_DATABASE_URL") or f"sqlite:///{os.path.join(_db_dir, 'test_stream.db')}")
+os.environ.setdefault("ANTHROPIC_API_KEY", "test")
+
+from fastapi.testclient import TestClient  # noqa: E402
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage, ToolMessage  # noqa: E402
+from langgraph.types import Command  # noqa: E402
+
+import agent as agent_module  # noqa: E402
+from database import ThreadService, async_init_database, dispose_engines  # noqa: E402
+from scheduler import thread_run_locks  # noqa: E402
+
+MAIN = {"langgraph_checkpoint_ns": "agent:1"}
+SUB_AGENT = {"langgraph_checkpoint_ns": "tools:2|agent:3"}
+
+
+class FakeStreamingAgent:
+    """Agente falso que emite una secuencia fija de eventos de astream_events"""
+
+    def __init__(self, events, fail_after=None):
+        self.events = events
+        self.fail_after = fail_after
+
+    async def astream_events(self, inputs, config, version="v2"):
+        for i, event in enumerate(self.events):
+            if self.fail_after is not None and i == self.fail_after:
+                raise RuntimeError("fallo del modelo")
+            yield event
+
+
+def _events(prefix):
+    ai_message = AIMessage(
+        id=f"{prefix}-ai-1", content="Hola",
+        tool_calls=[{"name": "write_todos", "args": {"todos": "1. buscar"}, "id": "call-1"}],
+    )
+    tool_message = ToolMessage(id=f"{prefix}-tool-1", content="📋 Lista de tareas actualizada: 1. buscar", tool_call_id="call-1")
+    final_message = AIMessage(id=f"{prefix}-ai-2", content="Listo")
+    return [
+        {"event": "on_chat_model_stream", "metadata": MAIN, "data": {"chunk": AIMessageChunk(content="Hola")}},
+        {"event": "on_chat_model_stream", "metadata": SUB_AGENT, "data": {"chunk": AIMessageChunk(content="interno")}},
+        {"event": "on_chat_model_end", "metadata": MAIN, "data": {"output": ai_message}},
+        {"event": "on_tool_start", "name": "ls", "run_id": "sub", "metadata": SUB_AGENT, "data": {"input": {}}},
+        {"event": "on_tool_start", "name": "write_todos", "run_id": "r1", "metadata": MAIN,
+         "data": {"input": {"todos": "1. buscar"}}},
+        {"event": "on_tool_end", "name": "write_todos", "run_id": "r1", "metadata": MAIN,
+         "data": {"output": tool_message, "input": {"todos": "1. buscar"}}},
+        {"event": "on_chat_model_stream", "metadata": MAIN, "data": {"chunk": AIMessageChunk(content=" Listo")}},
+        {"event": "on_chain_end", "parent_ids": [], "metadata": {},
+         "data": {"output": {"messages": [HumanMessage(content="hola"), ai_message, tool_message, final_message]}}},
+    ]
+
+
+def _command_events(prefix):
+    """Eventos con una herramienta de deepagents, que devuelve un Command"""
+    ai_message = AIMessage(
+        id=f"{prefix}-ai-1", content="Escribo",
+        tool_calls=[{"name": "write_file", "args": {"file_path": "a.md", "content": "x"}, "id": "call-1"}],
+    )
+    command = Command(update={
+        "files": {"a.md": "x"},
+        "messages": [ToolMessage(id=f"{prefix}-tool-1", content="Updated file a.md", tool_call_id="call-1")],
+    })
+    return [
+        {"event": "on_chat_model_stream", "metadata": MAIN, "data": {"chunk": AIMessageChunk(content="Escribo")}},
+        {"event": "on_chat_model_end", "metadata": MAIN, "data": {"output": ai_message}},
+        {"event": "on_tool_end", "name": "write_file", "run_id": "r1", "metadata": MAIN,
+         "data": {"output": command, "input": {"file_path": "a.md", "content": "x"}}},
+        {"event": "on_chat_model_stream", "metadata": MAIN, "data": {"chunk": AIMessageChunk(content="más")}},
+        {"event": "on_chat_model_stream", "metadata": MAIN, "data": {"chunk": AIMessageChunk(content="texto")}},
+    ]
+
+
+async def _disconnecting_stream(thread_id, frames_before_disconnect):
+    """Llamar a /chat/stream por ASGI 2.4 con un cliente que se desconecta tras N frames"""
+    body = json.dumps({"message": "hola", "thread_id": thread_id}).encode()
+    scope = {
+        "type": "http", "asgi": {"version": "3.0", "spec_version": "2.4"}, "http_version": "1.1",
+        "method": "POST", "scheme": "http", "path": "/chat/stream", "raw_path": b"/chat/stream",
+        "query_string": b"", "root_path": "", "client": ("test", 1), "server": ("test", 80),
+        "headers": [(b"host", b"test"), (b"content-type", b"application/json")],
+    }
+    received = []
+    frames = []
+    await async_init_database()
+
+    async def receive():
+        if not received:
+            received.append(True)
+            return {"type": "http.request", "body": body, "more_body": False}
+        await asyncio.Event().wait()
+
+    async def send(message):
+        if message["type"] == "http.response.body" and message.get("body"):
+            frames.append(message["body"])
+            if len(frames) > frames_before_disconnect:
+                raise OSError("cliente desconectado")
+
+    try:
+        await agent_module.app(scope, receive, send)
+    except Exception:
+        pass
+    thread = await ThreadService.get_thread(thread_id)
+    await dispose_engines()
+    return frames, thread
+
+
+def _frames(response):
+    return [json.loads(line[len("data: "):]) for line in response.text.splitlines() if line.startswith("data: ")]
+
+
+class TestChatStream(unittest.TestCase):
+    def tearDown(self):
+        # asyncio.run abre un event loop nuevo: no reutilizar conexiones del anterior
+        asyncio.run(dispose_engines())
+
+    def _stream(self, fake_agent, thread_id):
+        with mock.patch.object(agent_module, "agent", fake_agent), TestClient(agent_module.app) as client:
+            return client.post("/chat/stream", json={"message": "hola", "thread_id": thread_id})
+
+    def test_frames_y_persistencia(self):
+        """Solo llegan los eventos del agente principal y la ejecución se guarda al terminar"""
+        response = self._stream(FakeStreamingAgent(_events("ok")), "stream-ok")
+        frames = _frames(response)
+
+        self.assertEqual([f["type"] for f in frames],
+                         ["start", "text_chunk", "tool_start", "todos", "tool_end", "text_chunk", "complete"])
+        self.assertEqual("".join(f["content"] for f in frames if f["type"] == "text_chunk"), "Hola Listo")
+        self.assertEqual(frames[-1]["todos"][0]["content"], "buscar")
+        self.assertFalse(thread_run_locks.is_busy("stream-ok"))
+
+        thread = asyncio.run(ThreadService.get_thread("stream-ok"))
+        self.assertEqual([m.type for m in thread.messages], ["human", "ai", "tool", "ai"])
+        self.assertEqual([t.content for t in thread.todos], ["buscar"])
+
+    def test_error_guarda_el_mensaje_del_usuario(self):
+        """Si el stream falla se guarda el mensaje del usuario y lo que el agente completó"""
+        response = self._stream(FakeStreamingAgent(_events("error"), fail_after=6), "stream-error")
+        frames = _frames(response)
+
+        self.assertEqual(frames[-1]["type"], "error")
+        self.assertFalse(thread_run_locks.is_busy("stream-error"))
+
+        thread = asyncio.run(ThreadService.get_thread("stream-error"))
+        self.assertEqual([m.type for m in thread.messages], ["human", "ai", "tool"])
+        self.assertEqual(thread.messages[0].content, "hola")
+
+
+    def test_error_guarda_la_salida_command_de_las_herramientas(self):
+        """Las herramientas que devuelven Command también se conservan al fallar el stream"""
+        response = self._stream(FakeStreamingAgent(_command_events("cmd"), fail_after=3), "stream-command")
+        self.assertEqual(_frames(response)[-1]["type"], "error")
+
+        thread = asyncio.run(ThreadService.get_thread("stream-command"))
+        self.assertEqual([m.type for m in thread.messages], ["human", "ai", "tool"])
+        self.assertEqual(thread.messages[2].content, "Updated file a.md")
+
+    def test_desconexion_del_cliente_guarda_lo_completado(self):
+        """Si el cliente se desconecta se guardan los turnos completados, no solo el mensaje del usuario"""
+        with mock.patch.object(agent_module, "agent", FakeStreamingAgent(_command_events("disc"))):
+            frames, thread = asyncio.run(_disconnecting_stream("stream-disconnect", 3))
+
+        self.assertEqual(len(frames), 4)
+        self.assertFalse(thread_run_locks.is_busy("stream-disconnect"))
+        self.assertEqual([m.type for m in thread.messages], ["human", "ai", "tool"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,528 @@
+import asyncio
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from sqlalchemy import delete, select, text
+from sqlalchemy.exc import OperationalError
+
+# Base de datos temporal: debe configurarse antes de importar database.
+# Con TEST_DATABASE_URL=postgresql://... la suite corre contra Postgres (base de datos vacía)
+_db_dir = tempfile.mkdtemp()
+os.environ["DATABASE_URL"] = os.getenv("TEST_DATABASE_URL") or f"sqlite:///{os.path.join(_db_dir, 'test_threads.db')}"
+
+from database import (  # noqa: E402
+    IS_POSTGRES, IS_SQLITE, AsyncReadSessionLocal, AsyncReplicaSessionLocal, AsyncSessionLocal, ThreadService, async_engine, async_init_database, async_read_engine, async_replica_engine,
+    ThreadCache, async_database_url, dispose_engines, redact_database_url, sqlite_maintenance, thread_cache, thread_loader,
+)
+from models import FileBlob, ThreadFile, ThreadTodo, content_hash  # noqa: E402
+
+
+class TestDatabaseUrl(unittest.TestCase):
+    def test_driver_asincrono(self):
+        """Las URL de SQLite y Postgres se traducen a aiosqlite y asyncpg"""
+        self.assertEqual(async_database_url("sqlite:///threads.db"), "sqlite+aiosqlite:///threads.db")
+        self.assertEqual(async_database_url("postgres://u:p@db:5432/lois"), "postgresql+asyncpg://u:p@db:5432/lois")
+        self.assertEqual(async_database_url("postgresql://u:p@db/lois?sslmode=require"),
+                         "postgresql+asyncpg://u:p@db/lois?ssl=require")
+
+    def test_url_sin_contrasena(self):
+        """La URL que se muestra no incluye la contraseña"""
+        self.assertEqual(redact_database_url("postgresql://lois:s3cr3t@db:5432/lois"),
+                         "postgresql://lois:***@db:5432/lois")
+        self.assertEqual(redact_database_url("sqlite:///threads.db"), "sqlite:///threads.db")
+
+
+class DatabaseTestCase(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        await async_init_database()
+
+    async def asyncTearDown(self):
+        # Las conexiones del pool pertenecen al event loop de cada test
+        await dispose_engines()
+
+
+class TestSearchThreadSummaries(DatabaseTestCase):
+    async def test_resumen_con_conteos_y_preview(self):
+        """El modo resumen devuelve conteos y vista previa sin cargar el contenido"""
+        await ThreadService.create_thread("summary-1")
+        await ThreadService.add_message("summary-1", {"id": "summary-1-m1", "type": "human", "content": "Primera pregunta\nmás texto"})
+        await ThreadService.add_message("summary-1", {"id": "summary-1-m2", "type": "ai", "content": "Respuesta"})
+        await ThreadService.update_thread_files("summary-1", {"a.md": "x" * 1000, "b.md": "y"})
+        await ThreadService.update_thread_todos("summary-1", [{"content": "t", "status": "pending", "activeForm": "t"}])
+
+        summaries = await ThreadService.search_thread_summaries(limit=100, sort_by="updated_at")
+        summary = next(s for s in summaries if s["thread_id"] == "summary-1")
+
+        self.assertEqual(summary["message_count"], 2)
+        self.assertEqual(summary["files_count"], 2)
+        self.assertEqual(summary["todos_count"], 1)
+        self.assertEqual(summary["title"], "Primera pregunta")
+        self.assertTrue(summary["preview"].startswith("Primera pregunta"))
+
+    async def test_paginacion_keyset(self):
+        """Recorrer con cursor devuelve todos los threads sin repetir ni saltar"""
+        for i in range(5):
+            await ThreadService.create_thread(f"page-{i}")
+
+        seen = []
+        cursor = None
+        while True:
+            page = await ThreadService.search_thread_summaries(limit=2, sort_by="created_at", sort_order="desc", cursor=cursor)
+            seen.extend(s["thread_id"] for s in page)
+            if len(page) < 2:
+                break
+            cursor = page[-1]["cursor"]
+
+        page_ids = [thread_id for thread_id in seen if thread_id.startswith("page-")]
+        self.assertEqual(len(seen), len(set(seen)))
+        self.assertEqual(sorted(page_ids), [f"page-{i}" for i in range(5)])
+
+
+class TestAddMessages(DatabaseTestCase):
+    async def test_guarda_mensajes_todos_y_archivos_en_una_transaccion(self):
+        """add_messages crea el thread y guarda toda la salida de una ejecución"""
+        messages = await ThreadService.add_messages(
+            "bulk-1",
+            [
+                {"id": "bulk-1-m1", "type": "human", "content": "hola"},
+                {"id": "bulk-1-m2", "type": "ai", "content": "respuesta", "tool_calls": [{"name": "write_file"}]},
+            ],
+            todos_list=[{"content": "t1", "status": "pending", "activeForm": "t1"}],
+            files_dict={"a.md": "contenido"},
+        )
+        self.assertEqual([m.id for m in messages], ["bulk-1-m1", "bulk-1-m2"])
+        self.assertIsNotNone(messages[0].timestamp)
+
+        thread = await ThreadService.get_thread("bulk-1")
+        self.assertEqual(len(thread.messages), 2)
+        self.assertEqual({f.filename: f.content for f in thread.files}, {"a.md": "contenido"})
+        self.assertEqual([t.content for t in thread.todos], ["t1"])
+
+    async def test_falla_sin_escrituras_parciales(self):
+        """Si una inserción falla no queda ningún mensaje de la ejecución guardado"""
+        await ThreadService.add_messages("bulk-2", [{"id": "bulk-2-m1", "type": "human", "content": "hola"}])
+        with self.assertRaises(Exception):
+            await ThreadService.add_messages(
+                "bulk-2",
+                [
+                    {"id": "bulk-2-m2", "type": "ai", "content": "nuevo"},
+                    {"id": "bulk-2-m1", "type": "ai", "content": "duplicado"},
+                ],
+            )
+        thread = await ThreadService.get_thread("bulk-2")
+        self.assertEqual([m.id for m in thread.messages], ["bulk-2-m1"])
+
+
+class TestMessageContent(DatabaseTestCase):
+    async def test_normaliza_al_escribir(self):
+        """El texto visible y las partes se calculan al guardar, no al leer"""
+        content = '[{"type": "text", "text": "hola"}, {"type": "tool_use", "name": "ls"}]'
+        await ThreadService.add_messages("content-1", [
+            {"id": "content-1-m1", "type": "ai", "content": content},
+            {"id": "content-1-m2", "type": "human", "content": "[nota] texto plano"},
+        ])
+        thread = await ThreadService.get_thread("content-1")
+        first, second = sorted(thread.messages, key=lambda m: m.id)
+
+        self.assertEqual(first.display_text, "hola")
+        self.assertEqual(first.content_parts[1]["type"], "tool_use")
+        self.assertEqual(first.to_dict()["content"], "hola")
+        self.assertEqual(second.to_dict()["content"], "[nota] texto plano")
+        self.assertIsNone(second.content_parts)
+
+
+class TestThreadChanges(DatabaseTestCase):
+    async def test_since_devuelve_solo_lo_nuevo(self):
+        """Con since solo llegan los mensajes y archivos escritos después de esa versión"""
+        await ThreadService.add_messages(
+            "delta-1",
+            [{"id": "delta-1-m1", "type": "human", "content": "hola"}],
+            todos_list=[{"content": "t1", "status": "pending", "activeForm": "t1"}],
+            files_dict={"a.md": "a", "b.md": "b"},
+        )
+        first = await ThreadService.get_thread_changes("delta-1", 0)
+        self.assertEqual(first["version"], 1)
+        self.assertEqual(first["files"], {"a.md": "a", "b.md": "b"})
+
+        await ThreadService.add_messages(
+            "delta-1",
+            [{"id": "delta-1-m2", "type": "ai", "content": "respuesta"}],
+            files_dict={"a.md": "a", "c.md": "c"},
+        )
+        changes = await ThreadService.get_thread_changes("delta-1", first["version"])
+
+        self.assertEqual(changes["version"], 2)
+        self.assertEqual([m.id for m in changes["messages"]], ["delta-1-m2"])
+        self.assertEqual(changes["files"], {"c.md": "c"})
+        self.assertEqual(changes["file_names"], ["a.md", "c.md"])
+        self.assertIsNone(changes["todos"])
+        self.assertEqual(changes["message_count"], 2)
+
+        unchanged = await ThreadService.get_thread_changes("delta-1", changes["version"])
+        self.assertEqual(unchanged["messages"], [])
+        self.assertEqual(unchanged["files"], {})
+
+    async def test_version_atomica_con_escritores_concurrentes(self):
+        """Escrituras concurrentes en el mismo thread obtienen versiones distintas y consecutivas"""
+        import asyncio
+
+        await ThreadService.create_thread("delta-2")
+        await asyncio.gather(*(
+            ThreadService.update_thread_todos("delta-2", [{"content": f"t{i}", "status": "pending", "activeForm": "t"}])
+            for i in range(10)
+        ))
+        changes = await ThreadService.get_thread_changes("delta-2", 0)
+        self.assertEqual(changes["version"], 10)
+        self.assertEqual(len(changes["todos"]), 1)
+        self.assertEqual(changes["todos"][0].version, 10)
+
+
+class TestEnsureThread(DatabaseTestCase):
+    async def test_get_or_create_concurrente(self):
+        """Varias peticiones concurrentes sobre un thread nuevo lo crean una sola vez"""
+        created = await asyncio.gather(*(ThreadService.ensure_thread("ensure-1") for _ in range(5)))
+        self.assertEqual(created.count(True), 1)
+
+        threads = await asyncio.gather(*(ThreadService.get_or_create_thread("ensure-2") for _ in range(5)))
+        self.assertEqual({thread.id for thread in threads}, {"ensure-2"})
+
+    async def test_primer_mensaje_crea_el_thread(self):
+        """add_message sobre un thread inexistente lo crea con versión y seq iniciales"""
+        message = await ThreadService.add_message("ensure-3", {"id": "ensure-3-m1", "type": "human", "content": "hola"})
+        self.assertEqual((message.version, message.seq), (1, 1))
+        self.assertFalse(await ThreadService.ensure_thread("ensure-3"))
+        thread = await ThreadService.get_thread("ensure-3")
+        self.assertEqual((thread.version, thread.message_seq, thread.thread_metadata), (1, 1, {}))
+
+
+class TestFileAndTodoSync(DatabaseTestCase):
+    async def _rows(self, model, thread_id):
+        async with AsyncReadSessionLocal() as session:
+            result = await session.execute(select(model).where(model.thread_id == thread_id))
+            return list(result.scalars().all())
+
+    async def test_solo_se_reescriben_los_archivos_cambiados(self):
+        """Los archivos sin cambios conservan su fila y versión; los eliminados se borran"""
+        await ThreadService.update_thread_files("sync-1", {"a.md": "a", "b.md": "b", "c.md": "c"})
+        before = {f.filename: f for f in await self._rows(ThreadFile, "sync-1")}
+
+        await ThreadService.update_thread_files("sync-1", {"a.md": "a", "b.md": "b2", "d.md": "d"})
+        after = {f.filename: f for f in await self._rows(ThreadFile, "sync-1")}
+
+        self.assertEqual(sorted(after), ["a.md", "b.md", "d.md"])
+        self.assertEqual((after["a.md"].id, after["a.md"].version), (before["a.md"].id, 1))
+        self.assertEqual((after["b.md"].id, after["b.md"].content, after["b.md"].version), (before["b.md"].id, "b2", 2))
+        self.assertEqual(after["b.md"].content_hash, content_hash("b2"))
+        self.assertEqual(after["d.md"].version, 2)
+
+    async def test_todos_por_posicion(self):
+        """Solo se actualizan los todos que cambian y se borran los que sobran"""
+        todos = [{"content": f"t{i}", "status": "pending", "activeForm": f"t{i}"} for i in range(3)]
+        await ThreadService.update_thread_todos("sync-2", todos)
+        todos[1]["status"] = "completed"
+        await ThreadService.update_thread_todos("sync-2", todos[:2])
+
+        rows = sorted(await self._rows(ThreadTodo, "sync-2"), key=lambda t: t.position)
+        self.assertEqual([(t.content, t.status, t.version) for t in rows],
+                         [("t0", "pending", 1), ("t1", "completed", 2)])
+
+        # Repetir la misma lista no cambia los todos ni los devuelve en el delta
+        await ThreadService.update_thread_todos("sync-2", todos[:2])
+        changes = await ThreadService.get_thread_changes("sync-2", 2)
+        self.assertIsNone(changes["todos"])
+        thread = await ThreadService.get_thread("sync-2")
+        self.assertEqual([t.content for t in thread.todos], ["t0", "t1"])
+
+
+class TestFileBlobs(DatabaseTestCase):
+    async def _blob(self, content):
+        async with AsyncReadSessionLocal() as session:
+            return await session.get(FileBlob, content_hash(content))
+
+    async def test_blobs_compartidos_y_con_referencias(self):
+        """Un contenido repetido entre threads se guarda comprimido una sola vez"""
+        log = "fuente consultada\n" * 500
+        await ThreadService.update_thread_files("blob-1", {"research_log.md": log})
+        await ThreadService.update_thread_files("blob-2", {"research_log.md": log, "copia.md": log})
+
+        blob = await self._blob(log)
+        self.assertEqual(blob.ref_count, 3)
+        self.assertLess(len(blob.data), blob.size)
+        thread = await ThreadService.get_thread("blob-2")
+        self.assertEqual({f.filename: f.content for f in thread.files}, {"research_log.md": log, "copia.md": log})
+
+        await ThreadService.update_thread_files("blob-2", {"research_log.md": "otro"})
+        self.assertEqual((await self._blob(log)).ref_count, 1)
+        await ThreadService.delete_thread("blob-1")
+        self.assertIsNone(await self._blob(log))
+        self.assertEqual((await self._blob("otro")).ref_count, 1)
+
+    async def test_recolectar_blobs_huerfanos(self):
+        """collect_file_blobs recalcula las referencias y elimina los blobs sin archivos"""
+        await ThreadService.update_thread_files("blob-3", {"a.md": "huérfano"})
+        async with AsyncSessionLocal() as session:
+            async with session.begin():
+                await session.execute(delete(ThreadFile).where(ThreadFile.thread_id == "blob-3"))
+
+        self.assertGreaterEqual(await ThreadService.collect_file_blobs(), 1)
+        self.assertIsNone(await self._blob("huérfano"))
+
+    @unittest.skipUnless(IS_POSTGRES, "carrera entre escritores concurrentes (solo Postgres)")
+    async def test_blob_liberado_mientras_otro_escritor_lo_referencia(self):
+        """Un blob que otra transacción deja a cero no se elimina si esta lo está referenciando"""
+        content = "contenido compartido entre escritores"
+        digest = content_hash(content)
+        await ThreadService.update_thread_files("blob-race-1", {"a.md": content})
+        await ThreadService.ensure_thread("blob-race-2")
+
+        async with AsyncSessionLocal() as session:
+            async with session.begin():
+                # T2 ve el blob (y lo bloquea) antes de que T1 lo deje sin referencias
+                await ThreadService._store_file_blobs(session, {digest: content}, lock_hashes=[digest])
+                releasing = asyncio.ensure_future(ThreadService.update_thread_files("blob-race-1", {}))
+                await asyncio.sleep(0.5)
+                self.assertFalse(releasing.done())
+                await ThreadService._upsert(session, ThreadFile, [{
+                    "thread_id": "blob-race-2", "filename": "b.md", "content": None,
+                    "content_hash": digest, "version": 1,
+                }], ["thread_id", "filename"], ["content_hash"])
+                await ThreadService._adjust_blob_refs(session, {digest: 1})
+        await asyncio.wait_for(releasing, timeout=5)
+
+        self.assertEqual((await self._blob(content)).ref_count, 1)
+        thread = await ThreadService.get_thread("blob-race-2")
+        self.assertEqual({f.filename: f.content for f in thread.files}, {"b.md": content})
+
+
+class TestThreadCache(DatabaseTestCase):
+    @unittest.skipUnless(thread_cache.enabled, "caché de threads desactivada (por defecto con Postgres)")
+    async def test_lecturas_repetidas_desde_la_cache(self):
+        """La segunda lectura no toca la base de datos y una mutación invalida la entrada"""
+        await ThreadService.add_message("cache-1", {"id": "cache-1-m1", "type": "human", "content": "hola"})
+        first = await ThreadService.get_thread("cache-1")
+        hits = thread_cache.stats()["hits"]
+        self.assertIs(await ThreadService.get_thread("cache-1"), first)
+        self.assertEqual(thread_cache.stats()["hits"], hits + 1)
+
+        await ThreadService.add_message("cache-1", {"id": "cache-1-m2", "type": "ai", "content": "respuesta"})
+        thread = await ThreadService.get_thread("cache-1")
+        self.assertIsNot(thread, first)
+        self.assertEqual([m.id for m in thread.messages], ["cache-1-m1", "cache-1-m2"])
+
+    async def test_carga_invalidada_no_se_guarda(self):
+        """Si el thread cambia mientras se carga, el resultado de esa carga no se cachea"""
+        await ThreadService.create_thread("cache-2")
+        cache = ThreadCache()
+        token = cache.begin_load("cache-2")
+        thread = await ThreadService.get_thread("cache-2")
+        cache.invalidate("cache-2")
+        cache.put("cache-2", thread, token)
+        cache.end_load("cache-2")
+        self.assertIsNone(cache.get("cache-2"))
+
+    async def test_limite_de_memoria(self):
+        """Al superar el tamaño máximo se expulsan las entradas menos usadas"""
+        for i in range(3):
+            await ThreadService.add_message(f"cache-lru-{i}", {"id": f"cache-lru-{i}-m1", "type": "human", "content": "x" * 1000})
+        threads = [await ThreadService.get_thread(f"cache-lru-{i}") for i in range(3)]
+        cache = ThreadCache(max_bytes=2 * ThreadCache.estimate_size(threads[0]) + 100)
+        for i, thread in enumerate(threads):
+            cache.put(thread.id, thread, cache.begin_load(thread.id))
+            cache.end_load(thread.id)
+
+        self.assertIsNone(cache.get("cache-lru-0"))
+        self.assertIsNotNone(cache.get("cache-lru-2"))
+        self.assertEqual(cache.stats()["evictions"], 1)
+        self.assertLessEqual(cache.stats()["bytes"], cache.max_bytes)
+
+
+class TestThreadLoader(DatabaseTestCase):
+    async def test_lecturas_concurrentes_en_un_lote(self):
+        """Las lecturas de la misma vuelta del loop se agrupan y las repetidas se comparten"""
+        for i in range(3):
+            await ThreadService.add_message(f"loader-{i}", {"id": f"loader-{i}-m1", "type": "human", "content": "hola"})
+        thread_cache.clear()
+        before = thread_loader.stats()
+
+        ids = ["loader-0", "loader-1", "loader-2", "loader-0", "loader-1", "loader-x"]
+        threads = await asyncio.gather(*(ThreadService.get_thread(thread_id) for thread_id in ids))
+
+        after = thread_loader.stats()
+        self.assertEqual(after["batches"], before["batches"] + 1)
+        self.assertEqual(after["shared_loads"], before["shared_loads"] + 2)
+        self.assertIs(threads[0], threads[3])
+        self.assertEqual([t.messages[0].id for t in threads[:3]], [f"loader-{i}-m1" for i in range(3)])
+        self.assertIsNone(threads[5])
+
+    async def test_escritura_no_comparte_una_carga_anterior(self):
+        """Tras una escritura, get_thread no se une a una carga que empezó antes"""
+        await ThreadService.add_message("loader-w", {"id": "loader-w-m1", "type": "human", "content": "hola"})
+        thread_cache.clear()
+        stale = asyncio.ensure_future(ThreadService.get_thread("loader-w"))
+        await asyncio.sleep(0)
+        await ThreadService.add_message("loader-w", {"id": "loader-w-m2", "type": "ai", "content": "respuesta"})
+        fresh = await ThreadService.get_thread("loader-w")
+        await stale
+
+        self.assertEqual([m.id for m in fresh.messages], ["loader-w-m1", "loader-w-m2"])
+
+    async def test_invalidar_una_carga_encolada_la_resuelve_igual(self):
+        """Si una escritura invalida un thread ya encolado pero aún no despachado, quien espera recibe el thread"""
+        await ThreadService.add_message("loader-q", {"id": "loader-q-m1", "type": "human", "content": "hola"})
+        thread_cache.clear()
+        queued = asyncio.ensure_future(ThreadService.get_thread("loader-q"))
+        await asyncio.sleep(0)
+        # Sin ceder el loop: la carga sigue en la cola del loader cuando se invalida
+        ThreadService._invalidate("loader-q")
+
+        thread = await asyncio.wait_for(queued, timeout=3)
+        self.assertEqual([m.id for m in thread.messages], ["loader-q-m1"])
+        self.assertEqual(thread_loader.stats()["in_flight"], 0)
+
+
+class TestMessagePages(DatabaseTestCase):
+    async def test_paginacion_por_seq(self):
+        """Sin cursor llega la última página; before/after recorren el resto en orden"""
+        await ThreadService.add_messages(
+            "pages-1", [{"id": f"pages-1-m{i}", "type": "human", "content": str(i)} for i in range(1, 8)]
+        )
+        await ThreadService.add_message("pages-1", {"id": "pages-1-m8", "type": "ai", "content": "8"})
+
+        last = await ThreadService.get_message_page("pages-1", limit=3)
+        self.assertEqual([m.seq for m in last["messages"]], [6, 7, 8])
+        self.assertTrue(last["has_more"])
+        self.assertEqual(last["message_count"], 8)
+
+        previous = await ThreadService.get_message_page("pages-1", limit=3, before=6)
+        self.assertEqual([m.content for m in previous["messages"]], ["3", "4", "5"])
+
+        following = await ThreadService.get_message_page("pages-1", limit=5, after=6)
+        self.assertEqual([m.seq for m in following["messages"]], [7, 8])
+        self.assertFalse(following["has_more"])
+
+        window = await ThreadService.get_message_page("pages-1", limit=2, after=2, before=6)
+        self.assertEqual([m.seq for m in window["messages"]], [3, 4])
+        self.assertTrue(window["has_more"])
+
+        thread = await ThreadService.get_thread("pages-1")
+        self.assertEqual([m.seq for m in thread.messages], list(range(1, 9)))
+
+    async def test_seq_sin_duplicados_con_escritores_concurrentes(self):
+        """add_messages concurrentes en el mismo thread reservan rangos de seq disjuntos"""
+        import asyncio
+
+        await ThreadService.create_thread("pages-2")
+        await asyncio.gather(*(
+            ThreadService.add_messages("pages-2", [
+                {"id": f"pages-2-r{run}-m{i}", "type": "ai", "content": str(i)} for i in range(3)
+            ])
+            for run in range(10)
+        ))
+        thread = await ThreadService.get_thread("pages-2")
+        self.assertEqual([m.seq for m in thread.messages], list(range(1, 31)))
+        self.assertEqual(thread.message_seq, 30)
+        self.assertEqual(thread.version, 10)
+        # Cada ejecución tiene sus mensajes contiguos y con la misma versión
+        for start in range(0, 30, 3):
+            runs = {m.id.split("-m")[0] for m in thread.messages[start:start + 3]}
+            self.assertEqual(len(runs), 1)
+
+
+@unittest.skipUnless(IS_SQLITE, "perfil específico de SQLite")
+class TestSQLiteProfile(DatabaseTestCase):
+    async def test_pragmas_en_cada_conexion(self):
+        """Cada conexión abre en WAL con busy_timeout y claves foráneas activadas"""
+        async with async_engine.connect() as conn:
+            self.assertEqual((await conn.exec_driver_sql("PRAGMA journal_mode")).scalar(), "wal")
+            self.assertEqual((await conn.exec_driver_sql("PRAGMA synchronous")).scalar(), 1)
+            self.assertEqual((await conn.exec_driver_sql("PRAGMA busy_timeout")).scalar(), 5000)
+            self.assertEqual((await conn.exec_driver_sql("PRAGMA foreign_keys")).scalar(), 1)
+
+    async def test_pasada_de_mantenimiento(self):
+        """Una pasada de mantenimiento hace checkpoint del WAL y queda registrada"""
+        await ThreadService.add_messages("maint-1", [{"id": "maint-1-m1", "type": "human", "content": "hola"}])
+        stats = await sqlite_maintenance.run_once()
+        self.assertGreaterEqual(stats["runs"], 1)
+        self.assertEqual(stats["last_checkpoint"]["busy"], 0)
+
+    async def test_lecturas_en_el_pool_de_solo_lectura(self):
+        """Las lecturas van al pool mode=ro, que ve lo escrito pero no puede escribir"""
+        self.assertIsNot(async_read_engine, async_engine)
+        self.assertEqual(async_read_engine.url.query.get("mode"), "ro")
+
+        await ThreadService.add_messages("ro-1", [{"id": "ro-1-m1", "type": "human", "content": "hola"}])
+        thread = await ThreadService.get_thread("ro-1")
+        self.assertEqual([m.content for m in thread.messages], ["hola"])
+
+        async with AsyncReadSessionLocal() as session:
+            self.assertEqual((await session.execute(text("PRAGMA query_only"))).scalar(), 1)
+            with self.assertRaises(OperationalError):
+                await session.execute(text("DELETE FROM messages WHERE id = 'ro-1-m1'"))
+
+    async def test_escritores_serializados(self):
+        """El escritor toma el lock con BEGIN IMMEDIATE y las demás escrituras esperan turno"""
+        await ThreadService.create_thread("writer-1")
+        # Tras una pasada AUTOCOMMIT de mantenimiento la conexión vuelve a abrir con BEGIN IMMEDIATE
+        await sqlite_maintenance.run_once()
+
+        async with AsyncSessionLocal() as session:
+            await session.execute(text("SELECT 1"))
+            probe = sqlite3.connect(async_engine.url.database, timeout=0)
+            try:
+                with self.assertRaises(sqlite3.OperationalError):
+                    probe.execute("BEGIN IMMEDIATE")
+            finally:
+                probe.close()
+
+            pending = asyncio.create_task(
+                ThreadService.add_message("writer-1", {"id": "writer-1-m1", "type": "human", "content": "hola"})
+            )
+            await asyncio.sleep(0.2)
+            self.assertFalse(pending.done())
+            self.assertEqual(async_engine.pool.checkedout(), 1)
+
+        await pending
+        thread = await ThreadService.get_thread("writer-1")
+        self.assertEqual([m.id for m in thread.messages], ["writer-1-m1"])
+
+
+@unittest.skipUnless(IS_POSTGRES, "perfil específico de Postgres")
+class TestPostgresProfile(DatabaseTestCase):
+    async def test_opciones_de_asyncpg(self):
+        """Cada conexión usa la caché de sentencias y el application_name configurados"""
+        async with async_engine.connect() as conn:
+            raw = await conn.get_raw_connection()
+            self.assertEqual(raw.driver_connection._config.statement_cache_size, 500)
+            self.assertEqual(raw.dbapi_connection._prepared_statement_cache.capacity, 500)
+            name = (await conn.exec_driver_sql("SHOW application_name")).scalar()
+        self.assertEqual(name, "lois-agent-backend")
+
+    async def test_migraciones_esperan_el_advisory_lock(self):
+        """async_init_database espera mientras otra réplica tiene el lock de migraciones"""
+        async with async_engine.connect() as holder:
+            await holder.exec_driver_sql("SELECT pg_advisory_lock(7265921)")
+            init = asyncio.ensure_future(async_init_database())
+            await asyncio.sleep(0.5)
+            self.assertFalse(init.done())
+            await holder.exec_driver_sql("SELECT pg_advisory_unlock(7265921)")
+        await asyncio.wait_for(init, timeout=5)
+
+    async def test_rowcount_de_on_conflict(self):
+        """INSERT ... ON CONFLICT DO NOTHING informa si insertó (ensure_thread)"""
+        self.assertTrue(await ThreadService.ensure_thread("pg-ensure"))
+        self.assertFalse(await ThreadService.ensure_thread("pg-ensure"))
+
+    async def test_lecturas_de_thread_en_el_primario(self):
+        """Las lecturas de un thread ven lo recién escrito: nunca van a la réplica"""
+        self.assertIs(async_read_engine, async_engine)
+        self.assertIs(AsyncReadSessionLocal.kw["bind"], async_engine)
+        self.assertIs(AsyncReplicaSessionLocal.kw["bind"], async_replica_engine)
+        await ThreadService.add_message("pg-ryw", {"id": "pg-ryw-m1", "type": "human", "content": "hola"})
+        thread = await ThreadService.get_thread("pg-ryw")
+        self.assertEqual([m.id for m in thread.messages], ["pg-ryw-m1"])
+
+
+if __name__ == '__main__':
+    unittest.main()
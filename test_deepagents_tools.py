@@ -0,0 +1,318 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'src'))
+
+from langgraph.checkpoint.memory import InMemorySaver  # noqa: E402
+from langgraph.graph import END, START, StateGraph  # noqa: E402
+
+from deepagents.file_index import FileIndexCache, LineIndex, file_index  # noqa: E402
+from deepagents.state import DeepAgentState, diff_files, file_reducer  # noqa: E402
+from deepagents.tools import edit_file, glob, grep, ls, multi_edit, read_file, write_file  # noqa: E402
+
+
+class TestFilesChannel(unittest.TestCase):
+    def test_las_herramientas_devuelven_solo_el_archivo_tocado(self):
+        """write_file y edit_file envían un delta con la ruta modificada, no todo el mapa"""
+        state = {"files": {"a.md": "hola mundo", "b.md": "otro"}}
+        update = write_file("c.md", "nuevo", state, "call-1").update
+        self.assertEqual(update["files"], {"c.md": "nuevo"})
+
+        update = edit_file.func("a.md", "mundo", "deepagents", state, "call-2").update
+        self.assertEqual(update["files"], {"a.md": "hola deepagents"})
+        # El estado recibido no se modifica
+        self.assertEqual(state["files"], {"a.md": "hola mundo", "b.md": "otro"})
+
+    def test_reducer_aplica_altas_y_borrados_sin_mutar(self):
+        """Cada delta produce un mapa nuevo; el anterior no se toca"""
+        initial = {"a.md": "a", "b.md": "b"}
+        files = file_reducer(initial, {"c.md": "c"})
+        self.assertEqual(initial, {"a.md": "a", "b.md": "b"})
+        self.assertEqual(files, {"a.md": "a", "b.md": "b", "c.md": "c"})
+
+        updated = file_reducer(files, {"a.md": "A", "b.md": None})
+        self.assertIsNot(updated, files)
+        self.assertEqual(updated, {"a.md": "A", "c.md": "c"})
+        self.assertEqual(files, {"a.md": "a", "b.md": "b", "c.md": "c"})
+        # Los contenidos se comparten, no se copian
+        self.assertIs(updated["c.md"], files["c.md"])
+        self.assertIs(file_reducer(files, None), files)
+        self.assertEqual(file_reducer(None, {"x.md": "x", "y.md": None}), {"x.md": "x"})
+
+    def test_diff_files(self):
+        """El delta de un sub-agente incluye solo lo que cambió"""
+        before = {"a.md": "a", "b.md": "b", "c.md": "c"}
+        after = {"a.md": "a", "b.md": "B", "d.md": "d"}
+        self.assertEqual(diff_files(before, after), {"b.md": "B", "d.md": "d", "c.md": None})
+        self.assertEqual(diff_files(before, before), {})
+
+    def test_deltas_en_un_grafo_con_checkpoints(self):
+        """Los deltas se acumulan entre pasos y sobreviven a los checkpoints"""
+        builder = StateGraph(DeepAgentState)
+        builder.add_node("write", lambda state: {"files": {"nuevo.md": "x"}})
+        builder.add_node("delete", lambda state: {"files": {"viejo.md": None}})
+        builder.add_edge(START, "write")
+        builder.add_edge("write", "delete")
+        builder.add_edge("delete", END)
+        graph = builder.compile(checkpointer=InMemorySaver())
+        config = {"configurable": {"thread_id": "files"}}
+
+        initial = {"viejo.md": "v", "otro.md": "o"}
+        result = graph.invoke({"messages": [], "files": initial}, config)
+        self.assertEqual(result["files"], {"otro.md": "o", "nuevo.md": "x"})
+        self.assertEqual(initial, {"viejo.md": "v", "otro.md": "o"})
+
+        result = graph.invoke({"messages": [], "files": {"otro.md": "O"}}, config)
+        self.assertEqual(result["files"], {"otro.md": "O", "nuevo.md": "x"})
+        self.assertEqual(graph.get_state(config).values["files"], {"otro.md": "O", "nuevo.md": "x"})
+
+    def _three_step_graph(self):
+        builder = StateGraph(DeepAgentState)
+        builder.add_node("write_a", lambda state: {"files": {"a.md": "a"}})
+        builder.add_node("write_b", lambda state: {"files": {"b.md": "b"}})
+        builder.add_node("delete_a", lambda state: {"files": {"a.md": None}})
+        builder.add_edge(START, "write_a")
+        builder.add_edge("write_a", "write_b")
+        builder.add_edge("write_b", "delete_a")
+        builder.add_edge("delete_a", END)
+        return builder.compile(checkpointer=InMemorySaver())
+
+    def test_el_historial_conserva_cada_version(self):
+        """Los checkpoints anteriores no ven las escrituras posteriores"""
+        graph = self._three_step_graph()
+        config = {"configurable": {"thread_id": "history"}}
+        graph.invoke({"messages": []}, config)
+
+        history = [
+            snapshot.values.get("files")
+            for snapshot in reversed(list(graph.get_state_history(config)))
+        ]
+        # Entrada, START y un checkpoint por nodo
+        self.assertEqual(history, [{}, {}, {"a.md": "a"}, {"a.md": "a", "b.md": "b"}, {"b.md": "b"}])
+
+    def test_stream_values_son_instantaneas_distintas(self):
+        """stream_mode="values" emite un mapa por paso, cada uno con su contenido"""
+        graph = self._three_step_graph()
+        config = {"configurable": {"thread_id": "stream"}}
+        snapshots = [
+            chunk.get("files")
+            for chunk in graph.stream({"messages": []}, config, stream_mode="values")
+        ]
+        self.assertEqual(snapshots, [{}, {"a.md": "a"}, {"a.md": "a", "b.md": "b"}, {"b.md": "b"}])
+        self.assertEqual(len({id(files) for files in snapshots}), len(snapshots))
+
+
+class TestReadFile(unittest.TestCase):
+    def setUp(self):
+        file_index.clear()
+
+    def test_ventanas_iguales_a_splitlines(self):
+        """Cualquier ventana coincide con la lectura basada en splitlines"""
+        content = "uno\r\ndos\n\ntres\rcuatro\n" + "x" * 2500 + "\nfin\n"
+        state = {"files": {"a.md": content}}
+        lines = content.splitlines()
+        for offset, limit in [(0, 2000), (1, 2), (4, 1), (5, 10)]:
+            expected = "\n".join(f"{i + 1:6d}\t{lines[i][:2000]}"
+                                  for i in range(offset, min(offset + limit, len(lines))))
+            self.assertEqual(read_file.func("a.md", state, offset, limit), expected)
+        self.assertEqual(read_file.func("a.md", state, 7), "Error: Line offset 7 exceeds file length (7 lines)")
+        self.assertIn("empty contents", read_file.func("b.md", {"files": {"b.md": " \n "}}))
+
+    def test_indice_por_version_del_archivo(self):
+        """El índice se reutiliza entre lecturas y se invalida al escribir o editar"""
+        content = "\n".join(f"línea {i}" for i in range(10000))
+        state = {"files": {"big.md": content}}
+        read_file.func("big.md", state, 9000, 5)
+        index = file_index.lines("big.md", content)
+        self.assertEqual(read_file.func("big.md", state, 9999, 5), " 10000\tlínea 9999")
+        self.assertIs(file_index.lines("big.md", content), index)
+
+        write_file("big.md", "nuevo", state, "call-1")
+        self.assertIsNot(file_index.lines("big.md", content), index)
+        # Otra versión del contenido nunca reutiliza el índice anterior
+        self.assertEqual(read_file.func("big.md", {"files": {"big.md": "otra\nversión"}}, 1, 1),
+                         "     2\tversión")
+
+    def test_lru_acotado(self):
+        """La caché descarta las entradas menos usadas"""
+        cache = FileIndexCache(max_entries=2)
+        contents = [f"archivo {i}" for i in range(3)]
+        first = cache.lines("0.md", contents[0])
+        cache.lines("1.md", contents[1])
+        cache.lines("2.md", contents[2])
+        self.assertIsNot(cache.lines("0.md", contents[0]), first)
+
+    def test_acotada_por_bytes(self):
+        """El total de contenido e índices no supera max_bytes"""
+        contents = ["x\n" * 1000 + str(i) for i in range(4)]
+        size = LineIndex(contents[0]).nbytes
+        cache = FileIndexCache(max_bytes=2 * size + size // 2)
+        indexes = [cache.lines(f"{i}.md", content) for i, content in enumerate(contents)]
+        self.assertLessEqual(cache.nbytes, cache.max_bytes)
+        self.assertIs(cache.lines("3.md", contents[3]), indexes[3])
+        self.assertIsNot(cache.lines("0.md", contents[0]), indexes[0])
+        # Un archivo mayor que el límite se indexa pero no se guarda
+        big = "y\n" * 10000
+        cache.lines("big.md", big)
+        self.assertIsNot(cache.lines("big.md", big), cache.lines("big.md", big))
+        cache.clear()
+        self.assertEqual(cache.nbytes, 0)
+
+    def test_invalidar_solo_la_version_reemplazada(self):
+        """Invalidar una ruta no descarta las versiones de otras conversaciones"""
+        cache = FileIndexCache()
+        mine, other = "mío\n" + "a", "ajeno\n" + "b"
+        cache.lines("notes.md", mine)
+        other_index = cache.lines("notes.md", other)
+        cache.invalidate("notes.md", mine)
+        self.assertIs(cache.lines("notes.md", other), other_index)
+        self.assertEqual(cache.nbytes, other_index.nbytes)
+        cache.invalidate("notes.md", None)
+
+
+class TestMultiEdit(unittest.TestCase):
+    def setUp(self):
+        self.state = {"files": {"informe.md": "# Título\nuno dos tres\nuno\nfin\n"}}
+
+    def _edit(self, edits):
+        return multi_edit.func("informe.md", edits, self.state, "call-1")
+
+    def test_aplica_todas_las_ediciones_de_una_vez(self):
+        """Las ediciones se aplican juntas sobre el contenido original y en un único delta"""
+        result = self._edit([
+            {"old_string": "# Título", "new_string": "# Informe"},
+            {"old_string": "uno", "new_string": "1", "replace_all": True},
+            {"old_string": "fin", "new_string": "uno"},
+        ])
+        self.assertEqual(result.update["files"], {"informe.md": "# Informe\n1 dos tres\n1\nuno\n"})
+        self.assertIn("3 edit(s) (4 replacement(s))", result.update["messages"][0].content)
+
+    def test_es_atomica(self):
+        """Si una edición no es válida no se aplica ninguna"""
+        result = self._edit([
+            {"old_string": "# Título", "new_string": "# Informe"},
+            {"old_string": "uno", "new_string": "1"},
+        ])
+        self.assertEqual(result, "Error: Edit 2: String 'uno' appears 2 times in file. Use replace_all=True to "
+                                 "replace all instances, or provide a more specific string with surrounding context.")
+        self.assertEqual(self._edit([{"old_string": "no existe", "new_string": "x"}]),
+                         "Error: Edit 1: String not found in file: 'no existe'")
+        self.assertIn("Edits 1 and 2 have the same old_string",
+                      self._edit([{"old_string": "fin", "new_string": "a"}, {"old_string": "fin", "new_string": "b"}]))
+        self.assertIn("Edit 2 overlaps", self._edit([
+            {"old_string": "dos tres", "new_string": "2 3"},
+            {"old_string": "tres", "new_string": "3"},
+        ]))
+        # Una coincidencia tapada por otra edición también es un solapamiento, aunque
+        # la misma cadena aparezca en otro sitio
+        self.state["files"]["solapes.md"] = "abcd\nbcd\n"
+        self.assertEqual(multi_edit.func("solapes.md", [
+            {"old_string": "abc", "new_string": "X"},
+            {"old_string": "bcd", "new_string": "Y"},
+        ], self.state, "call-1"), "Error: Edit 2 overlaps text matched by another edit: 'bcd'")
+        self.assertIn("Edit 2 overlaps", multi_edit.func("solapes.md", [
+            {"old_string": "abc", "new_string": "X"},
+            {"old_string": "bcd", "new_string": "Y", "replace_all": True},
+        ], self.state, "call-1"))
+        self.assertEqual(self.state["files"]["solapes.md"], "abcd\nbcd\n")
+        self.assertEqual(self.state["files"]["informe.md"], "# Título\nuno dos tres\nuno\nfin\n")
+
+    def test_la_mas_larga_gana_en_la_misma_posicion(self):
+        """Con old_string que empiezan igual se usa la coincidencia más larga"""
+        result = self._edit([
+            {"old_string": "uno\n", "new_string": "UNO\n"},
+            {"old_string": "uno dos", "new_string": "uno-dos"},
+        ])
+        self.assertEqual(result.update["files"]["informe.md"], "# Título\nuno-dos tres\nUNO\nfin\n")
+
+
+class TestGrepGlob(unittest.TestCase):
+    def setUp(self):
+        file_index.clear()
+        self.state = {"files": {
+            "notas.md": "uno\nTODO: revisar\ntres\ncuatro\ncinco\nTODO: citar fuentes\n",
+            "docs/informe.md": "# Informe\ntodo bien\n",
+            "docs/datos/tabla.txt": "a,b\nTODO,c\n",
+        }}
+
+    def test_grep_con_numeros_de_linea(self):
+        """grep devuelve solo las líneas que coinciden, con ruta y número de línea"""
+        self.assertEqual(grep.func("TODO", self.state), "\n".join([
+            "docs/datos/tabla.txt:2:TODO,c",
+            "notas.md:2:TODO: revisar",
+            "notas.md:6:TODO: citar fuentes",
+        ]))
+        self.assertEqual(grep.func("^todo", self.state, include="**/*.md", ignore_case=True).splitlines(),
+                         ["docs/informe.md:2:todo bien", "notas.md:2:TODO: revisar", "notas.md:6:TODO: citar fuentes"])
+        self.assertEqual(grep.func("no existe", self.state), "No matches found for pattern 'no existe'")
+        self.assertTrue(grep.func("(", self.state).startswith("Error: Invalid regex pattern"))
+
+    def test_grep_con_contexto_y_limite(self):
+        """El contexto agrupa las líneas cercanas y max_results corta la salida"""
+        self.assertEqual(grep.func("TODO", self.state, include="notas.md", context=1), "\n".join([
+            "notas.md-1-uno",
+            "notas.md:2:TODO: revisar",
+            "notas.md-3-tres",
+            "--",
+            "notas.md-5-cinco",
+            "notas.md:6:TODO: citar fuentes",
+        ]))
+        self.assertEqual(grep.func("o", self.state, include="notas.md", context=3).count("--"), 0)
+        limited = grep.func("TODO", self.state, max_results=2).splitlines()
+        self.assertEqual(limited[-1], "(showing the first 2 matching lines)")
+        self.assertEqual(len(limited), 3)
+
+    def test_glob(self):
+        """glob filtra rutas con * dentro de un segmento y ** entre directorios"""
+        self.assertEqual(glob.func("*.md", self.state), "notas.md")
+        self.assertEqual(glob.func("**/*.md", self.state), "docs/informe.md\nnotas.md")
+        self.assertEqual(glob.func("docs/**", self.state), "docs/datos/tabla.txt\ndocs/informe.md")
+        self.assertEqual(glob.func("*.csv", self.state), "No files match pattern '*.csv'")
+
+
+class TestLs(unittest.TestCase):
+    def setUp(self):
+        file_index.clear()
+        self.state = {"files": {}, "file_stats": {}}
+        for step, (path, content) in enumerate([
+            ("notas.md", "uno\ndos\n"),
+            ("docs/informe.md", "# Informe\nañadir\nfin"),
+            ("docs/datos.csv", "a,b\n" * 50),
+        ], 1):
+            update = write_file(path, content, self.state, f"call-{step}", {"metadata": {"langgraph_step": step}}).update
+            for channel in ("files", "file_stats"):
+                self.state[channel] = file_reducer(self.state[channel], update[channel])
+
+    def test_las_escrituras_guardan_estadisticas(self):
+        """Cada escritura añade al delta el tamaño, las líneas y el paso"""
+        self.assertEqual(self.state["file_stats"]["docs/informe.md"],
+                         {"size": 21, "lines": 3, "modified_step": 2})
+        update = edit_file.func("notas.md", "dos", "dos\ntres", self.state, "call-4",
+                                config={"metadata": {"langgraph_step": 7}}).update
+        self.assertEqual(update["file_stats"], {"notas.md": {"size": 13, "lines": 3, "modified_step": 7}})
+
+    def test_filtra_ordena_y_pagina(self):
+        """ls admite prefijo, glob, orden y paginación"""
+        self.assertEqual(ls.func(self.state).splitlines(), ["docs/datos.csv", "docs/informe.md", "notas.md"])
+        self.assertEqual(ls.func(self.state, path="docs/", pattern="**/*.md"), "docs/informe.md")
+        self.assertEqual(ls.func(self.state, sort_by="modified", reverse=True).splitlines(),
+                         ["docs/datos.csv", "docs/informe.md", "notas.md"])
+        self.assertEqual(ls.func(self.state, sort_by="size").splitlines()[0], "notas.md")
+        self.assertEqual(ls.func(self.state, limit=2).splitlines(), [
+            "docs/datos.csv", "docs/informe.md", "(showing 1-2 of 3 files; use offset=2 for more)",
+        ])
+        self.assertEqual(ls.func(self.state, offset=2, limit=2), "notas.md")
+        self.assertEqual(ls.func(self.state, offset=5), "Error: Offset 5 exceeds the number of files (3)")
+        self.assertEqual(ls.func(self.state, pattern="*.txt"), "No files found")
+
+    def test_detalles(self):
+        """Con details se muestran las estadísticas, calculándolas si faltan"""
+        self.assertEqual(ls.func(self.state, path="docs/datos", details=True),
+                         "docs/datos.csv\t200 bytes\t50 lines\tmodified at step 3")
+        state = {"files": {"entrada.md": "a\nb"}}
+        self.assertEqual(ls.func(state, details=True), "entrada.md\t3 bytes\t2 lines\tmodified at step -")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import os
+import tempfile
+import unittest
+
+from sqlalchemy import create_engine, inspect, text
+
+from migrations import BASELINE_SCHEMA, MIGRATIONS, pending_migrations, upgrade
+from models import decompress_content
+
+
+class TestMigrations(unittest.TestCase):
+    def setUp(self):
+        self.db_path = os.path.join(tempfile.mkdtemp(), "legacy.db")
+        self.engine = create_engine(f"sqlite:///{self.db_path}")
+
+    def tearDown(self):
+        self.engine.dispose()
+
+    def test_actualiza_una_base_de_datos_existente(self):
+        """Las migraciones añaden columnas e índices y rellenan los datos existentes"""
+        with self.engine.begin() as conn:
+            for ddl in BASELINE_SCHEMA:
+                conn.execute(text(ddl))
+            conn.execute(text("INSERT INTO threads (id, created_at, updated_at) VALUES ('t1', '2024-01-01', '2024-01-01')"))
+            conn.execute(text(
+                "INSERT INTO messages (id, thread_id, type, content, timestamp) VALUES "
+                "('m2', 't1', 'ai', '[{''type'': ''text'', ''text'': ''respuesta''}]', '2024-01-01 00:00:02'), "
+                "('m1', 't1', 'human', 'hola', '2024-01-01 00:00:01')"
+            ))
+            conn.execute(text(
+                "INSERT INTO thread_files (thread_id, filename, content) VALUES "
+                "('t1', 'a.md', 'viejo'), ('t1', 'a.md', 'nuevo'), ('t1', 'b.md', 'nuevo')"
+            ))
+            conn.execute(text(
+                "INSERT INTO thread_todos (thread_id, content, status) VALUES ('t1', 'uno', 'pending'), ('t1', 'dos', 'pending')"
+            ))
+
+        with self.engine.begin() as conn:
+            applied = upgrade(conn)
+        self.assertEqual(applied, [migration.version for migration in MIGRATIONS])
+
+        indexes = {index["name"] for index in inspect(self.engine).get_indexes("messages")}
+        self.assertIn("ix_messages_thread_seq", indexes)
+        todo_indexes = {index["name"] for index in inspect(self.engine).get_indexes("thread_todos")}
+        self.assertIn("ix_thread_todos_thread_position", todo_indexes)
+        file_indexes = {index["name"]: index for index in inspect(self.engine).get_indexes("thread_files")}
+        self.assertTrue(file_indexes["ix_thread_files_thread_filename"]["unique"])
+
+        with self.engine.connect() as conn:
+            rows = conn.execute(text("SELECT id, seq, display_text FROM messages ORDER BY seq")).all()
+            message_seq = conn.execute(text("SELECT message_seq FROM threads")).scalar()
+            files = conn.execute(text("SELECT filename, content, content_hash FROM thread_files ORDER BY filename")).all()
+            blobs = conn.execute(text("SELECT hash, codec, data, ref_count FROM file_blobs")).all()
+            todos = conn.execute(text("SELECT content, position FROM thread_todos ORDER BY position")).all()
+            self.assertEqual(pending_migrations(conn), [])
+        self.assertEqual([tuple(row) for row in rows], [("m1", 1, "hola"), ("m2", 2, "respuesta")])
+        self.assertEqual(message_seq, 2)
+        # Los archivos duplicados se reducen al más reciente y el contenido pasa a un único blob
+        self.assertEqual([(f.filename, f.content) for f in files], [("a.md", None), ("b.md", None)])
+        self.assertEqual(len(blobs), 1)
+        self.assertEqual(files[0].content_hash, blobs[0].hash)
+        self.assertEqual(decompress_content(blobs[0].codec, blobs[0].data), "nuevo")
+        self.assertEqual(blobs[0].ref_count, 2)
+        self.assertEqual([tuple(row) for row in todos], [("uno", 0), ("dos", 1)])
+
+        # Volver a ejecutar no aplica nada
+        with self.engine.begin() as conn:
+            self.assertEqual(upgrade(conn), [])
+
+    def test_base_de_datos_nueva(self):
+        """En una base vacía se crean las tablas y se marcan todas las migraciones"""
+        with self.engine.begin() as conn:
+            upgrade(conn)
+        with self.engine.connect() as conn:
+            plan = conn.execute(text(
+                "EXPLAIN QUERY PLAN SELECT * FROM thread_todos WHERE thread_id = 't1'"
+            )).all()
+            self.assertEqual(pending_migrations(conn), [])
+        self.assertIn("ix_thread_todos_thread_position", " ".join(str(row[-1]) for row in plan))
+
+
+if __name__ == '__main__':
+    unittest.main()
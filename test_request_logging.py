@@ -0,0 +1,128 @@
+import asyncio
+import os
+import tempfile
+import unittest
+
+from request_logging import RequestLoggingMiddleware, redact_headers
+
+
+class RecordingLogger:
+    """Logger falso que guarda (nivel, evento, campos)"""
+
+    def __init__(self):
+        self.records = []
+
+    def _log(self, level):
+        def log(event, **fields):
+            self.records.append((level, event, fields))
+        return log
+
+    def __getattr__(self, level):
+        return self._log(level)
+
+
+def make_app(status=200, body=b"ok", delay=0.0, fail=False):
+    async def app(scope, receive, send):
+        while True:
+            message = await receive()
+            if not message.get("more_body"):
+                break
+        if delay:
+            await asyncio.sleep(delay)
+        if fail:
+            raise RuntimeError("fallo")
+        await send({"type": "http.response.start", "status": status, "headers": []})
+        await send({"type": "http.response.body", "body": body})
+    return app
+
+
+async def call(middleware, body=b"", headers=None):
+    chunks = [body[:5], body[5:]] if body else [b""]
+    messages = [
+        {"type": "http.request", "body": chunk, "more_body": i < len(chunks) - 1}
+        for i, chunk in enumerate(chunks)
+    ]
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        pass
+
+    scope = {
+        "type": "http", "method": "POST", "path": "/chat",
+        "headers": headers or [], "client": ("127.0.0.1", 1234),
+    }
+    await middleware(scope, receive, send)
+
+
+class TestRedactHeaders(unittest.TestCase):
+    def test_oculta_credenciales(self):
+        """Las cabeceras con credenciales se reemplazan por [REDACTED]"""
+        headers = redact_headers([
+            (b"Authorization", b"Bearer secreto"),
+            (b"x-custom-token", b"abc"),
+            (b"cookie", b"s=1"),
+            (b"content-type", b"application/json"),
+        ])
+        self.assertEqual(headers["authorization"], "[REDACTED]")
+        self.assertEqual(headers["x-custom-token"], "[REDACTED]")
+        self.assertEqual(headers["cookie"], "[REDACTED]")
+        self.assertEqual(headers["content-type"], "application/json")
+
+
+class TestRequestLoggingMiddleware(unittest.IsolatedAsyncioTestCase):
+    def _middleware(self, app, **kwargs):
+        middleware = RequestLoggingMiddleware(app, **kwargs)
+        middleware.logger = RecordingLogger()
+        return middleware
+
+    async def test_preview_del_body_limitado(self):
+        """El preview del body respeta max_body_bytes y marca si se truncó"""
+        middleware = self._middleware(make_app(), sample_rate=1.0, body_sample_rate=1.0, max_body_bytes=4)
+        await call(middleware, body=b"0123456789", headers=[(b"authorization", b"Bearer x")])
+
+        level, event, fields = middleware.logger.records[0]
+        self.assertEqual(level, "info")
+        self.assertEqual(fields["body_preview"], "0123")
+        self.assertTrue(fields["body_truncated"])
+        self.assertEqual(fields["request_bytes"], 10)
+        self.assertEqual(fields["headers"]["authorization"], "[REDACTED]")
+
+    async def test_sin_muestreo_no_registra_ni_captura_body(self):
+        """Una petición normal no muestreada no genera log"""
+        middleware = self._middleware(make_app(), sample_rate=0.0, body_sample_rate=1.0)
+        await call(middleware, body=b"hola")
+        self.assertEqual(middleware.logger.records, [])
+
+    async def test_errores_y_lentas_se_registran_siempre(self):
+        """Los 5xx, las excepciones y las peticiones lentas se registran aunque no estén muestreadas"""
+        middleware = self._middleware(make_app(status=503), sample_rate=0.0)
+        await call(middleware)
+        self.assertEqual(middleware.logger.records[0][0], "error")
+        self.assertEqual(middleware.logger.records[0][2]["status"], 503)
+
+        middleware = self._middleware(make_app(fail=True), sample_rate=0.0)
+        with self.assertRaises(RuntimeError):
+            await call(middleware)
+        self.assertEqual(middleware.logger.records[0][2]["status"], 500)
+
+        middleware = self._middleware(make_app(delay=0.02), sample_rate=0.0, slow_request_seconds=0.01)
+        await call(middleware)
+        level, _, fields = middleware.logger.records[0]
+        self.assertEqual(level, "warning")
+        self.assertNotIn("body_preview", fields)
+
+
+class TestMiddlewareOrder(unittest.TestCase):
+    def test_logging_es_el_middleware_mas_externo(self):
+        """El logging envuelve a CORS, así que también registra los preflight"""
+        os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'test_logging.db')}")
+        os.environ.setdefault("ANTHROPIC_API_KEY", "test")
+        import agent as agent_module
+
+        self.assertIs(agent_module.app.user_middleware[0].cls, RequestLoggingMiddleware)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+import asyncio
+import unittest
+
+from scheduler import RunScheduler, SchedulerFullError, ThreadRunLocks, ThreadBusyError
+
+
+class TestRunScheduler(unittest.IsolatedAsyncioTestCase):
+    async def test_limita_concurrencia_en_orden_fifo(self):
+        """Solo max_concurrent ejecuciones a la vez y la cola se atiende en orden"""
+        scheduler = RunScheduler(max_concurrent=2, max_queue=10, queue_timeout=5)
+        order = []
+        running = 0
+        peak = 0
+
+        async def run(i):
+            nonlocal running, peak
+            async with scheduler.slot():
+                running += 1
+                peak = max(peak, running)
+                order.append(i)
+                await asyncio.sleep(0.01)
+                running -= 1
+
+        await asyncio.gather(*(run(i) for i in range(6)))
+
+        self.assertEqual(peak, 2)
+        self.assertEqual(order, list(range(6)))
+        self.assertEqual(scheduler.stats()["active_runs"], 0)
+        self.assertEqual(scheduler.stats()["admitted_total"], 6)
+
+    async def test_rechaza_cuando_la_cola_esta_llena(self):
+        """Con la cola llena se rechaza de inmediato con 429 y Retry-After"""
+        scheduler = RunScheduler(max_concurrent=1, max_queue=1, queue_timeout=5)
+        first = await scheduler.acquire()
+        queued = asyncio.ensure_future(scheduler.acquire())
+        await asyncio.sleep(0)
+
+        with self.assertRaises(SchedulerFullError) as ctx:
+            await scheduler.acquire()
+        self.assertEqual(ctx.exception.status_code, 429)
+        self.assertGreaterEqual(ctx.exception.retry_after, 1)
+        self.assertEqual(scheduler.stats()["queue_depth"], 1)
+
+        first.release()
+        second = await queued
+        second.release()
+        self.assertEqual(scheduler.stats()["active_runs"], 0)
+
+    async def test_timeout_en_cola(self):
+        """Si la espera supera queue_timeout se responde 503 y no se pierde el slot"""
+        scheduler = RunScheduler(max_concurrent=1, max_queue=5, queue_timeout=0.01)
+        ticket = await scheduler.acquire()
+
+        with self.assertRaises(SchedulerFullError) as ctx:
+            await scheduler.acquire()
+        self.assertEqual(ctx.exception.status_code, 503)
+
+        ticket.release()
+        ticket.release()  # Liberar dos veces no debe descuadrar el contador
+        stats = scheduler.stats()
+        self.assertEqual(stats["active_runs"], 0)
+        self.assertEqual(stats["queue_depth"], 0)
+        self.assertEqual(stats["timed_out_total"], 1)
+
+
+class TestThreadRunLocks(unittest.IsolatedAsyncioTestCase):
+    async def test_serializa_ejecuciones_del_mismo_thread(self):
+        """Dos mensajes en el mismo thread no se ejecutan en paralelo; threads distintos sí"""
+        locks = ThreadRunLocks(max_pending=2)
+        events = []
+
+        async def run(thread_id, name):
+            ticket = await locks.acquire(thread_id)
+            try:
+                events.append(f"start-{name}")
+                await asyncio.sleep(0.01)
+                events.append(f"end-{name}")
+            finally:
+                ticket.release()
+
+        await asyncio.gather(run("t1", "a"), run("t1", "b"), run("t2", "c"))
+
+        self.assertLess(events.index("end-a"), events.index("start-b"))
+        self.assertLess(events.index("start-c"), events.index("end-a"))
+        self.assertEqual(locks.stats()["busy_threads"], 0)
+
+    async def test_rechaza_si_esta_ocupado_o_la_cola_esta_llena(self):
+        """Modo reject devuelve 409 de inmediato; en modo cola se respeta max_pending"""
+        locks = ThreadRunLocks(max_pending=1)
+        first = await locks.acquire("t1")
+
+        with self.assertRaises(ThreadBusyError) as ctx:
+            await locks.acquire("t1", reject_if_busy=True)
+        self.assertEqual(ctx.exception.status_code, 409)
+
+        queued = asyncio.ensure_future(locks.acquire("t1"))
+        await asyncio.sleep(0)
+        with self.assertRaises(ThreadBusyError):
+            await locks.acquire("t1")
+
+        first.release()
+        second = await queued
+        self.assertTrue(locks.is_busy("t1"))
+        second.release()
+        self.assertFalse(locks.is_busy("t1"))
+
+
+if __name__ == '__main__':
+    unittest.main()
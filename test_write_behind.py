@@ -0,0 +1,120 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+# Base de datos temporal: debe configurarse antes de importar database
+os.environ.setdefault("DATABASE_URL", os.getenv("TEST_DATABASE_URL")
+                      or f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'test_threads.db')}")
+
+from database import ThreadService, async_init_database, dispose_engines  # noqa: E402
+from write_behind import WriteBehindQueue  # noqa: E402
+
+
+def _run(prefix: str, n: int = 2) -> list:
+    return [{"id": f"{prefix}-m{i}", "type": "human" if i % 2 == 0 else "ai", "content": f"mensaje {i}"}
+            for i in range(n)]
+
+
+class TestWriteBehindQueue(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        await async_init_database()
+        self.queue = WriteBehindQueue(enabled=True, max_queue=100, batch_size=10)
+        self.queue.start()
+
+    async def asyncTearDown(self):
+        await self.queue.stop()
+        await dispose_engines()
+
+    async def test_encola_y_superpone_lo_pendiente(self):
+        """add_messages vuelve sin guardar y pending_view muestra lo encolado hasta guardarlo"""
+        messages = await self.queue.add_messages(
+            "wb-1", _run("wb-1"), todos_list=[{"content": "t", "status": "pending", "activeForm": "t"}],
+            files_dict={"a.md": "a"}
+        )
+        self.assertEqual([m.id for m in messages], ["wb-1-m0", "wb-1-m1"])
+
+        view = self.queue.pending_view("wb-1")
+        self.assertEqual([m.id for m in view["messages"]], ["wb-1-m0", "wb-1-m1"])
+        self.assertEqual(view["files"], {"a.md": "a"})
+
+        await self.queue.wait_for_thread("wb-1")
+        self.assertEqual(self.queue.pending_view("wb-1")["messages"], [])
+        thread = await ThreadService.get_thread("wb-1")
+        self.assertEqual([m.seq for m in thread.messages], [1, 2])
+        self.assertEqual([t.content for t in thread.todos], ["t"])
+
+    async def test_agrupa_escrituras_en_lotes(self):
+        """Las ejecuciones encoladas a la vez se guardan en una sola transacción"""
+        for i in range(5):
+            await self.queue.add_messages(f"wb-batch-{i % 2}", _run(f"wb-batch-{i}"))
+        await self.queue.flush()
+
+        stats = self.queue.stats()
+        self.assertEqual(stats["written"], 5)
+        self.assertEqual(stats["batches"], 1)
+        self.assertEqual(stats["pending_runs"], 0)
+        thread = await ThreadService.get_thread("wb-batch-0")
+        self.assertEqual([m.seq for m in thread.messages], list(range(1, 7)))
+
+    async def test_una_ejecucion_fallida_no_descarta_el_lote(self):
+        """Si una ejecución falla se guardan las demás y se cuenta como fallida"""
+        await self.queue.add_messages("wb-fail", _run("wb-dup", 1))
+        await self.queue.add_messages("wb-fail", _run("wb-dup", 1))
+        await self.queue.add_messages("wb-ok", _run("wb-ok"))
+        await self.queue.flush()
+
+        stats = self.queue.stats()
+        self.assertEqual((stats["written"], stats["failed"]), (2, 1))
+        self.assertIsNotNone(await ThreadService.get_thread("wb-ok"))
+
+    async def test_stop_guarda_lo_pendiente(self):
+        """Al detenerse se guarda todo lo encolado"""
+        await self.queue.add_messages("wb-stop", _run("wb-stop"))
+        await self.queue.stop()
+        self.assertFalse(self.queue.running)
+        thread = await ThreadService.get_thread("wb-stop")
+        self.assertEqual(len(thread.messages), 2)
+
+    async def test_cancelar_con_la_cola_llena_no_deja_pendientes(self):
+        """Si se cancela una ejecución que espera sitio en la cola no queda nada pendiente"""
+        await self.queue.stop()
+        self.queue = WriteBehindQueue(enabled=True, max_queue=1, batch_size=1)
+        self.queue.start()
+        release = asyncio.Event()
+        original_add_runs = ThreadService.add_runs
+
+        async def slow_add_runs(runs):
+            await release.wait()
+            return await original_add_runs(runs)
+
+        with mock.patch.object(ThreadService, "add_runs", slow_add_runs):
+            await self.queue.add_messages("wb-full-1", _run("wb-full-1"))
+            await asyncio.sleep(0)  # la escritora toma la primera y se bloquea
+            await self.queue.add_messages("wb-full-2", _run("wb-full-2"))  # llena la cola
+            blocked = asyncio.ensure_future(self.queue.add_messages("wb-full-3", _run("wb-full-3")))
+            await asyncio.sleep(0)
+            blocked.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await blocked
+
+            self.assertEqual(self.queue.pending_view("wb-full-3")["messages"], [])
+            await asyncio.wait_for(self.queue.wait_for_thread("wb-full-3"), timeout=1)
+            release.set()
+            await self.queue.flush()
+
+        self.assertEqual(self.queue.stats()["written"], 2)
+        self.assertIsNone(await ThreadService.get_thread("wb-full-3"))
+
+    async def test_desactivada_escribe_directamente(self):
+        """Sin write-behind add_messages guarda antes de volver"""
+        queue = WriteBehindQueue(enabled=False)
+        queue.start()
+        messages = await queue.add_messages("wb-direct", _run("wb-direct"))
+        self.assertEqual([m.seq for m in messages], [1, 2])
+        self.assertEqual(queue.stats()["enqueued"], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,218 @@
+"""
+Persistencia write-behind (opcional) de las ejecuciones del agente
+"""
+import asyncio
+import os
+import time
+from collections import deque
+from datetime import datetime
+from typing import Any, Deque, Dict, List, Optional
+
+from database import ThreadService
+from models import Message
+
+
+class PendingRun:
+    """Ejecución encolada pendiente de guardar"""
+
+    def __init__(self, thread_id: str, messages_data: List[Dict[str, Any]],
+                 todos_list: Optional[List[Dict[str, Any]]], files_dict: Optional[Dict[str, str]],
+                 messages: List[Message]):
+        self.thread_id = thread_id
+        self.messages_data = messages_data
+        self.todos_list = todos_list
+        self.files_dict = files_dict
+        self.messages = messages
+        self.enqueued_at = time.monotonic()
+        self.done = asyncio.get_running_loop().create_future()
+
+    def as_run(self) -> tuple:
+        return (self.thread_id, self.messages_data, self.todos_list, self.files_dict)
+
+
+class WriteBehindQueue:
+    """
+    Cola acotada de ejecuciones a persistir que vacía una única tarea escritora en
+    transacciones agrupadas, para que /chat responda sin esperar a la base de datos.
+
+    Lectura de lo propio escrito: pending_view() devuelve lo que sigue en la cola de un
+    thread para superponerlo a lo ya guardado, y wait_for_thread() espera a que se guarde
+    (para las lecturas con versiones, como los deltas). Desactivada, add_messages escribe
+    directamente con ThreadService.add_messages.
+    """
+
+    def __init__(self, enabled: bool = False, max_queue: int = 1000, batch_size: int = 50):
+        self.enabled = enabled
+        self.max_queue = max(1, max_queue)
+        self.batch_size = max(1, batch_size)
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._pending: Dict[str, Deque[PendingRun]] = {}
+
+        # Métricas
+        self._enqueued = 0
+        self._written = 0
+        self._failed = 0
+        self._batches = 0
+        self._last_batch_size = 0
+        self._last_lag: Optional[float] = None
+        self._max_lag = 0.0
+        self._last_error: Optional[str] = None
+
+    @classmethod
+    def from_env(cls) -> "WriteBehindQueue":
+        return cls(
+            enabled=os.getenv("WRITE_BEHIND_ENABLED", "false").lower() in ("1", "true", "yes"),
+            max_queue=int(os.getenv("WRITE_BEHIND_MAX_QUEUE", "1000")),
+            batch_size=int(os.getenv("WRITE_BEHIND_BATCH_SIZE", "50")),
+        )
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        """Arrancar la tarea escritora (solo si está activada)"""
+        if not self.enabled or self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._task = asyncio.create_task(self._writer())
+        print(f"Write-behind activado: cola de {self.max_queue}, lotes de {self.batch_size}")
+
+    async def stop(self):
+        """Guardar todo lo encolado y detener la tarea escritora"""
+        if self._task is None:
+            return
+        await self.flush()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def flush(self):
+        """Esperar a que se haya guardado todo lo encolado"""
+        if self.running:
+            await self._queue.join()
+
+    async def add_messages(self, thread_id: str, messages_data: List[Dict[str, Any]],
+                           todos_list: Optional[List[Dict[str, Any]]] = None,
+                           files_dict: Optional[Dict[str, str]] = None) -> List[Message]:
+        """
+        Igual que ThreadService.add_messages, pero con write-behind activo solo encola la
+        ejecución (esperando si la cola está llena) y devuelve los mensajes sin guardar
+        """
+        if not self.running:
+            return await ThreadService.add_messages(thread_id, messages_data, todos_list, files_dict)
+
+        now = datetime.utcnow()
+        messages = [
+            Message(
+                id=message_data.get("id"),
+                thread_id=thread_id,
+                type=message_data.get("type"),
+                content=message_data.get("content"),
+                tool_calls=message_data.get("tool_calls"),
+                tool_call_id=message_data.get("tool_call_id"),
+                timestamp=now
+            )
+            for message_data in messages_data
+        ]
+        run = PendingRun(thread_id, messages_data, todos_list, files_dict, messages)
+        # Registrar la ejecución solo cuando ya está en la cola: si se cancela la espera
+        # con la cola llena no debe quedar un pendiente que nunca se resuelva. Después de
+        # put() no se cede el loop, así que la tarea escritora no la ve antes del registro
+        await self._queue.put(run)
+        self._pending.setdefault(thread_id, deque()).append(run)
+        self._enqueued += 1
+        return messages
+
+    def pending_view(self, thread_id: str) -> Dict[str, Any]:
+        """
+        Lo que sigue en la cola para un thread: mensajes sin guardar y, si alguna ejecución
+        pendiente los reemplaza, los últimos todos y archivos
+        """
+        view = {"messages": [], "todos": None, "files": None}
+        for run in self._pending.get(thread_id, ()):
+            view["messages"].extend(run.messages)
+            if run.todos_list is not None:
+                view["todos"] = run.todos_list
+            if run.files_dict is not None:
+                view["files"] = run.files_dict
+        return view
+
+    async def wait_for_thread(self, thread_id: str):
+        """Esperar a que se guarden las ejecuciones encoladas de un thread"""
+        pending = [run.done for run in self._pending.get(thread_id, ())]
+        if pending:
+            await asyncio.gather(*(asyncio.shield(done) for done in pending))
+
+    async def _writer(self):
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except asyncio.QueueEmpty:
+                    break
+            try:
+                await self._write_batch(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _write_batch(self, batch: List[PendingRun]):
+        try:
+            await ThreadService.add_runs([run.as_run() for run in batch])
+            failed = []
+        except Exception as e:
+            # Reintentar una a una para que una ejecución con errores no descarte el lote
+            print(f"❌ Error guardando lote write-behind ({len(batch)} ejecuciones): {e}")
+            failed = []
+            for run in batch:
+                try:
+                    await ThreadService.add_runs([run.as_run()])
+                except Exception as run_error:
+                    failed.append(run)
+                    self._last_error = str(run_error)
+                    print(f"❌ Ejecución descartada en thread {run.thread_id}: {run_error}")
+
+        now = time.monotonic()
+        self._batches += 1
+        self._last_batch_size = len(batch)
+        self._written += len(batch) - len(failed)
+        self._failed += len(failed)
+        self._last_lag = now - batch[0].enqueued_at
+        self._max_lag = max(self._max_lag, self._last_lag)
+        for run in batch:
+            pending = self._pending.get(run.thread_id)
+            if pending and run in pending:
+                pending.remove(run)
+                if not pending:
+                    del self._pending[run.thread_id]
+            if not run.done.done():
+                run.done.set_result(run not in failed)
+
+    def stats(self) -> Dict[str, Any]:
+        """Métricas de la cola para /health"""
+        oldest = min((pending[0].enqueued_at for pending in self._pending.values() if pending), default=None)
+        return {
+            "enabled": self.enabled,
+            "running": self.running,
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "pending_runs": sum(len(pending) for pending in self._pending.values()),
+            "lag_ms": round((time.monotonic() - oldest) * 1000, 2) if oldest is not None else 0,
+            "last_batch_lag_ms": round(self._last_lag * 1000, 2) if self._last_lag is not None else None,
+            "max_lag_ms": round(self._max_lag * 1000, 2),
+            "enqueued": self._enqueued,
+            "written": self._written,
+            "failed": self._failed,
+            "batches": self._batches,
+            "last_batch_size": self._last_batch_size,
+            "last_error": self._last_error,
+        }
+
+
+write_behind = WriteBehindQueue.from_env()